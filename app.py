@@ -1,4 +1,4 @@
-# app.py (Versio 23.0 - Parannettu aggressiivinen TILA C ja dynaaminen puskuri)
+# app.py (Versio 31.4 - Rinnakkaiset osiot valinnaisiksi)
 import logging
 import re
 import time
@@ -6,17 +6,28 @@ from collections import defaultdict
 from io import BytesIO
 
 import docx
-import ollama
 import streamlit as st
 import streamlit.components.v1 as components
 from logic import (
+    ARVIOINTI_MALLI_VARAMALLI,
+    ARVIOINTI_RINNAKKAISUUS,
+    ASIANTUNTIJA_MALLI,
+    OSIO_RINNAKKAISUUS,
     STRATEGIA_SANAKIRJA,
+    TarkennushaunEnnakointi,
+    aloita_esilataus,
+    arvioi_kunnes_riittaa,
     arvioi_tulokset,
     ehdota_uutta_strategiaa,
+    esilataa_mallit,
     etsi_merkityksen_mukaan,
+    etsi_merkityksen_mukaan_monta,
     etsi_puhtaalla_haulla,
-    lataa_resurssit,
+    hae_ollama_asiakas,
+    kirjaa_json_kutsutilastot,
     luo_kontekstisidonnainen_avainsana,
+    poimi_tehostesanat,
+    suorita_osiot,
     suorita_tarkennushaku,
     tallenna_uusi_strategia,
 )
@@ -87,7 +98,7 @@ class StreamlitLogHandler(logging.Handler):
 def hae_asennetut_mallit():
     """Hakee ja palauttaa listan asennetuista Ollama-malleista."""
     try:
-        models_data = ollama.list()
+        models_data = hae_ollama_asiakas().list()
         valid_models = [
             model['model'] for model in models_data.get('models', [])
             if 'model' in model
@@ -214,8 +225,10 @@ def luo_raportti_doc(sl, jae_kartta, arvosanat):
 # --- Streamlit-käyttöliittymä ---
 st.title("📚 Raamattu-tutkija v5 (Asiantuntija-asetuksin)")
 
-with st.spinner("Valmistellaan hakukonetta..."):
-    lataa_resurssit()
+# Mallit ja indeksit ladataan taustasäikeessä, joten asetuksia voi muokata latauksen aikana
+hakukone_valmis = aloita_esilataus()
+if not hakukone_valmis.is_set():
+    st.info("Hakukonetta valmistellaan taustalla. Voit täyttää asetukset sillä välin.")
 
 if 'processing_complete' not in st.session_state:
     st.session_state.processing_complete = False
@@ -255,6 +268,28 @@ with col2:
             index=asennetut_mallit.index(default_model) if default_model and default_model in asennetut_mallit else 0,
             help="Valitse Ollamaan asennettu malli tulosten arviointiin."
         )
+        # Valittu malli, varamalli ja asiantuntijamalli ladataan muistiin taustalla jo ennen hakua
+        esilataa_mallit(tuple(
+            malli for malli in dict.fromkeys([valittu_malli, ARVIOINTI_MALLI_VARAMALLI, ASIANTUNTIJA_MALLI])
+            if malli in asennetut_mallit
+        ))
+        arvioinnin_rinnakkaisuus = st.number_input(
+            "Rinnakkaiset arviointipyynnöt:",
+            min_value=1, max_value=16, value=ARVIOINTI_RINNAKKAISUUS, step=1,
+            help=(
+                "Kuinka monta jaetta arvioidaan samanaikaisesti. Kannattaa "
+                "asettaa Ollaman OLLAMA_NUM_PARALLEL-arvon suuruiseksi."
+            )
+        )
+        osioiden_rinnakkaisuus = st.number_input(
+            "Rinnakkain käsiteltävät osiot:",
+            min_value=1, max_value=8, value=OSIO_RINNAKKAISUUS, step=1,
+            help=(
+                "Kuinka monta osiota haetaan, arvioidaan ja parannetaan "
+                "samanaikaisesti. Raportin järjestys pysyy samana, mutta "
+                "lokirivit sekoittuvat, kun arvo on suurempi kuin 1."
+            )
+        )
         ydinjakeiden_minimi = st.number_input(
             "Ydinjakeiden minimimäärä (TILA A):",
             min_value=2, max_value=10, value=3, step=1,
@@ -321,9 +356,8 @@ if koko_syote:
                 st.markdown(f"**Osio {osio_nro}:** *{otsikko.split(':')[0]}*")
 
                 with st.form(key=f"form_{osio_nro}"):
-                    _, tunnistetut_sanat = etsi_merkityksen_mukaan(
-                        haku, otsikko, top_k=0
-                    )
+                    # Pelkkä sanapoiminta (muistissa otsikoittain): ei mallikutsuja eikä hakua
+                    tunnistetut_sanat = poimi_tehostesanat(otsikko)
                     kaikki_vaihtoehdot = sorted(
                         list(tunnistetut_sanat |
                              st.session_state.tehostesanat.get(osio_nro, set()))
@@ -361,6 +395,9 @@ if suorita_nappi:
     if not koko_syote:
         st.warning("Syötä aihe ja rakenne.")
     else:
+        if not hakukone_valmis.is_set():
+            with st.spinner("Odotetaan hakukoneen valmistumista..."):
+                hakukone_valmis.wait()
         logger = setup_logger()
         log_container = st.expander("Näytä prosessin loki", expanded=True)
         components.html(auto_scroll_js(), height=0)
@@ -390,31 +427,41 @@ if suorita_nappi:
             ui_pakota_tila_c = st.session_state.get('pakota_tila_c_checkbox', False)
             ui_maksimi_iteraatiot = maksimi_iteraatiot
 
-            for i, (osio_nro, haku) in enumerate(sorted_hakulauseet):
+            tehostesanat = dict(st.session_state.tehostesanat)
+
+            # Kaikkien osioiden alkuhaku yhdellä koodauksella, FAISS-haulla ja cross-encoder-kutsulla
+            log_container.markdown("--- \n ### Haetaan kaikkien osioiden ehdokasjakeet")
+            alkuhaut = dict(zip(
+                (osio_nro for osio_nro, _ in sorted_hakulauseet),
+                etsi_merkityksen_mukaan_monta(
+                    [(haku, otsikot.get(osio_nro, '')) for osio_nro, haku in sorted_hakulauseet],
+                    top_k=top_k_valinta,
+                    valitut_tehostesanat=[
+                        tehostesanat.get(osio_nro, set())
+                        for osio_nro, _ in sorted_hakulauseet
+                    ]
+                )
+            ))
+            log_performance_stats(perf_writer, perf_file)
+
+            def kasittele_osio(osio_nro, haku):
+                """Hakee, arvioi ja parantaa yhden osion jakeet; palauttaa (jakeet, keskiarvo)."""
                 log_container.markdown(
-                    f"--- \n ### Käsitellään osiota "
-                    f"{i+1}/{len(sorted_hakulauseet)}: "
+                    f"--- \n ### Käsitellään osiota {osio_nro}: "
                     f"{otsikot.get(osio_nro, '')}"
                 )
 
                 musta_lista_viitteet = set()
                 log_performance_stats(perf_writer, perf_file)
 
-                valitut_tehostesanat_osiolle = (
-                    st.session_state.tehostesanat.get(osio_nro, set())
-                )
-                tulokset, _ = etsi_merkityksen_mukaan(
-                    haku,
-                    otsikot.get(osio_nro, ''),
-                    top_k=top_k_valinta,
-                    valitut_tehostesanat=valitut_tehostesanat_osiolle
-                )
+                tulokset, _ = alkuhaut[osio_nro]
 
                 musta_lista_viitteet.update(t['viite'] for t in tulokset)
                 log_performance_stats(perf_writer, perf_file)
 
                 arvio = arvioi_tulokset(
-                    haku, tulokset, malli_nimi=valittu_malli
+                    haku, tulokset, malli_nimi=valittu_malli,
+                    rinnakkaisuus=arvioinnin_rinnakkaisuus
                 )
                 log_performance_stats(perf_writer, perf_file)
 
@@ -425,7 +472,7 @@ if suorita_nappi:
                     final_tulokset = etsi_puhtaalla_haulla(
                         haku, top_k=top_k_valinta
                     )
-                    arvio = arvioi_tulokset(haku, final_tulokset, malli_nimi=valittu_malli)
+                    arvio = arvioi_tulokset(haku, final_tulokset, malli_nimi=valittu_malli, rinnakkaisuus=arvioinnin_rinnakkaisuus)
                     for jae in final_tulokset:
                         vastaava = next((a for a in arvio.get("jae_arviot", []) if a.get('viite') == jae['viite']), None)
                         if vastaava:
@@ -447,7 +494,7 @@ if suorita_nappi:
                 lopputulos_keskiarvo = alkuperainen_keskiarvo
                 logging.info(f"Alkuperäinen laatuarvio: {alkuperainen_keskiarvo:.2f}/10")
 
-                log_container.markdown("--- \n #### Taso 2: Dynaaminen Parannusalgoritmi")
+                log_container.markdown(f"--- \n #### Osio {osio_nro} – Taso 2: Dynaaminen Parannusalgoritmi")
 
                 dynaaminen_raja_arvo = alkuperainen_keskiarvo
                 ydinjakeet = [t for t in final_tulokset if t.get('arvosana', 0) >= dynaaminen_raja_arvo]
@@ -460,8 +507,14 @@ if suorita_nappi:
                     haettava_maara = max(10, min(50, len(heikot) * aggressiivisuus_kerroin))
                     uudet_ehdokkaat = suorita_tarkennushaku(ydinjakeet, musta_lista_viitteet, haettava_maara)
                     if uudet_ehdokkaat:
-                        musta_lista_viitteet.update(t['viite'] for t in uudet_ehdokkaat)
-                        uudet_arviot = arvioi_tulokset(haku, uudet_ehdokkaat, malli_nimi=valittu_malli).get("jae_arviot", [])
+                        # Arviointi lopetetaan, kun arvioiduilla ehdokkailla saavutetaan laatutavoite
+                        tarvittava_nousu = ui_laatutavoite * len(final_tulokset) - sum(t.get('arvosana', 0) for t in final_tulokset)
+                        uudet_arviot = arvioi_kunnes_riittaa(
+                            haku, uudet_ehdokkaat, [t.get('arvosana', 0) for t in heikot], tarvittava_nousu,
+                            malli_nimi=valittu_malli, rinnakkaisuus=arvioinnin_rinnakkaisuus
+                        )
+                        # Vain arvioidut mustalle listalle: arvioimatta jääneet voivat löytyä myöhemmissä hauissa
+                        musta_lista_viitteet.update(a['viite'] for a in uudet_arviot)
                         for jae in uudet_ehdokkaat:
                             vastaava = next((a for a in uudet_arviot if a.get('viite') == jae['viite']), None)
                             if vastaava:
@@ -501,97 +554,116 @@ if suorita_nappi:
                     if ui_pakota_tila_c and not tila_a_ehdot_taynna:
                         logging.warning("TILA C (PAKOTETTU): Ohitetaan TILA B ja siirrytään suoraan iteratiiviseen parannukseen.")
                     
-                    log_container.markdown(f"--- \n #### Taso 3: Laadun Tavoittelu (Tavoite: {ui_laatutavoite:.2f})")
+                    log_container.markdown(f"--- \n #### Osio {osio_nro} – Taso 3: Laadun Tavoittelu (Tavoite: {ui_laatutavoite:.2f})")
                     logging.info(f"LÄHTÖTILANNE TILA C: Keskiarvo {lopputulos_keskiarvo:.2f}/{ui_laatutavoite:.2f}")
                     
                     # KORJATTU: Aggressiivinen tila ohittaa iteraatiorajan
                     iteraatioraja = 100 if ui_pakota_tila_c else ui_maksimi_iteraatiot
                     iteraatio = 0
-                    while (lopputulos_keskiarvo < ui_laatutavoite and iteraatio < iteraatioraja):
-                        iteraatio += 1
-                        logging.info(f"Käynnistetään TILA C -parannusyritys {iteraatio}...")
+                    ennakointi = TarkennushaunEnnakointi()
+                    try:
+                        while (lopputulos_keskiarvo < ui_laatutavoite and iteraatio < iteraatioraja):
+                            iteraatio += 1
+                            logging.info(f"Käynnistetään TILA C -parannusyritys {iteraatio}...")
 
-                        edellinen_keskiarvo = lopputulos_keskiarvo
-                        
-                        nykyinen_summa = sum(t.get('arvosana', 0) for t in final_tulokset if t.get('arvosana') is not None)
-                        tarvittava_summa = ui_laatutavoite * len(final_tulokset)
-                        summan_ero = max(0, tarvittava_summa - nykyinen_summa)
+                            edellinen_keskiarvo = lopputulos_keskiarvo
                         
-                        heikot_c = sorted([t for t in final_tulokset if t.get('arvosana', 0) < lopputulos_keskiarvo], key=lambda x: x.get('arvosana', 0))
-                        if not heikot_c:
-                            logging.warning("TILA C: Ei enää heikkoja jakeita parannettavaksi. Silmukka päättyy.")
-                            break
+                            nykyinen_summa = sum(t.get('arvosana', 0) for t in final_tulokset if t.get('arvosana') is not None)
+                            tarvittava_summa = ui_laatutavoite * len(final_tulokset)
+                            summan_ero = max(0, tarvittava_summa - nykyinen_summa)
                         
-                        korvattavia_lkm = 0
-                        potentiaalinen_nousu = 0
-                        for heikko_jae in heikot_c:
-                            potentiaalinen_nousu += (10.0 - heikko_jae.get('arvosana', 0))
-                            korvattavia_lkm += 1
-                            if potentiaalinen_nousu >= summan_ero:
+                            heikot_c = sorted([t for t in final_tulokset if t.get('arvosana', 0) < lopputulos_keskiarvo], key=lambda x: x.get('arvosana', 0))
+                            if not heikot_c:
+                                logging.warning("TILA C: Ei enää heikkoja jakeita parannettavaksi. Silmukka päättyy.")
                                 break
                         
-                        # KORJATTU: Dynaaminen puskuri
-                        puskuri = max(3, korvattavia_lkm // 2)
-                        haettava_maara_c = korvattavia_lkm + puskuri
-                        logging.info(f"Tavoitteeseen vaaditaan {summan_ero:.2f}p. Yritetään korvata {korvattavia_lkm} jaetta hakemalla {haettava_maara_c} uutta ehdokasta.")
+                            korvattavia_lkm = 0
+                            potentiaalinen_nousu = 0
+                            for heikko_jae in heikot_c:
+                                potentiaalinen_nousu += (10.0 - heikko_jae.get('arvosana', 0))
+                                korvattavia_lkm += 1
+                                if potentiaalinen_nousu >= summan_ero:
+                                    break
                         
-                        ydinjakeet_c = [t for t in final_tulokset if t.get('arvosana', 0) >= lopputulos_keskiarvo]
-                        if not ydinjakeet_c:
-                            ydinjakeet_c = sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True)[:5]
-
-                        uudet_ehdokkaat_c = suorita_tarkennushaku(ydinjakeet_c, musta_lista_viitteet, haettava_maara_c)
-                        if not uudet_ehdokkaat_c:
-                            logging.warning("TILA C: Tarkennushaku ei löytänyt enempää uniikkeja jakeita. Silmukka päättyy.")
-                            break
-                        musta_lista_viitteet.update(t['viite'] for t in uudet_ehdokkaat_c)
-
-                        logging.info(f"Arvioidaan {len(uudet_ehdokkaat_c)} uutta ehdokasta kerralla...")
-                        uudet_arviot_c = arvioi_tulokset(haku, uudet_ehdokkaat_c, malli_nimi=valittu_malli).get("jae_arviot", [])
-                        for jae in uudet_ehdokkaat_c:
-                            vastaava = next((a for a in uudet_arviot_c if a.get('viite') == jae['viite']), None)
-                            if vastaava:
-                                jae.update(vastaava)
+                            # KORJATTU: Dynaaminen puskuri
+                            puskuri = max(3, korvattavia_lkm // 2)
+                            haettava_maara_c = korvattavia_lkm + puskuri
+                            logging.info(f"Tavoitteeseen vaaditaan {summan_ero:.2f}p. Yritetään korvata {korvattavia_lkm} jaetta hakemalla {haettava_maara_c} uutta ehdokasta.")
+                        
+                            ydinjakeet_c = [t for t in final_tulokset if t.get('arvosana', 0) >= lopputulos_keskiarvo]
+                            if not ydinjakeet_c:
+                                ydinjakeet_c = sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True)[:5]
 
-                        uudet_parhaat_c = sorted([j for j in uudet_ehdokkaat_c if 'arvosana' in j], key=lambda x: x.get('arvosana', 0), reverse=True)
+                            uudet_ehdokkaat_c = ennakointi.hae(ydinjakeet_c, musta_lista_viitteet, haettava_maara_c)
+                            if not uudet_ehdokkaat_c:
+                                logging.warning("TILA C: Tarkennushaku ei löytänyt enempää uniikkeja jakeita. Silmukka päättyy.")
+                                break
+                            # Seuraavan kierroksen haku taustalla sillä oletuksella, että ydinjakeet pysyvät samoina.
+                            # Varaa on tämän kierroksen ehdokkaiden verran, koska arvioidut lisätään mustalle listalle.
+                            if iteraatio < iteraatioraja:
+                                ennakointi.ennakoi(ydinjakeet_c, musta_lista_viitteet, haettava_maara_c + len(uudet_ehdokkaat_c))
+
+                            logging.info(f"Arvioidaan enintään {len(uudet_ehdokkaat_c)} uutta ehdokasta, kunnes tavoite on saavutettavissa...")
+                            uudet_arviot_c = arvioi_kunnes_riittaa(
+                                haku, uudet_ehdokkaat_c, [t.get('arvosana', 0) for t in heikot_c], summan_ero,
+                                malli_nimi=valittu_malli, rinnakkaisuus=arvioinnin_rinnakkaisuus
+                            )
+                            musta_lista_viitteet.update(a['viite'] for a in uudet_arviot_c)
+                            for jae in uudet_ehdokkaat_c:
+                                vastaava = next((a for a in uudet_arviot_c if a.get('viite') == jae['viite']), None)
+                                if vastaava:
+                                    jae.update(vastaava)
+
+                            uudet_parhaat_c = sorted([j for j in uudet_ehdokkaat_c if 'arvosana' in j], key=lambda x: x.get('arvosana', 0), reverse=True)
                         
-                        korvaus_laskuri_c = 0
-                        heikot_c_uudelleen = sorted([t for t in final_tulokset if t.get('arvosana', 0) < edellinen_keskiarvo], key=lambda x: x.get('arvosana', 0))
-
-                        for i_korv in range(len(heikot_c_uudelleen)):
-                            if i_korv < len(uudet_parhaat_c):
-                                vanha_jae = heikot_c_uudelleen[i_korv]
-                                uusi_jae = uudet_parhaat_c[i_korv]
-                                if uusi_jae.get('arvosana', 0) > vanha_jae.get('arvosana', 0):
-                                    for idx, item in enumerate(final_tulokset):
-                                        if item['viite'] == vanha_jae['viite']:
-                                            final_tulokset[idx] = uusi_jae
-                                            korvaus_laskuri_c += 1
-                                            break
+                            korvaus_laskuri_c = 0
+                            heikot_c_uudelleen = sorted([t for t in final_tulokset if t.get('arvosana', 0) < edellinen_keskiarvo], key=lambda x: x.get('arvosana', 0))
+
+                            for i_korv in range(len(heikot_c_uudelleen)):
+                                if i_korv < len(uudet_parhaat_c):
+                                    vanha_jae = heikot_c_uudelleen[i_korv]
+                                    uusi_jae = uudet_parhaat_c[i_korv]
+                                    if uusi_jae.get('arvosana', 0) > vanha_jae.get('arvosana', 0):
+                                        for idx, item in enumerate(final_tulokset):
+                                            if item['viite'] == vanha_jae['viite']:
+                                                final_tulokset[idx] = uusi_jae
+                                                korvaus_laskuri_c += 1
+                                                break
                         
-                        valid_scores_now = [t.get('arvosana') for t in final_tulokset if t.get('arvosana') is not None]
-                        lopputulos_keskiarvo = sum(valid_scores_now) / len(valid_scores_now) if valid_scores_now else 0.0
-
-                        logging.info(f"TILA C: Kierros {iteraatio} valmis. {korvaus_laskuri_c} jaetta korvattu.")
-                        if lopputulos_keskiarvo > edellinen_keskiarvo:
-                            logging.info(f"TILA C: LAATU PARANI: {edellinen_keskiarvo:.2f} -> {lopputulos_keskiarvo:.2f} ✅")
-                        else:
-                            logging.warning("TILA C: Laatu ei parantunut tällä kierroksella. Silmukka päättyy.")
-                            lopputulos_keskiarvo = edellinen_keskiarvo
-                            break
+                            valid_scores_now = [t.get('arvosana') for t in final_tulokset if t.get('arvosana') is not None]
+                            lopputulos_keskiarvo = sum(valid_scores_now) / len(valid_scores_now) if valid_scores_now else 0.0
+
+                            logging.info(f"TILA C: Kierros {iteraatio} valmis. {korvaus_laskuri_c} jaetta korvattu.")
+                            if lopputulos_keskiarvo > edellinen_keskiarvo:
+                                logging.info(f"TILA C: LAATU PARANI: {edellinen_keskiarvo:.2f} -> {lopputulos_keskiarvo:.2f} ✅")
+                            else:
+                                logging.warning("TILA C: Laatu ei parantunut tällä kierroksella. Silmukka päättyy.")
+                                lopputulos_keskiarvo = edellinen_keskiarvo
+                                break
+                    finally:
+                        ennakointi.sulje()
                     
                     if lopputulos_keskiarvo < ui_laatutavoite:
                         logging.warning(f"TILA C: Laatutavoitetta ({ui_laatutavoite:.2f}) ei saavutettu. Lopullinen laatu: {lopputulos_keskiarvo:.2f}/10.")
 
-                jae_kartta[osio_nro]["jakeet"] = sorted(
+                jakeet = sorted(
                     final_tulokset, key=lambda x: x.get('arvosana', 0),
                     reverse=True
                 )
+                return jakeet, lopputulos_keskiarvo
+
+            # Valmiit osiot tallennetaan sitä mukaa kuin ne valmistuvat; raportit järjestävät osiot numeron mukaan
+            for valmiit, (osio_nro, (jakeet, keskiarvo)) in enumerate(suorita_osiot(
+                    sorted_hakulauseet, kasittele_osio, osioiden_rinnakkaisuus), 1):
+                jae_kartta[osio_nro]["jakeet"] = jakeet
                 jae_kartta[osio_nro]["otsikko"] = otsikot.get(
-                    osio_nro, haku.split(':')[0]
+                    osio_nro, hakulauseet[osio_nro].split(':')[0]
                 )
-                lopulliset_arvosanat[osio_nro] = lopputulos_keskiarvo
+                lopulliset_arvosanat[osio_nro] = keskiarvo
+                logging.info(f"Osio {osio_nro} valmis ({valmiit}/{len(sorted_hakulauseet)}), laatu {keskiarvo:.2f}/10.")
 
             log_performance_stats(perf_writer, perf_file)
+            kirjaa_json_kutsutilastot()
 
         finally:
             if perf_file:
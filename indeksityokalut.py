@@ -0,0 +1,204 @@
+# indeksityokalut.py (Versio 1.1 - Rinnakkainen koodaus prosessipoolilla)
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+import faiss
+import numpy as np
+
+MATRIISIN_KOPIOINTIERA = 4096  # Vektoria kerrallaan vektorimatriisia kirjoitettaessa
+
+
+def laske_sisaltotiiviste(teksti: str) -> str:
+    return hashlib.sha256(teksti.encode("utf-8")).hexdigest()
+
+
+def sisainen_indeksi(indeksi):
+    """Palauttaa IndexIDMap-kääreen sisällä olevan varsinaisen indeksin (tai indeksin itsensä)."""
+    return faiss.downcast_index(indeksi.index) if hasattr(indeksi, "id_map") else indeksi
+
+
+def lue_vektorit_ja_tunnisteet(indeksi) -> tuple[np.ndarray, np.ndarray]:
+    """Lukee indeksin kaikki vektorit tallennusjärjestyksessä sekä niiden tunnisteet (id)."""
+    sisainen = sisainen_indeksi(indeksi)
+    vektorit = sisainen.reconstruct_n(0, sisainen.ntotal)
+    if hasattr(indeksi, "id_map"):
+        return vektorit, faiss.vector_to_array(indeksi.id_map).astype(np.int64)
+    return vektorit, np.arange(indeksi.ntotal, dtype=np.int64)
+
+
+def _kirjoita_json(tiedosto: str, data, **asetukset):
+    """Kirjoittaa JSON-tiedoston ensin väliaikaiseksi, jotta keskeytys ei jätä puolikasta tiedostoa."""
+    valiaikainen = tiedosto + ".tmp"
+    with open(valiaikainen, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, **asetukset)
+    os.replace(valiaikainen, tiedosto)
+
+
+def lue_manifesti(tiedosto: str, malli: str) -> dict | None:
+    """Lukee manifestin {malli, seuraava_id, ikkunat: {viite: [id, tiiviste]}}; None, jos sitä ei voi käyttää."""
+    if not os.path.exists(tiedosto):
+        return None
+    try:
+        with open(tiedosto, "r", encoding="utf-8") as f:
+            manifesti = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Manifestia '{tiedosto}' ei voitu lukea ({e}).")
+        return None
+    if manifesti.get("malli") != malli:
+        logging.info(f"Manifesti on tehty eri mallilla ('{manifesti.get('malli')}').")
+        return None
+    return manifesti
+
+
+def paivita_indeksi(
+    ikkunat: list[tuple[str, str]],
+    koodaa: Callable[[list[str]], Iterable[np.ndarray]],
+    malli: str,
+    indeksi_tiedosto: str,
+    kartta_tiedosto: str,
+    manifesti_tiedosto: str,
+):
+    """Päivittää FAISS-indeksin koodaamalla uudelleen vain ne konteksti-ikkunat, joiden sisältö on muuttunut.
+
+    Indeksi on IndexIDMap2, jossa jokaisella viitteellä on pysyvä tunniste (id); viitekartan avain on id.
+    Muuttunut ikkuna poistetaan ja lisätään samalla id:llä, uusi jae saa seuraavan vapaan id:n.
+    `koodaa` palauttaa tekstien vektorit järjestyksessä yhtenä tai useampana peräkkäisenä eränä.
+    Palauttaa päivitetyn indeksin, tai None, jos indeksiä ei voitu muodostaa.
+    """
+    manifesti = lue_manifesti(manifesti_tiedosto, malli)
+    indeksi = None
+    if manifesti is not None and os.path.exists(indeksi_tiedosto):
+        indeksi = faiss.read_index(indeksi_tiedosto)
+        if not hasattr(indeksi, "id_map") or indeksi.ntotal != len(manifesti["ikkunat"]):
+            logging.info("Olemassa oleva indeksi ei vastaa manifestia. Rakennetaan kokonaan uudelleen.")
+            indeksi = None
+    if indeksi is None:
+        manifesti = {"malli": malli, "seuraava_id": 0, "ikkunat": {}}
+
+    vanhat = manifesti["ikkunat"]
+    tiivisteet = {viite: laske_sisaltotiiviste(teksti) for viite, teksti in ikkunat}
+    poistettavat = [vanhat[viite][0] for viite in vanhat if tiivisteet.get(viite) != vanhat[viite][1]]
+    koodattavat = [(viite, teksti) for viite, teksti in ikkunat
+                   if viite not in vanhat or vanhat[viite][1] != tiivisteet[viite]]
+    uudet = sum(viite not in vanhat for viite, _ in koodattavat)
+    logging.info(f"Manifesti: {len(ikkunat) - len(koodattavat)} ikkunaa ennallaan, {len(koodattavat) - uudet} muuttunut, "
+                 f"{uudet} uutta, {len(poistettavat) - (len(koodattavat) - uudet)} poistunut.")
+    if indeksi is not None and not koodattavat and not poistettavat:
+        logging.info("Indeksi on jo ajan tasalla.")
+        return indeksi
+
+    if indeksi is not None and poistettavat:
+        indeksi.remove_ids(np.array(poistettavat, dtype=np.int64))
+    seuraava_id = manifesti["seuraava_id"]
+    tunnisteet = []
+    for viite, _ in koodattavat:
+        if viite in vanhat:
+            tunnisteet.append(vanhat[viite][0])
+        else:
+            tunnisteet.append(seuraava_id)
+            seuraava_id += 1
+    tunnisteet = np.array(tunnisteet, dtype=np.int64)
+
+    lisatyt = 0
+    if koodattavat:
+        for vektorit in koodaa([teksti for _, teksti in koodattavat]):
+            vektorit = np.ascontiguousarray(vektorit, dtype=np.float32)
+            if vektorit.ndim != 2:
+                raise ValueError(f"Koodaus palautti odottamattoman muotoisen taulukon {vektorit.shape}.")
+            if indeksi is None:
+                indeksi = faiss.IndexIDMap2(faiss.IndexFlatL2(vektorit.shape[1]))
+            indeksi.add_with_ids(vektorit, tunnisteet[lisatyt:lisatyt + len(vektorit)])
+            lisatyt += len(vektorit)
+    if lisatyt != len(koodattavat):
+        raise ValueError(f"Koodaus palautti {lisatyt} vektoria, odotettiin {len(koodattavat)}.")
+    if indeksi is None:
+        return None
+
+    paivitetyt_ikkunat = {viite: merkinta for viite, merkinta in vanhat.items() if tiivisteet.get(viite) == merkinta[1]}
+    for (viite, _), tunniste in zip(koodattavat, tunnisteet.tolist()):
+        paivitetyt_ikkunat[viite] = [tunniste, tiivisteet[viite]]
+
+    # Manifesti kirjoitetaan viimeisenä: jos ajo keskeytyy ennen sitä, seuraava ajo rakentaa kaiken uudelleen
+    faiss.write_index(indeksi, indeksi_tiedosto)
+    logging.info(f"Indeksi tallennettu: '{indeksi_tiedosto}' ({indeksi.ntotal} vektoria)")
+    viite_kartta = {str(tunniste): viite for viite, (tunniste, _) in sorted(paivitetyt_ikkunat.items(), key=lambda x: x[1][0])}
+    _kirjoita_json(kartta_tiedosto, viite_kartta, indent=4)
+    logging.info(f"Viitekartta tallennettu: '{kartta_tiedosto}'")
+    _kirjoita_json(manifesti_tiedosto, {"malli": malli, "seuraava_id": seuraava_id, "ikkunat": paivitetyt_ikkunat})
+    return indeksi
+
+
+def tallenna_vektorimatriisi(indeksi, tiedosto: str):
+    """Kirjoittaa indeksin vektorit .npy-matriisiksi, jonka rivi on vektorin id (puuttuvat id:t ovat nollarivejä)."""
+    sisainen = sisainen_indeksi(indeksi)
+    if hasattr(indeksi, "id_map"):
+        tunnisteet = faiss.vector_to_array(indeksi.id_map).astype(np.int64)
+    else:
+        tunnisteet = np.arange(indeksi.ntotal, dtype=np.int64)
+    rivit = int(tunnisteet.max()) + 1 if len(tunnisteet) else 0
+    matriisi = np.lib.format.open_memmap(tiedosto, mode="w+", dtype=np.float32, shape=(rivit, indeksi.d))
+    for alku in range(0, sisainen.ntotal, MATRIISIN_KOPIOINTIERA):
+        loppu = min(alku + MATRIISIN_KOPIOINTIERA, sisainen.ntotal)
+        matriisi[tunnisteet[alku:loppu]] = sisainen.reconstruct_n(alku, loppu - alku)
+    matriisi.flush()
+    del matriisi
+    logging.info(f"Vektorimatriisi tallennettu: '{tiedosto}'")
+
+
+@contextmanager
+def koodauspooli(model, tyoprosessit: int):
+    """Käynnistää SentenceTransformerin CPU-prosessipoolin; tyoprosessit <= 1 koodaa nykyisessä prosessissa (None)."""
+    if tyoprosessit <= 1:
+        yield None
+        return
+    # Jokaiselle prosessille oma osuus ytimistä, jotta torch-säikeet eivät kilpaile keskenään
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // tyoprosessit)))
+    logging.info(f"Käynnistetään {tyoprosessit} koodausprosessia...")
+    pooli = model.start_multi_process_pool(target_devices=["cpu"] * tyoprosessit)
+    try:
+        yield pooli
+    finally:
+        model.stop_multi_process_pool(pooli)
+
+
+def koodaa_tekstit(model, tekstit: list[str], erakoko: int = 32, pooli=None, pituusjarjestys: bool = True) -> np.ndarray:
+    """Koodaa tekstit vektoreiksi; tulosrivit ovat aina samassa järjestyksessä kuin `tekstit`.
+
+    Pituusjärjestyksessä samanpituiset tekstit päätyvät samaan erään ja samalle prosessille,
+    jolloin täytettä (padding) tarvitaan vähemmän.
+    """
+    if pituusjarjestys:
+        jarjestys = np.argsort([-len(t) for t in tekstit], kind="stable")
+    else:
+        jarjestys = np.arange(len(tekstit))
+    jarjestetyt = [tekstit[i] for i in jarjestys]
+    if pooli is not None:
+        vektorit = model.encode_multi_process(jarjestetyt, pooli, batch_size=erakoko)
+    else:
+        vektorit = model.encode(jarjestetyt, batch_size=erakoko, show_progress_bar=False)
+    vektorit = np.asarray(vektorit, dtype=np.float32)
+    tulos = np.empty_like(vektorit)
+    tulos[jarjestys] = vektorit
+    return tulos
+
+
+def vertaa_koodausnopeutta(model, tekstit: list[str], tyoprosessit: int, erakoko: int = 32, otoskoko: int = 1024):
+    """Mittaa otoksella nykyisen koodaustavan ja rinnakkaisen, pituusjärjestetyn koodauksen nopeuden."""
+    otos = tekstit[:otoskoko]
+    tulokset = {}
+    for nimi, prosessit, jarjestetty in [("yksi prosessi", 1, False),
+                                         ("yksi prosessi, pituusjärjestys", 1, True),
+                                         (f"{tyoprosessit} prosessia, pituusjärjestys", tyoprosessit, True)]:
+        with koodauspooli(model, prosessit) as pooli:
+            aloitus = time.time()
+            koodaa_tekstit(model, otos, erakoko, pooli, jarjestetty)
+            tulokset[nimi] = len(otos) / (time.time() - aloitus)
+    perustaso = next(iter(tulokset.values()))
+    for nimi, nopeus in tulokset.items():
+        logging.info(f"{nimi:<32} {nopeus:8.1f} tekstiä/s  (nopeutus {nopeus / perustaso:.2f}x)")
+    return tulokset
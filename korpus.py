@@ -0,0 +1,217 @@
+# korpus.py (Versio 2.0 - Sarakemuotoinen korpusartefakti kaikille rakentajille ja sovellukselle)
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# --- MÄÄRITYKSET ---
+RAAMATTU_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/bible.json"
+PAAKARTTA_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_kartta_e5_large.json"
+KORPUS_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_korpus.npz"
+PAAKARTTA_TAULUKKO_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_kartta_e5_large.npy"
+KORPUS_VERSIO = 2
+SANA_PATTERN = re.compile(r"\w+")
+
+
+class Korpus:
+    """Raamatun jakeet sarakemuotoisena: järjestysnumero on indeksi kaikkiin taulukoihin.
+
+    Tekstit ovat yhdessä merkkijonossa välilyönnein erotettuina, joten jakeen konteksti-ikkuna
+    (edellinen, nykyinen ja seuraava jae) on suoraan yksi viipale ilman merkkijonojen yhdistelyä.
+    """
+
+    def __init__(self, viitteet: list[str], kirjat: list[str], kirja_nrot: np.ndarray, luvut: np.ndarray,
+                 jae_nrot: np.ndarray, teksti: str, alut: np.ndarray, loput: np.ndarray):
+        self.viitteet = viitteet
+        self.kirjat = kirjat
+        self.kirja_nrot = kirja_nrot
+        self.luvut = luvut
+        self.jae_nrot = jae_nrot
+        self._teksti = teksti
+        self._alut = alut.tolist()
+        self._loput = loput.tolist()
+
+    @classmethod
+    def jasenna(cls, raamattu_data: dict) -> "Korpus":
+        """Jäsentää bible.json-rakenteen. Jakeet ilman tekstiä tai kirjan nimeä ohitetaan."""
+        viitteet, kirjat, kirja_nrot, luvut, jae_nrot, tekstit = [], [], [], [], [], []
+        for book_obj in raamattu_data.get("book", {}).values():
+            kirjan_nimi = book_obj.get("info", {}).get("name")
+            luvut_obj = book_obj.get("chapter")
+            if not kirjan_nimi or not isinstance(luvut_obj, dict):
+                continue
+            kirjat.append(kirjan_nimi)
+            for luku_nro, luku_obj in luvut_obj.items():
+                for jae_nro, jae_obj in (luku_obj.get("verse") or {}).items():
+                    teksti = jae_obj.get("text", "").strip()
+                    if teksti:
+                        viitteet.append(f"{kirjan_nimi} {luku_nro}:{jae_nro}")
+                        kirja_nrot.append(len(kirjat) - 1)
+                        luvut.append(int(luku_nro))
+                        jae_nrot.append(int(jae_nro))
+                        tekstit.append(teksti)
+        pituudet = np.array([len(t) for t in tekstit], dtype=np.int64)
+        alut = np.zeros(len(tekstit), dtype=np.int64)
+        alut[1:] = np.cumsum(pituudet + 1)[:-1]
+        return cls(viitteet, kirjat, np.array(kirja_nrot, dtype=np.int16), np.array(luvut, dtype=np.int16),
+                   np.array(jae_nrot, dtype=np.int16), " ".join(tekstit), alut, alut + pituudet)
+
+    def __len__(self) -> int:
+        return len(self.viitteet)
+
+    def teksti(self, i: int) -> str:
+        return self._teksti[self._alut[i]:self._loput[i]]
+
+    def jakeet(self) -> list[tuple[str, str]]:
+        """Palauttaa jakeet järjestyksessä muodossa [(viite, teksti), ...]."""
+        return [(viite, self._teksti[a:l]) for viite, a, l in zip(self.viitteet, self._alut, self._loput)]
+
+    def konteksti_ikkuna(self, i: int) -> str:
+        """Jakeen i 3 jakeen ikkuna "edellinen nykyinen seuraava" (korpuksen reunoilla lyhyempi)."""
+        return self._teksti[self._alut[max(i - 1, 0)]:self._loput[min(i + 1, len(self) - 1)]]
+
+    def konteksti_ikkunat(self, etuliite: str = "") -> list[str]:
+        return [etuliite + self.konteksti_ikkuna(i) for i in range(len(self))]
+
+    def tallenna(self, kohde: str):
+        np.savez(
+            kohde,
+            versio=KORPUS_VERSIO,
+            viitteet=np.array(self.viitteet),
+            kirjat=np.array(self.kirjat),
+            kirja_nrot=self.kirja_nrot,
+            luvut=self.luvut,
+            jae_nrot=self.jae_nrot,
+            tekstit=np.frombuffer(self._teksti.encode("utf-8"), dtype=np.uint8),
+            tekstien_alut=np.array(self._alut, dtype=np.int64),
+            tekstien_loput=np.array(self._loput, dtype=np.int64),
+        )
+
+    @classmethod
+    def lue(cls, tiedosto: str) -> "Korpus":
+        with np.load(tiedosto) as data:
+            if "versio" not in data or int(data["versio"]) != KORPUS_VERSIO:
+                raise ValueError(f"Korpusartefaktin '{tiedosto}' muoto on vanhentunut.")
+            return cls(data["viitteet"].tolist(), data["kirjat"].tolist(), data["kirja_nrot"], data["luvut"],
+                       data["jae_nrot"], data["tekstit"].tobytes().decode("utf-8"),
+                       data["tekstien_alut"], data["tekstien_loput"])
+
+
+def kaanna_korpus(raamattu_tiedosto: str = RAAMATTU_TIEDOSTO, kohde: str = KORPUS_TIEDOSTO) -> Korpus:
+    """Kääntää bible.json-tiedoston sarakemuotoiseksi korpusartefaktiksi."""
+    with open(raamattu_tiedosto, "r", encoding="utf-8") as f:
+        korpus = Korpus.jasenna(json.load(f))
+    korpus.tallenna(kohde)
+    logging.info(f"Korpus käännetty: {len(korpus)} jaetta -> '{kohde}'")
+    return korpus
+
+
+def lue_paakartta_json(kartta_tiedosto: str = PAAKARTTA_TIEDOSTO) -> list[str]:
+    """Lukee JSON-viitekartan listaksi, jossa indeksin rivi on listan indeksi (puuttuvat rivit = "")."""
+    with open(kartta_tiedosto, "r", encoding="utf-8") as f:
+        kartta = json.load(f)
+    taulukko = [""] * (max(map(int, kartta), default=-1) + 1)
+    for rivi, viite in kartta.items():
+        taulukko[int(rivi)] = viite
+    return taulukko
+
+
+def kaanna_paakartta(kartta_tiedosto: str = PAAKARTTA_TIEDOSTO, kohde: str = PAAKARTTA_TAULUKKO_TIEDOSTO):
+    """Kääntää {"0": "1. Moos. 1:1", ...} -kartan taulukoksi, jossa rivinumero on indeksin rivi."""
+    taulukko = lue_paakartta_json(kartta_tiedosto)
+    np.save(kohde, np.array(taulukko))
+    logging.info(f"Viitekartta käännetty: {len(taulukko)} riviä -> '{kohde}'")
+
+
+def onko_ajan_tasalla(artefakti: str, *lahteet: str) -> bool:
+    """Artefakti kelpaa, jos se on olemassa eikä mikään lähdetiedosto ole sitä uudempi."""
+    if not os.path.exists(artefakti):
+        return False
+    return all(not os.path.exists(l) or os.path.getmtime(l) <= os.path.getmtime(artefakti) for l in lahteet)
+
+
+def lataa_korpus(tiedosto: str = KORPUS_TIEDOSTO, raamattu_tiedosto: str = RAAMATTU_TIEDOSTO) -> Korpus:
+    """Lataa korpusartefaktin yhdellä luvulla. Puuttuva tai vanhentunut artefakti käännetään ensin."""
+    if onko_ajan_tasalla(tiedosto, raamattu_tiedosto):
+        try:
+            return Korpus.lue(tiedosto)
+        except (OSError, ValueError, KeyError) as e:
+            logging.info(f"Korpusartefaktia ei voitu käyttää ({e}).")
+    logging.info(f"Käännetään korpus tiedostosta '{raamattu_tiedosto}'...")
+    try:
+        return kaanna_korpus(raamattu_tiedosto, tiedosto)
+    except OSError as e:
+        logging.warning(f"Korpusartefaktia ei voitu tallentaa ({e}). Käytetään jäsennettyä korpusta muistissa.")
+        with open(raamattu_tiedosto, "r", encoding="utf-8") as f:
+            return Korpus.jasenna(json.load(f))
+
+
+def lataa_paakartta(tiedosto: str = PAAKARTTA_TAULUKKO_TIEDOSTO) -> list[str]:
+    """Lataa viitekartan listana; indeksin rivinumero on suoraan listan indeksi."""
+    return np.load(tiedosto).tolist()
+
+
+def tokenisoi(teksti: str) -> list[str]:
+    """Pilkkoo tekstin pienaakkosin kirjoitetuiksi sanoiksi samoilla rajoilla kuin säännöllisen lausekkeen \\b."""
+    return SANA_PATTERN.findall(teksti.lower())
+
+
+class Bm25Hakemisto:
+    """Käänteishakemisto ja BM25-pisteytys jaeteksteille.
+
+    Jakeet tunnistetaan järjestysnumerolla (indeksi jakeet-listassa); numerot ovat postauslistoissa nousevassa järjestyksessä.
+    """
+
+    def __init__(self, jakeet: list[tuple[str, str]], k1: float = 1.2, b: float = 0.75):
+        self.viitteet = [viite for viite, _ in jakeet]
+        self.k1 = k1
+        self.b = b
+        numerot, frekvenssit = defaultdict(list), defaultdict(list)
+        pituudet = np.zeros(len(jakeet), dtype=np.float32)
+        for nro, (_, teksti) in enumerate(jakeet):
+            sanat = tokenisoi(teksti)
+            pituudet[nro] = len(sanat)
+            for sana, maara in Counter(sanat).items():
+                numerot[sana].append(nro)
+                frekvenssit[sana].append(maara)
+        self.postaukset = {
+            sana: (np.array(numerot[sana], dtype=np.int32), np.array(frekvenssit[sana], dtype=np.float32))
+            for sana in numerot
+        }
+        self._pituusnormi = k1 * (1 - b + b * pituudet / max(float(pituudet.mean()), 1.0)) if len(jakeet) else pituudet
+
+    def sanahakemisto(self) -> dict[str, np.ndarray]:
+        """Palauttaa hakemiston {sana: jakeiden järjestysnumerot} ilman frekvenssejä."""
+        return {sana: nrot for sana, (nrot, _) in self.postaukset.items()}
+
+    def hae(self, kysely: str, k: int) -> list[tuple[str, float]]:
+        """Palauttaa kyselyn k parasta jaetta BM25-pisteiden mukaan muodossa [(viite, pisteet), ...]."""
+        pisteet = np.zeros(len(self.viitteet), dtype=np.float32)
+        n = len(self.viitteet)
+        for sana in set(tokenisoi(kysely)):
+            if sana not in self.postaukset:
+                continue
+            nrot, tf = self.postaukset[sana]
+            idf = np.log1p((n - len(nrot) + 0.5) / (len(nrot) + 0.5))
+            pisteet[nrot] += idf * tf * (self.k1 + 1) / (tf + self._pituusnormi[nrot])
+        osumat = np.flatnonzero(pisteet)
+        if len(osumat) > k:
+            osumat = osumat[np.argpartition(pisteet[osumat], -k)[-k:]]
+        osumat = osumat[np.argsort(-pisteet[osumat], kind='stable')]
+        return [(self.viitteet[i], float(pisteet[i])) for i in osumat]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] - %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    alku = time.time()
+    kaanna_korpus()
+    kaanna_paakartta()
+    logging.info(f"Artefaktit käännetty {time.time() - alku:.2f} sekunnissa.")
@@ -1,30 +1,182 @@
-# logic.py (Versio 38.0 - Vankka virheenkäsittely ja GPU-optimointi viimeinen jäädytetty versio)
+# logic.py (Versio 45.13 - Tarkennushaun ennakoinnin osumat ja ohitukset lokiin)
 import json
 import logging
+import os
 import pprint
 import re
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
 
-import faiss
 import numpy as np
-import ollama
 import streamlit as st
-from sentence_transformers import CrossEncoder, SentenceTransformer
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# faiss, ollama ja sentence_transformers (ja sen mukana torch) tuodaan vasta ensimmäisellä käyttökerralla
+from korpus import (
+    Bm25Hakemisto,
+    lataa_korpus,
+    lataa_paakartta,
+    lue_paakartta_json,
+    onko_ajan_tasalla,
+    tokenisoi,
+)
+from valimuisti import ArvioValimuisti, PisteValimuisti, VektoriValimuisti
 
 # --- VAKIOASETUKSET ---
 LOGIC_TIEDOSTOPOLKU = "logic.py"
 PAAINDESKI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large.faiss"
 PAAKARTTA_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_kartta_e5_large.json"
+# Hakuindeksin tyyppi: "flat" (tarkka), "hnsw" tai "ivfpq" (likimääräiset, luo_uusi_indeksi_e5.py --ann).
+# Hakutarkkuuden ja -nopeuden vertailu: vertaa_ann_indekseja.py
+PAAINDEKSI_TYYPPI = "flat"
+PAAINDEKSI_ANN_TIEDOSTOPOHJA = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large_{tyyppi}.faiss"
+HNSW_EF_SEARCH = 256
+IVFPQ_NPROBE = 32
+# Indeksi muistikartoitetaan (mmap), jolloin käynnistys ei lue koko tiedostoa muistiin
+PAAINDEKSI_MMAP = True
+# Käännetyt artefaktit (python korpus.py): viitekartta taulukkona ja sarakemuotoinen korpus
+PAAKARTTA_TAULUKKO_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_kartta_e5_large.npy"
+KORPUS_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_korpus.npz"
+# Indeksin vektorit .npy-matriisina (luo_uusi_indeksi_e5.py). Jos puuttuu, vektorit luetaan indeksistä.
+PAAVEKTORIT_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_vektorit_e5_large.npy"
 RAAMATTU_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/bible.json"
 RAAMATTU_SANAKIRJA_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/bible_dictionary.json"
 EMBEDDING_MALLI = "intfloat/multilingual-e5-large"
 CROSS_ENCODER_MALLI = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 TIMANTTIJAE_MINIMI_MAARA = 3
 
+# Raamatunviite, esim. "Room. 12:1-2", "Ap. t. 4:12", "Joh. 3:16–4:2" tai "Room. 12:1, 4-5".
+# Pilkun jälkeinen numero hylätään vain, jos sitä seuraa uusi kirjaviite ("Joh. 1:1, 2. Joh. 1:2"),
+# joten lauseen päättävä jae ("Joh. 3:16, 17.") säilyy. Välin merkkinä käy yhdysmerkki tai ajatusviiva.
+VIITE_PATTERN = re.compile(
+    r'(?P<kirja>(?:[1-3]\.\s)?[A-ZÅÄÖa-zåäö]+\.?(?:\s[a-zåäö]\.)?)'
+    r'\s(?P<valit>\d+:\d+(?:[-–]\d+(?::\d+)?)?'
+    r'(?:,\s*\d+(?!\d)(?!\.\s[A-ZÅÄÖ][A-ZÅÄÖa-zåäö]*\.?(?:\s[a-zåäö]\.)?\s\d+:)(?::\d+)?(?:[-–]\d+(?::\d+)?)?)*)'
+)
+
+# Otsikon sanat, joita ei koskaan ehdoteta tehostesanoiksi
+HUKKASANAT = frozenset({
+    'aiemmin', 'aika', 'aikaa', 'aikaan', 'aikaisemmin', 'aikaisin', 'aikana', 'aikoa', 'aina', 'ainakaan',
+    'ainakin', 'ainoa', 'ainut', 'aivan', 'alas', 'alkuisin', 'alla', 'alle', 'alta', 'aluksi', 'antaa', 'asia', 'asti',
+    'edes', 'edessä', 'edestä', 'ehkä', 'ei', 'eikä', 'eilen', 'eivät', 'eli', 'ellei', 'emme', 'en', 'enemmän', 'eniten',
+    'ensin', 'entinen', 'entä', 'eri', 'erittäin', 'esimerkiksi', 'et', 'eteen', 'etenkin', 'ette', 'he', 'heidän',
+    'hän', 'hänen', 'ihan', 'ilman', 'itse', 'itsensä', 'ja', 'jo', 'johon', 'joiden', 'joihin', 'joiksi', 'joilla',
+    'joille', 'joilta', 'joina', 'joissa', 'joista', 'joita', 'joka', 'jokainen', 'jokin', 'joko', 'joku', 'jolla',
+    'jolle', 'jolloin', 'jolta', 'jonka', 'jonkin', 'jonne', 'jos', 'joskus', 'jossa', 'josta', 'jota', 'jotain',
+    'joten', 'jotka', 'jotta', 'juuri', 'jälkeen', 'kanssa', 'keiden', 'keihin', 'keillä', 'keille', 'keiltä',
+    'keissä', 'keistä', 'keitä', 'kuka', 'kukaan', 'ken', 'kerran', 'kerta', 'kertaa', 'kesken', 'koska', 'koskaan',
+    'kuin', 'kuinka', 'kuitenkaan', 'kuitenkin', 'kun', 'kuten', 'kyllä', 'kymmenen', 'lähellä', 'läheltä', 'lähes',
+    'läpi', 'liian', 'lisäksi', 'me', 'meidän', 'melkein', 'melko', 'mihin', 'mikin', 'miksi', 'mikä', 'mikään',
+    'mille', 'milloin', 'millä', 'miltä', 'minkä', 'minne', 'minun', 'minut', 'minä', 'missä', 'mistä', 'miten',
+    'mitkä', 'mitä', 'mitään', 'mukaan', 'mutta', 'muu', 'muut', 'muuta', 'muutama', 'muuten', 'myös', 'myöskään',
+    'ne', 'neljä', 'niiden', 'niihin', 'niiksi', 'niillä', 'niille', 'niiltä', 'niin', 'niinä', 'niissä', 'niistä',
+    'niitä', 'noin', 'nopeasti', 'nyt', 'nämä', 'näiden', 'näihin', 'näiksi', 'näillä', 'näille', 'näiltä', 'näinä',
+    'näissä', 'näistä', 'näitä', 'ole', 'olemme', 'olen', 'olet', 'olette', 'oleva', 'olevan', 'olevat', 'oli',
+    'olimme', 'olin', 'olisi', 'olisimme', 'olisin', 'olisit', 'olisitte', 'olivat', 'olla', 'olleet', 'ollut',
+    'oma', 'omat', 'on', 'ovat', 'paljon', 'paremmin', 'perusteella', 'pian', 'pitkin', 'pitäisi', 'pitää', 'pois',
+    'puolesta', 'puolestaan', 'päälle', 'päin', 'saakka', 'sata', 'se', 'sekä', 'sen', 'siellä', 'sieltä', 'siihen',
+    'siinä', 'siitä', 'sijaan', 'siksi', 'sillä', 'silloin', 'silti', 'sinne', 'sinun', 'sinut', 'sinä', 'sisällä',
+    'siten', 'sitten', 'sitä', 'suoraan', 'suuri', 'suurin', 'tai', 'taas', 'takana', 'takia', 'tavalla', 'tavoin',
+    'te', 'teidän', 'tietenkin', 'todella', 'toinen', 'toisaalla', 'toisaalta', 'toistaiseksi', 'toki', 'tosin',
+    'tuhannen', 'tuhat', 'tulee', 'tulla', 'tämä', 'tämän', 'tänään', 'tässä', 'tästä', 'täysin', 'täytyy', 'täällä',
+    'täältä', 'usea', 'useasti', 'usein', 'useita', 'uusi', 'uusia', 'uutta', 'vaan', 'vaikka', 'vain', 'varmasti',
+    'varsinkin', 'varten', 'vasta', 'vastaan', 'verran', 'vielä', 'viime', 'viimeksi', 'voida', 'voimme', 'voin',
+    'voit', 'voitte', 'voivat', 'vuoksi', 'vuosi', 'vuotta', 'vähemmän', 'vähän', 'yhtä', 'yhtään', 'yksi', 'yleensä',
+    'yli', 'myöskin'
+})
+ERIKOISMERKKI_PATTERN = re.compile(r'[^\w\s]')
+
+# Cross-encoderin porrastettu uudelleenjärjestys: ensin pisteytetään max(top_k * ALKUKERROIN, MINIMI)
+# parhaan vektorihaun ehdokasta, sitten max(top_k, MINIMI) kerrallaan, kunnes top_k-joukko vakiintuu.
+# Valinnainen: porrastus voi jättää pisteyttämättä ehdokkaan, joka olisi noussut top_k-joukkoon.
+UUDELLEENJARJESTYS_PORRASTETTU = False
+PORRASTUS_ALKUKERROIN = 3
+PORRASTUS_MINIMI = 32
+CROSS_ENCODER_ERAKOKO = 32
+# Hybridihaku: BM25-sanahaun ja vektorihaun ehdokkaat yhdistetään käänteisen sijoituksen summalla (RRF)
+# ennen cross-encoderia. Ylihaku on kerroin * haettavien jakeiden määrä (pelkässä vektorihaussa 5-10).
+HYBRIDIHAKU = False
+HYBRIDI_TIHEA_KERROIN = 3
+HYBRIDI_BM25_KERROIN = 2
+RRF_K = 60
+
 # --- MALLIMÄÄRITYKSET ---
 ARVIOINTI_MALLI_ENSISIJAINEN = "raamattu-tutkija-model:q4"
 ARVIOINTI_MALLI_VARAMALLI = "gemma:7b"
 ASIANTUNTIJA_MALLI = "raamattu-tutkija-model:q4"
+# Samanaikaisten arviointipyyntöjen enimmäismäärä. Ollama palvelee rinnakkaisia
+# pyyntöjä OLLAMA_NUM_PARALLEL-asetuksen verran; loput jäävät sen jonoon.
+ARVIOINTI_RINNAKKAISUUS = 4
+# Montako jaetta arvioidaan yhdellä kehotteella. Puuttuvat tai virheelliset
+# arviot haetaan erikseen yksittäisarvioinnilla. Arvo 1 = vain yksittäisarviointi.
+ARVIOINTI_JAETTA_PER_KUTSU = 5
+# Montako osiota käsitellään samanaikaisesti (haku, arviointi ja parannus). Samanaikaisia
+# arviointipyyntöjä voi olla enimmillään OSIO_RINNAKKAISUUS * ARVIOINTI_RINNAKKAISUUS.
+# Valinnainen (> 1): rinnakkaisten osioiden lokirivit sekoittuvat keskenään, ja paikalliset
+# mallikutsut ajetaan silti yksi kerrallaan (_mallilukko).
+OSIO_RINNAKKAISUUS = 1
+# Ollama-yhteys: yksi jaettu asiakas (HTTP-yhteydet käytetään uudelleen). None = OLLAMA_HOST tai oletusosoite.
+OLLAMA_OSOITE = None
+OLLAMA_AIKAKATKAISU = 600  # sekuntia per pyyntö
+# Kuinka kauan malli pidetään muistissa viimeisen pyynnön jälkeen. Jotta pää- ja varamalli eivät
+# syrjäytä toisiaan, Ollaman OLLAMA_MAX_LOADED_MODELS-arvon tulee olla vähintään 2.
+OLLAMA_KEEP_ALIVE = "30m"
+# Jos mallin latausaika ylittää tämän (s), kutsu kirjataan mallin uudelleenlataukseksi.
+MALLIN_LATAUS_VAROITUSRAJA = 1.0
+
+# --- ARVIOINTIKEHOTTEET ---
+ARVIOINTI_KEHOTE = (
+    "ROOLI: Olet teologian asiantuntija. Tehtäväsi on arvioida, kuinka hyvin YKSI Raamatun jae vastaa annettua aihetta.\n"
+    "AIHE: \"{aihe}\"\n"
+    "ARVIOITAVA JAE:\n"
+    "- Viite: \"{viite}\"\n"
+    "- Teksti: \"{teksti}\"\n"
+    "VASTAA AINOASTAAN JSON-MUODOSSA. Anna arvosana (1.0-10.0) ja lyhyt, ytimekäs suomenkielinen perustelu.\n"
+    "ESIMERKKIVASTAUS: {{\"arvosana\": 8.5, \"perustelu\": \"Sopii hyvin, koska...\"}}\n"
+    "Sinun vastauksesi:"
+)
+ERA_ARVIOINTI_KEHOTE = (
+    "ROOLI: Olet teologian asiantuntija. Tehtäväsi on arvioida, kuinka hyvin KUKIN alla olevista Raamatun jakeista vastaa annettua aihetta. Arvioi jokainen jae erikseen.\n"
+    "AIHE: \"{aihe}\"\n"
+    "ARVIOITAVAT JAKEET:\n"
+    "{jakeet}\n"
+    "VASTAA AINOASTAAN JSON-MUODOSSA. Anna JOKAISELLE jakeelle viite täsmälleen yllä annetussa muodossa, arvosana (1.0-10.0) ja lyhyt, ytimekäs suomenkielinen perustelu.\n"
+    "ESIMERKKIVASTAUS: {{\"arviot\": [{{\"viite\": \"{esimerkkiviite}\", \"arvosana\": 8.5, \"perustelu\": \"Sopii hyvin, koska...\"}}]}}\n"
+    "Sinun vastauksesi:"
+)
+ERA_ARVIOINTI_JAE = "{nro}. Viite: \"{viite}\"\n   Teksti: \"{teksti}\""
+# Vastauskenttien JSON-skeemat. Kutsun skeema kootaan vaadituista avaimista ja annetaan Ollamalle
+# format-parametrina, jolloin malli tuottaa valmiiksi oikean muotoisen vastauksen.
+VASTAUSKENTTIEN_SKEEMAT = {
+    'arvosana': {'type': 'number'},
+    'perustelu': {'type': 'string'},
+    'sovellu': {'type': 'boolean'},
+    'selite': {'type': 'string'},
+    'avainsanat': {'type': 'array', 'items': {'type': 'string'}},
+    'uusi_avainsana': {'type': 'string'},
+    # Alkioiden kentät tarkistetaan _arvioi_jae_era-funktiossa, joka arvioi vain virheelliset jakeet uudelleen
+    'arviot': {'type': 'array', 'items': {'type': 'object'}},
+}
+
+# --- ARVIOVÄLIMUISTI ---
+# Välimuistin avain sisältää kehotepohjien tiivisteen, joten kehotteen muutos mitätöi vanhat arviot.
+ARVIO_VALIMUISTI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/arvio_valimuisti.sqlite"
+ARVIO_VALIMUISTI_MAKSIMIKOKO = 200_000
+ARVIO_VALIMUISTI_MAKSIMI_IKA_PAIVAT = 90
+# Kyselyvektorit: LRU-muisti ja valinnainen levytaso (None = vain muistissa).
+KYSELYVEKTORI_VALIMUISTI_KOKO = 2048
+KYSELYVEKTORI_VALIMUISTI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/kyselyvektorit.sqlite"
+KYSELYVEKTORI_LEVYVALIMUISTI_MAKSIMIKOKO = 100_000  # Vektoria levyllä; pisimpään käyttämättömät poistetaan
+# Cross-encoderin pisteet (kysely, viite) -pareille; 0 = ei välimuistia.
+PARIPISTE_VALIMUISTI_KOKO = 50_000
+# Strategian relevanssi: kun kyselyn ja strategian selitteen kosinisamankaltaisuus on vähintään raja,
+# strategia hyväksytään ilman kielimallia; muut tapaukset ratkaisee kielimalli. Hylkäysrajaa ei ole,
+# koska kalibroimaton raja hylkäisi relevantteja strategioita huomaamatta. Päätökset muistetaan
+# (kysely, selite) -parikohtaisesti.
+STRATEGIA_HYVAKSYNTARAJA = 0.86
+STRATEGIAPAATOSTEN_MUISTI = 1024
 
 # --- STRATEGIAKERROS JA KARTTA ---
 STRATEGIA_SANAKIRJA = {
@@ -70,91 +222,476 @@ logging.basicConfig(
 
 
 # --- RESURSSIEN LATAUS ---
+def _lue_faiss_indeksi(tiedosto: str):
+    """Lukee FAISS-indeksin muistikartoitettuna, jotta vektoreita ei kopioida käynnistyksessä muistiin."""
+    import faiss
+    if PAAINDEKSI_MMAP:
+        try:
+            return faiss.read_index(tiedosto, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logging.warning(f"Indeksiä ei voitu muistikartoittaa ({e}). Luetaan se kokonaan muistiin.")
+    return faiss.read_index(tiedosto)
+
+
+def lataa_paaindeksi():
+    """Lataa PAAINDEKSI_TYYPPI-asetuksen mukaisen hakuindeksin ja asettaa sen hakuparametrit."""
+    import faiss
+
+    from indeksityokalut import sisainen_indeksi
+    if PAAINDEKSI_TYYPPI == "flat":
+        return _lue_faiss_indeksi(PAAINDESKI_TIEDOSTO)
+    tiedosto = PAAINDEKSI_ANN_TIEDOSTOPOHJA.format(tyyppi=PAAINDEKSI_TYYPPI)
+    logging.info(f"Käytetään likimääräistä {PAAINDEKSI_TYYPPI}-indeksiä: '{tiedosto}'")
+    indeksi = _lue_faiss_indeksi(tiedosto)
+    if PAAINDEKSI_TYYPPI == "hnsw":
+        sisainen_indeksi(indeksi).hnsw.efSearch = HNSW_EF_SEARCH
+    elif PAAINDEKSI_TYYPPI == "ivfpq":
+        ivf = faiss.extract_index_ivf(indeksi)
+        ivf.nprobe = IVFPQ_NPROBE
+        ivf.make_direct_map()  # reconstruct() tarvitsee suoran kartan
+    else:
+        raise ValueError(f"Tuntematon PAAINDEKSI_TYYPPI: {PAAINDEKSI_TYYPPI}")
+    return indeksi
+
+
 @st.cache_resource
 def lataa_resurssit():
     logging.info("Ladataan hakumallit, indeksi ja datatiedostot muistiin...")
     try:
+        aloitus = time.time()
+        from sentence_transformers import CrossEncoder, SentenceTransformer
+        logging.info(f"sentence_transformers tuotu {time.time() - aloitus:.2f} sekunnissa.")
         model = SentenceTransformer(EMBEDDING_MALLI)
         cross_encoder = CrossEncoder(CROSS_ENCODER_MALLI)
-        paaindeksi = faiss.read_index(PAAINDESKI_TIEDOSTO)
-        with open(PAAKARTTA_TIEDOSTO, "r", encoding="utf-8") as f:
-            paakartta = json.load(f)
-        with open(RAAMATTU_TIEDOSTO, "r", encoding="utf-8") as f:
-            raamattu_data = json.load(f)
-        with open(RAAMATTU_SANAKIRJA_TIEDOSTO, "r", encoding="utf-8") as f:
-            raamattu_sanasto_lista = json.load(f)
-        raamattu_sanasto = set(raamattu_sanasto_lista)
-        jae_haku_kartta = {}
-        for book_obj in raamattu_data["book"].values():
-            kirjan_nimi = book_obj.get("info", {}).get("name")
-            for luku_nro, luku_obj in book_obj.get("chapter", {}).items():
-                for jae_nro, jae_obj in luku_obj.get("verse", {}).items():
-                    teksti = jae_obj.get("text", "").strip()
-                    if teksti and kirjan_nimi:
-                        viite = f"{kirjan_nimi} {luku_nro}:{jae_nro}"
-                        jae_haku_kartta[viite] = teksti
+        aloitus = time.time()
+        paaindeksi = lataa_paaindeksi()
+        # Käännetyt artefaktit (python korpus.py) ladataan ilman JSON-jäsennystä
+        if onko_ajan_tasalla(PAAKARTTA_TAULUKKO_TIEDOSTO, PAAKARTTA_TIEDOSTO):
+            paakartta = lataa_paakartta(PAAKARTTA_TAULUKKO_TIEDOSTO)
+        else:
+            logging.info("Käännettyä viitekarttaa ei löytynyt. Jäsennetään JSON (nopeuta: python korpus.py).")
+            paakartta = lue_paakartta_json(PAAKARTTA_TIEDOSTO)
+        # Sarakemuotoinen korpus käännetään bible.json-tiedostosta automaattisesti, jos se puuttuu tai on vanhentunut
+        jakeet = lataa_korpus(KORPUS_TIEDOSTO, RAAMATTU_TIEDOSTO).jakeet()
+        jae_haku_kartta = dict(jakeet)
+        raamattu_sanasto = lataa_raamattu_sanasto()
+        logging.info(f"Indeksi ja datatiedostot ladattu {time.time() - aloitus:.2f} sekunnissa.")
+        viiteindeksi = rakenna_viiteindeksi(jae_haku_kartta)
+        viite_rivit = {viite: rivi for rivi, viite in enumerate(paakartta) if viite}
+        aloitus = time.time()
+        bm25 = Bm25Hakemisto(jakeet)
+        sanahakemisto = bm25.sanahakemisto()
+        jae_numerot = {viite: nro for nro, (viite, _) in enumerate(jakeet)}
+        logging.info(f"Sanahakemisto ja BM25-indeksi rakennettu ({len(sanahakemisto)} sanaa) {time.time() - aloitus:.2f} sekunnissa.")
         logging.info("Kaikki resurssit ladattu onnistuneesti.")
-        return model, cross_encoder, paaindeksi, paakartta, jae_haku_kartta, raamattu_sanasto
+        return (model, cross_encoder, paaindeksi, paakartta, jae_haku_kartta, raamattu_sanasto,
+                viiteindeksi, viite_rivit, sanahakemisto, jae_numerot, bm25)
     except Exception as e:
         logging.error(f"Kriittinen virhe resurssien alustuksessa: {e}")
         st.error(f"Resurssien lataus epäonnistui: {e}")
-        return None, None, None, None, None, None
+        return None, None, None, None, None, None, None, None, None, None, None
+
+
+@st.cache_resource
+def lataa_raamattu_sanasto() -> frozenset:
+    """Lataa Raamatun sanaston; tehostesanojen poiminta ei tarvitse malleja eikä indeksiä."""
+    with open(RAAMATTU_SANAKIRJA_TIEDOSTO, "r", encoding="utf-8") as f:
+        return frozenset(json.load(f))
+
+
+@lru_cache(maxsize=1024)
+def _poimi_tehostesanat(otsikko: str) -> frozenset:
+    # Sanaston latausvirhe nousee välimuistin ohi, joten välimuistiin päätyvät vain onnistuneet tulokset
+    raamattu_sanasto = lataa_raamattu_sanasto()
+    sanat = ERIKOISMERKKI_PATTERN.sub('', VIITE_PATTERN.sub('', otsikko)).split()
+    return frozenset(s.lower() for s in sanat
+                     if len(s) > 2 and s[0].isupper() and s.lower() not in HUKKASANAT and s.lower() in raamattu_sanasto)
+
+
+def poimi_tehostesanat(otsikko: str) -> frozenset:
+    """Poimii otsikosta isolla alkukirjaimella kirjoitetut Raamatun sanaston sanat tehostesanaehdotuksiksi."""
+    try:
+        return _poimi_tehostesanat(otsikko)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.error(f"Raamatun sanastoa ei voitu ladata: {e}")
+        return frozenset()
+
+
+@st.cache_resource
+def aloita_esilataus() -> threading.Event:
+    """Käynnistää resurssien latauksen taustasäikeessä (kerran per prosessi) ja palauttaa valmiusmerkin.
+
+    Käyttöliittymä voi piirtyä heti; lataa_resurssit() odottaa kesken olevan latauksen valmistumista.
+    """
+    valmis = threading.Event()
+    ctx = get_script_run_ctx(suppress_warning=True)
+
+    def lataa():
+        aloitus = time.time()
+        try:
+            lataa_resurssit()
+        finally:
+            valmis.set()
+            logging.info(f"Taustalataus valmis {time.time() - aloitus:.2f} sekunnissa.")
+
+    saie = threading.Thread(target=lataa, name="resurssien-esilataus", daemon=True)
+    if ctx:
+        add_script_run_ctx(saie, ctx)
+    saie.start()
+    return valmis
+
+
+@st.cache_resource
+def lataa_jaevektorimatriisi() -> np.ndarray | None:
+    """Lataa indeksin vektorit muistikartoitettuna matriisina, jos tiedosto on olemassa."""
+    if not PAAVEKTORIT_TIEDOSTO or not os.path.exists(PAAVEKTORIT_TIEDOSTO):
+        return None
+    matriisi = np.load(PAAVEKTORIT_TIEDOSTO, mmap_mode='r')
+    paakartta = lataa_resurssit()[3]
+    # Matriisin rivi on indeksin id, joten rivejä on yhtä monta kuin viitekartassa (välissä voi olla aukkoja)
+    if paakartta is not None and matriisi.shape[0] != len(paakartta):
+        logging.warning(f"Vektorimatriisin rivimäärä ({matriisi.shape[0]}) ei vastaa viitekarttaa "
+                        f"({len(paakartta)}). Vektorit luetaan indeksistä.")
+        return None
+    return matriisi
+
+
+def hae_jaevektorit(viitteet: list[str]) -> tuple[np.ndarray, list[str]]:
+    """Palauttaa jakeiden tallennetut konteksti-ikkunavektorit ja viitteet, joille vektori löytyi."""
+    resurssit = lataa_resurssit()
+    if not all(resurssit):
+        return np.empty((0, 0), dtype=np.float32), []
+    paaindeksi, viite_rivit = resurssit[2], resurssit[7]
+    loydetyt = [v for v in viitteet if v in viite_rivit]
+    rivit = [viite_rivit[v] for v in loydetyt]
+    if not rivit:
+        return np.empty((0, paaindeksi.d), dtype=np.float32), []
+    matriisi = lataa_jaevektorimatriisi()
+    if matriisi is not None:
+        return np.asarray(matriisi[rivit], dtype=np.float32), loydetyt
+    try:
+        return np.vstack([paaindeksi.reconstruct(rivi) for rivi in rivit]).astype(np.float32), loydetyt
+    except RuntimeError as e:
+        logging.warning(f"Vektoreita ei voitu lukea indeksistä ({e}).")
+        return np.empty((0, paaindeksi.d), dtype=np.float32), []
+
+
+@st.cache_resource
+def hae_kyselyvektorivalimuisti() -> VektoriValimuisti:
+    try:
+        return VektoriValimuisti(KYSELYVEKTORI_VALIMUISTI_KOKO, KYSELYVEKTORI_VALIMUISTI_TIEDOSTO,
+                                 KYSELYVEKTORI_LEVYVALIMUISTI_MAKSIMIKOKO)
+    except Exception as e:
+        logging.warning(f"Kyselyvektorien levyvälimuistia ei voitu avata ({e}). Käytetään vain muistia.")
+        return VektoriValimuisti(KYSELYVEKTORI_VALIMUISTI_KOKO)
+
+
+# Embedding-malli, cross-encoder ja niiden nopeat tokenisaattorit eivät ole säieturvallisia
+# (esim. "RuntimeError: Already borrowed"), joten kaikki niiden kutsut sarjallistetaan.
+_mallilukko = threading.RLock()
+
+
+def koodaa_valimuistilla(model, tekstit: list[str]) -> np.ndarray:
+    """Koodaa tekstit vektoreiksi; aiemmin koodatut haetaan välimuistista."""
+    valimuisti = hae_kyselyvektorivalimuisti()
+    vektorit = [valimuisti.hae(EMBEDDING_MALLI, teksti) for teksti in tekstit]
+    puuttuvat = [i for i, vektori in enumerate(vektorit) if vektori is None]
+    if puuttuvat:
+        with _mallilukko:
+            uudet = model.encode([tekstit[i] for i in puuttuvat])
+        for i, vektori in zip(puuttuvat, uudet):
+            valimuisti.tallenna(EMBEDDING_MALLI, tekstit[i], vektori)
+            vektorit[i] = vektori
+    return np.array(vektorit, dtype=np.float32)
+
+
+@st.cache_resource
+def hae_pistevalimuisti() -> PisteValimuisti:
+    return PisteValimuisti(PARIPISTE_VALIMUISTI_KOKO)
 
 
 # --- APUFUNKTIOT ---
 def poimi_raamatunviitteet(teksti: str) -> list[str]:
-    pattern = r'((?:[1-3]\.\s)?[A-ZÅÄÖa-zåäö]+\.?\s\d+:\d+(?:-\d+)?)'
-    return re.findall(pattern, teksti)
+    return [m.group(0) for m in VIITE_PATTERN.finditer(teksti)]
 
 
-def hae_jakeet_viitteella(viite_str: str, jae_haku_kartta: dict) -> list[dict]:
-    viite_pattern = re.compile(
-        r'((?:[1-3]\.\s)?[A-ZÅÄÖa-zåäö]+\.?)'
-        r'\s(\d+):(\d+)(?:-(\d+))?'
-    )
-    match = viite_pattern.match(viite_str)
+def normalisoi_kirjan_nimi(kirja: str) -> str:
+    return kirja.strip().lower().replace('.', '').replace(' ', '')
+
+
+def rakenna_viiteindeksi(jae_haku_kartta: dict) -> dict:
+    """Rakentaa hakemiston muotoa {normalisoitu kirja: {luku: {jae: viite}}}."""
+    viiteindeksi = {}
+    for viite in jae_haku_kartta:
+        kirja, _, luku_jae_osa = viite.rpartition(' ')
+        try:
+            luku_str, jae_str = luku_jae_osa.split(':')
+            luku, jae = int(luku_str), int(jae_str)
+        except ValueError:
+            continue
+        kirjan_luvut = viiteindeksi.setdefault(normalisoi_kirjan_nimi(kirja), {})
+        kirjan_luvut.setdefault(luku, {})[jae] = viite
+    return viiteindeksi
+
+
+def _ratkaise_kirja(kirja: str, viiteindeksi: dict) -> dict | None:
+    """Etsii kirjan luvut nimen tai sen yksiselitteisen lyhenteen perusteella."""
+    avain = normalisoi_kirjan_nimi(kirja)
+    if avain in viiteindeksi:
+        return viiteindeksi[avain]
+    # Lyhenne (esim. "Ps" -> "Psalmit") tai pidempi nimi (esim. "Roomalaiskirje" -> "Room.")
+    lyhenteet = [k for k in viiteindeksi if k.startswith(avain)]
+    if len(lyhenteet) == 1:
+        return viiteindeksi[lyhenteet[0]]
+    pidemmat = [k for k in viiteindeksi if avain.startswith(k)]
+    if pidemmat:
+        return viiteindeksi[max(pidemmat, key=len)]
+    return None
+
+
+def _jasenna_jaevalit(valit_str: str) -> list[tuple[int, int, int, int]]:
+    """Jäsentää esim. "12:1, 4-5" tai "3:16–4:2" väleiksi (alkuluku, alkujae, loppuluku, loppujae)."""
+    valit = []
+    luku = None
+    for osa in valit_str.split(','):
+        alku, _, loppu = osa.strip().replace('–', '-').partition('-')
+        if ':' in alku:
+            luku_str, jae_str = alku.split(':')
+            luku = int(luku_str)
+            alku_jae = int(jae_str)
+        elif luku is not None:
+            alku_jae = int(alku)
+        else:
+            continue
+        alku_luku = luku
+        if ':' in loppu:
+            luku_str, jae_str = loppu.split(':')
+            luku = int(luku_str)
+            loppu_jae = int(jae_str)
+        else:
+            loppu_jae = int(loppu) if loppu else alku_jae
+        valit.append((alku_luku, alku_jae, luku, loppu_jae))
+    return valit
+
+
+def hae_jakeet_viitteella(viite_str: str, jae_haku_kartta: dict, viiteindeksi: dict = None) -> list[dict]:
+    match = VIITE_PATTERN.match(viite_str.strip())
     if not match:
         return []
-    kirja, luku, alku, loppu = match.groups()
-    kirja = kirja.strip().lower().replace('.', '').replace(' ', '')
-    luku_nro_str = str(int(luku))
-    alku_jae, loppu_jae = int(alku), int(loppu) if loppu else int(alku)
+    if viiteindeksi is None:
+        viiteindeksi = rakenna_viiteindeksi(jae_haku_kartta)
+    kirjan_luvut = _ratkaise_kirja(match.group('kirja'), viiteindeksi)
+    if not kirjan_luvut:
+        return []
     loytyneet = []
-    for avain, teksti in jae_haku_kartta.items():
-        avain_norm = avain.lower().replace('.', '').replace(' ', '')
-        if kirja in avain_norm:
+    nahdyt = set()
+    for alku_luku, alku_jae, loppu_luku, loppu_jae in _jasenna_jaevalit(match.group('valit')):
+        for luku_nro in range(alku_luku, loppu_luku + 1):
+            luvun_jakeet = kirjan_luvut.get(luku_nro)
+            if not luvun_jakeet:
+                continue
+            ensimmainen = alku_jae if luku_nro == alku_luku else 1
+            viimeinen = loppu_jae if luku_nro == loppu_luku else max(luvun_jakeet)
+            for jae_nro in range(ensimmainen, min(viimeinen, max(luvun_jakeet)) + 1):
+                viite = luvun_jakeet.get(jae_nro)
+                if viite and viite not in nahdyt:
+                    nahdyt.add(viite)
+                    loytyneet.append({"viite": viite, "teksti": jae_haku_kartta.get(viite, "")})
+    return loytyneet
+
+
+def _luo_saiepooli(saikeet: int) -> ThreadPoolExecutor:
+    """Luo säiepoolin, jonka säikeet perivät kutsujan Streamlit-kontekstin (lokit näkyvät UI:ssa)."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ThreadPoolExecutor(
+        max_workers=saikeet,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx) if ctx else None,
+    )
+
+
+def suorita_osiot(osiot: list, kasittele, rinnakkaisuus: int = OSIO_RINNAKKAISUUS):
+    """Ajaa kasittele(osio_nro, haku) jokaiselle osiolle ja tuottaa (osio_nro, tulos) valmistumisjärjestyksessä.
+
+    Osiot käsitellään säiepoolissa, joka jakaa ladatut resurssit ja välimuistit. Epäonnistunut osio
+    kirjataan lokiin ja ohitetaan, jotta muiden osioiden tulokset eivät katoa.
+    """
+    rinnakkaisuus = max(1, min(rinnakkaisuus, len(osiot)))
+    logging.info(f"Käsitellään {len(osiot)} osiota (rinnakkaisuus: {rinnakkaisuus}).")
+    if rinnakkaisuus == 1:
+        for osio_nro, haku in osiot:
+            try:
+                tulos = kasittele(osio_nro, haku)
+            except Exception as e:
+                logging.error(f"Osion {osio_nro} käsittely epäonnistui: {e}")
+                continue
+            yield osio_nro, tulos
+        return
+    with _luo_saiepooli(rinnakkaisuus) as pooli:
+        tehtavat = {pooli.submit(kasittele, osio_nro, haku): osio_nro for osio_nro, haku in osiot}
+        for tehtava in as_completed(tehtavat):
             try:
-                luku_jae_osa = avain.split(' ')[-1]
-                haun_luku_str, haun_jae_str = luku_jae_osa.split(':')
-                if haun_luku_str == luku_nro_str and alku_jae <= int(haun_jae_str) <= loppu_jae:
-                    loytyneet.append({"viite": avain, "teksti": teksti})
-            except (ValueError, IndexError):
+                tulos = tehtava.result()
+            except Exception as e:
+                logging.error(f"Osion {tehtavat[tehtava]} käsittely epäonnistui: {e}")
                 continue
-    return sorted(loytyneet, key=lambda x: int(x['viite'].split(':')[-1]))
+            yield tehtavat[tehtava], tulos
+
+
+# --- OLLAMA-ASIAKAS ---
+@st.cache_resource
+def hae_ollama_asiakas():
+    """Palauttaa prosessin yhteisen Ollama-asiakkaan, joka käyttää HTTP-yhteyksiä uudelleen."""
+    import ollama
+
+    return ollama.Client(host=OLLAMA_OSOITE, timeout=OLLAMA_AIKAKATKAISU)
+
+
+@lru_cache(maxsize=1)
+def _ollama_virheet() -> tuple:
+    """Yhteys-, aikakatkaisu- ja vastausvirheet, joiden jälkeen siirrytään seuraavaan malliin."""
+    import httpx
+    import ollama
+
+    return ConnectionError, httpx.HTTPError, ollama.RequestError, ollama.ResponseError
+
+
+def _kirjaa_kutsun_ajat(malli: str, vastaus, seinakelloaika: float):
+    """Kirjaa kutsun latausajan (mallin lataus muistiin) erikseen kehotteen käsittely- ja generointiajasta."""
+    ns = 1e-9
+    lataus = (vastaus.get('load_duration') or 0) * ns
+    kehote = (vastaus.get('prompt_eval_duration') or 0) * ns
+    generointi = (vastaus.get('eval_duration') or 0) * ns
+    tokenit = vastaus.get('eval_count') or 0
+    viesti = (f"Ollama {malli}: lataus {lataus:.2f}s, kehote {kehote:.2f}s, generointi {generointi:.2f}s "
+              f"({tokenit} tokenia), yhteensä {seinakelloaika:.2f}s.")
+    if lataus > MALLIN_LATAUS_VAROITUSRAJA:
+        logging.warning(viesti + " Malli ladattiin muistiin (kylmä käynnistys tai syrjäytetty malli).")
+    else:
+        logging.info(viesti)
+
+
+def _ollama_json_kutsu(malli: str, messages: list, skeema: dict = None):
+    aloitus = time.time()
+    vastaus = hae_ollama_asiakas().chat(model=malli, messages=messages, format=skeema or 'json',
+                                        keep_alive=OLLAMA_KEEP_ALIVE)
+    _kirjaa_kutsun_ajat(malli, vastaus, time.time() - aloitus)
+    return vastaus
+
+
+def _lataa_mallit_muistiin(mallit: tuple):
+    asiakas = hae_ollama_asiakas()
+    for malli in mallit:
+        aloitus = time.time()
+        try:
+            # Tyhjä kehote lataa mallin muistiin generoimatta mitään
+            asiakas.generate(model=malli, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+            logging.info(f"Malli {malli} esiladattu {time.time() - aloitus:.2f} sekunnissa.")
+        except Exception as e:
+            logging.warning(f"Mallin {malli} esilataus epäonnistui: {e}")
+
+
+@st.cache_resource
+def esilataa_mallit(mallit: tuple) -> threading.Event:
+    """Lataa mallit Ollaman muistiin taustasäikeessä (kerran per mallijoukko) ja palauttaa valmiusmerkin."""
+    valmis = threading.Event()
+
+    def lataa():
+        try:
+            _lataa_mallit_muistiin(mallit)
+        finally:
+            valmis.set()
+
+    threading.Thread(target=lataa, name="mallien-esilataus", daemon=True).start()
+    return valmis
 
 
 # --- VANKKA TEKOÄLYKUTSU ITSEKORJAUKSELLA ---
+_JSON_TYYPIT = {'object': dict, 'array': list, 'string': str, 'boolean': bool, 'integer': int, 'number': (int, float)}
+_json_kutsutilastot = {}
+_json_kutsutilastojen_lukko = threading.Lock()
+
+
+def luo_json_skeema(required_keys: list) -> dict:
+    """Koostaa vastauksen JSON-skeeman vaadituista avaimista; tuntematon avain voi olla mitä tahansa tyyppiä."""
+    return {
+        'type': 'object',
+        'properties': {avain: VASTAUSKENTTIEN_SKEEMAT.get(avain, {}) for avain in required_keys},
+        'required': list(required_keys),
+    }
+
+
+def tarkista_json_skeema(data, skeema: dict, polku: str = "vastaus") -> str | None:
+    """Tarkistaa datan skeemaa vasten (type, properties, required, items); palauttaa ensimmäisen virheen tai None."""
+    tyyppi = skeema.get('type')
+    if tyyppi and (not isinstance(data, _JSON_TYYPIT[tyyppi])
+                   or (tyyppi in ('number', 'integer') and isinstance(data, bool))):
+        return f"{polku}: odotettiin tyyppiä {tyyppi}"
+    if isinstance(data, dict):
+        for avain in skeema.get('required', []):
+            if avain not in data:
+                return f"{polku}: puuttuu avain '{avain}'"
+        for avain, aliskeema in skeema.get('properties', {}).items():
+            if avain in data and (virhe := tarkista_json_skeema(data[avain], aliskeema, f"{polku}.{avain}")):
+                return virhe
+    if isinstance(data, list) and 'items' in skeema:
+        for i, alkio in enumerate(data):
+            if virhe := tarkista_json_skeema(alkio, skeema['items'], f"{polku}[{i}]"):
+                return virhe
+    return None
+
+
+def _kirjaa_json_tilasto(malli: str, laji: str):
+    with _json_kutsutilastojen_lukko:
+        tilasto = _json_kutsutilastot.setdefault(
+            malli, {'pyynnot': 0, 'uusinnat': 0, 'skeemavirheet': 0, 'korjaukset': 0, 'yhteysvirheet': 0,
+                    'epaonnistuneet': 0})
+        tilasto[laji] += 1
+
+
+def hae_json_kutsutilastot() -> dict:
+    """Palauttaa malleittain pyyntöjen, uusintojen, skeema- ja yhteysvirheiden ja itsekorjausten määrät sekä osuudet (%)."""
+    with _json_kutsutilastojen_lukko:
+        tilastot = {malli: dict(tilasto) for malli, tilasto in _json_kutsutilastot.items()}
+    for tilasto in tilastot.values():
+        tilasto['korjausaste'] = 100.0 * tilasto['korjaukset'] / max(tilasto['pyynnot'], 1)
+        tilasto['uusinta_aste'] = 100.0 * tilasto['uusinnat'] / max(tilasto['pyynnot'], 1)
+    return tilastot
+
+
+def kirjaa_json_kutsutilastot():
+    for malli, t in hae_json_kutsutilastot().items():
+        logging.info(f"JSON-kutsut {malli}: {t['pyynnot']} pyyntöä, {t['uusinnat']} uusintaa ({t['uusinta_aste']:.1f} %), "
+                     f"{t['korjaukset']} itsekorjausta ({t['korjausaste']:.1f} %), {t['skeemavirheet']} skeemavirhettä, "
+                     f"{t['yhteysvirheet']} yhteysvirhettä, {t['epaonnistuneet']} epäonnistunutta.")
+
+
 def suorita_varmistettu_json_kutsu(mallit: list, kehote: str, required_keys: list = None, max_yritykset: int = 2) -> tuple[dict, str]:
-    """Suorittaa tekoälykutsun, varmistaa JSON-muodon ja vaadittujen avainten olemassaolon."""
+    """Suorittaa tekoälykutsun vaadituista avaimista kootulla JSON-skeemalla ja tarkistaa vastauksen paikallisesti."""
+    skeema = luo_json_skeema(required_keys or [])
     vastaus_teksti = ""
     for malli in mallit:
         logging.info(f"Käytetään mallia: {malli}")
         for yritys in range(max_yritykset):
+            _kirjaa_json_tilasto(malli, 'pyynnot')
+            if yritys:
+                _kirjaa_json_tilasto(malli, 'uusinnat')
             try:
                 messages = [{'role': 'user', 'content': kehote.strip()}]
                 logging.info(f"Lähetetään JSON-pyyntö mallille {malli} (Yritys {yritys + 1}/{max_yritykset})...")
-                response = ollama.chat(model=malli, messages=messages, format='json')
+                response = _ollama_json_kutsu(malli, messages, skeema)
                 vastaus_teksti = response['message']['content']
                 data = json.loads(vastaus_teksti)
 
-                if required_keys and not all(key in data for key in required_keys):
-                    logging.warning(f"Mallin {malli} vastaus oli validi, mutta siitä puuttui avaimet: {required_keys}. Yritetään uudelleen/seuraavaa mallia.")
+                if virhe := tarkista_json_skeema(data, skeema):
+                    _kirjaa_json_tilasto(malli, 'skeemavirheet')
+                    logging.warning(f"Mallin {malli} vastaus oli validi, mutta ei vastannut skeemaa ({virhe}). Yritetään uudelleen/seuraavaa mallia.")
                     continue
 
                 logging.info("Vastaus jäsennelty onnistuneesti ja sisältää vaaditut avaimet.")
                 return data, malli
             except (json.JSONDecodeError, KeyError) as e:
                 logging.warning(f"Virhe mallin {malli} kanssa (yritys {yritys + 1}): {e}. Käynnistetään itsekorjaus...")
+                _kirjaa_json_tilasto(malli, 'korjaukset')
                 korjaus_kehote = (
                     f"Edellinen vastauksesi ei ollut kelvollinen JSON-objekti. Virhe oli: '{e}'.\n"
                     f"Tässä on virheellinen teksti:\n---\n{vastaus_teksti}\n---\n"
@@ -162,10 +699,11 @@ def suorita_varmistettu_json_kutsu(mallit: list, kehote: str, required_keys: lis
                 )
                 try:
                     korjaus_messages = [{'role': 'user', 'content': korjaus_kehote}]
-                    korjaus_response = ollama.chat(model=malli, messages=korjaus_messages, format='json')
+                    korjaus_response = _ollama_json_kutsu(malli, korjaus_messages, skeema)
                     data = json.loads(korjaus_response['message']['content'])
-                    if required_keys and not all(key in data for key in required_keys):
-                        logging.warning("Myös korjattu vastaus oli validi, mutta siitä puuttui avaimet.")
+                    if virhe := tarkista_json_skeema(data, skeema):
+                        _kirjaa_json_tilasto(malli, 'skeemavirheet')
+                        logging.warning(f"Myös korjattu vastaus oli validi, mutta ei vastannut skeemaa ({virhe}).")
                         continue
                     logging.info("Itsekorjaus onnistui ja vastaus jäsenneltiin.")
                     return data, malli
@@ -174,12 +712,59 @@ def suorita_varmistettu_json_kutsu(mallit: list, kehote: str, required_keys: lis
                     if yritys < max_yritykset - 1:
                         logging.info("Yritetään alkuperäistä pyyntöä uudelleen...")
                     continue
+                except _ollama_virheet() as e_yhteys:
+                    _kirjaa_json_tilasto(malli, 'yhteysvirheet')
+                    logging.error(f"Itsekorjauskutsu mallille {malli} epäonnistui ({type(e_yhteys).__name__}: {e_yhteys}). "
+                                  f"Siirrytään seuraavaan malliin.")
+                    break
+            except _ollama_virheet() as e:
+                # Aikakatkaisu, yhteysvirhe tai Ollaman virhevastaus: uusinta samalle mallille tuskin auttaa
+                _kirjaa_json_tilasto(malli, 'yhteysvirheet')
+                logging.error(f"Kutsu mallille {malli} epäonnistui ({type(e).__name__}: {e}). Siirrytään seuraavaan malliin.")
+                break
+        _kirjaa_json_tilasto(malli, 'epaonnistuneet')
     logging.error(f"Kaikki mallit ({mallit}) epäonnistuivat. Palautetaan virhe.")
     return {"virhe": "JSON-vastausta ei saatu malleilta."}, "Tuntematon"
 
 
 # --- PÄÄFUNKTIOT ---
+def laske_strategian_samankaltaisuus(kysely: str, selite: str) -> float | None:
+    """Kyselyn ja strategian selitteen kosinisamankaltaisuus e5-vektoreilla (None, jos malli ei ole käytettävissä)."""
+    model = lataa_resurssit()[0]
+    if model is None:
+        return None
+    vektorit = koodaa_valimuistilla(model, [f"query: {kysely}", f"query: {selite}"])
+    vektorit /= np.linalg.norm(vektorit, axis=1, keepdims=True) + 1e-12
+    return float(vektorit[0] @ vektorit[1])
+
+
+_strategiapaatokset = {}
+_strategiapaatosten_lukko = threading.Lock()
+
+
 def onko_strategia_relevantti(kysely: str, selite: str) -> bool:
+    avain = (kysely, selite)
+    with _strategiapaatosten_lukko:
+        if avain in _strategiapaatokset:
+            return _strategiapaatokset[avain]
+    samankaltaisuus = laske_strategian_samankaltaisuus(kysely, selite)
+    if samankaltaisuus is not None and samankaltaisuus >= STRATEGIA_HYVAKSYNTARAJA:
+        logging.info(f"Esianalyysi: samankaltaisuus {samankaltaisuus:.3f} -> strategia soveltuu (ei LLM-kutsua).")
+        relevanssi = True
+    else:
+        if samankaltaisuus is not None:
+            logging.info(f"Esianalyysi: samankaltaisuus {samankaltaisuus:.3f} alittaa hyväksyntärajan, kysytään kielimallilta.")
+        relevanssi = _kysy_strategian_relevanssi(kysely, selite)
+        if relevanssi is None:
+            return False  # Epäonnistunutta kutsua ei muisteta
+    with _strategiapaatosten_lukko:
+        if len(_strategiapaatokset) >= STRATEGIAPAATOSTEN_MUISTI:
+            del _strategiapaatokset[next(iter(_strategiapaatokset))]
+        _strategiapaatokset[avain] = relevanssi
+    return relevanssi
+
+
+def _kysy_strategian_relevanssi(kysely: str, selite: str) -> bool | None:
     kehote = (f"ROOLI: Olet looginen päättelijä.\n"
               f"TEHTÄVÄ: Arvioi, onko strategia hyödyllinen hakukyselyn tarkentamiseen.\n"
               f"- Kysely: \"{kysely}\"\n"
@@ -191,72 +776,167 @@ def onko_strategia_relevantti(kysely: str, selite: str) -> bool:
         kehote,
         required_keys=['sovellu']
     )
+    if "virhe" in data:
+        return None
     relevanssi = data.get("sovellu", False)
     logging.info(f"Esianalyysin tulos: Soveltuuko strategia? {'Kyllä' if relevanssi else 'Ei'}.")
     return relevanssi
 
 
-def etsi_merkityksen_mukaan(kysely: str, otsikko: str, top_k: int = 15,
-                          custom_strategiat: dict = None,
-                          custom_siemenjakeet: dict = None,
-                          valitut_tehostesanat: set = None) -> tuple[list[dict], set]:
-    resurssit = lataa_resurssit()
-    if not all(resurssit):
-        return [], set()
-    model_encoder, cross_encoder, paaindeksi, paakartta, jae_haku_kartta, raamattu_sanasto = resurssit
-    
+def laske_tehosteet(ehdokkaat: list[dict], tehostettavat_sanat: set, sanahakemisto: dict,
+                    jae_numerot: dict) -> np.ndarray:
+    """Laskee ehdokkaille avainsanatehosteen (+2.0 jokaisesta löytyvästä sanasta) käänteishakemiston avulla.
+
+    Monisanaiset ilmaukset rajataan ensin sanojen leikkauksella ja varmistetaan sitten säännöllisellä lausekkeella.
+    """
+    tehosteet = np.zeros(len(ehdokkaat), dtype=np.float32)
+    numerot = np.array([jae_numerot.get(j['viite'], -1) for j in ehdokkaat], dtype=np.int32)
+    osumat_per_sana = {}
+    for sana in tehostettavat_sanat:
+        sanan_osat = tokenisoi(sana)
+        if len(sanan_osat) == 1 and sanan_osat[0] == sana.lower():
+            osumat = np.isin(numerot, sanahakemisto.get(sanan_osat[0], ()))
+        else:
+            osumat = np.ones(len(ehdokkaat), dtype=bool)
+            for osa in sanan_osat:
+                osumat &= np.isin(numerot, sanahakemisto.get(osa, ()))
+            pattern = re.compile(r'\b' + re.escape(sana.lower()) + r'\b')
+            for idx in np.flatnonzero(osumat):
+                osumat[idx] = bool(pattern.search(ehdokkaat[idx]['teksti'].lower()))
+        tehosteet += 2.0 * osumat
+        osumat_per_sana[sana] = int(osumat.sum())
+    if osumat_per_sana:
+        logging.info(f"  -> Tehostettiin {int(np.count_nonzero(tehosteet))}/{len(ehdokkaat)} ehdokasta "
+                     f"(osumia sanoittain: {osumat_per_sana})")
+    return tehosteet
+
+
+def yhdista_rrf(*jarjestykset: list[str], k: int = RRF_K) -> list[str]:
+    """Yhdistää viitejärjestykset käänteisen sijoituksen summalla: pisteet = Σ 1 / (k + sija)."""
+    pisteet = {}
+    for jarjestys in jarjestykset:
+        for sija, viite in enumerate(jarjestys, start=1):
+            pisteet[viite] = pisteet.get(viite, 0.0) + 1.0 / (k + sija)
+    return sorted(pisteet, key=pisteet.get, reverse=True)
+
+
+def _token_pituudet(cross_encoder, tekstit: list[str]) -> list[int]:
+    """Tekstien pituudet cross-encoderin tokeneina; ilman tokenisaattoria merkkeinä."""
+    tokenisaattori = getattr(cross_encoder, 'tokenizer', None)
+    if tokenisaattori is None:
+        return [len(teksti) for teksti in tekstit]
+    with _mallilukko:
+        tunnisteet = tokenisaattori(tekstit, add_special_tokens=False)['input_ids']
+    return [len(t) for t in tunnisteet]
+
+
+def _pisteyta_parit_monta(cross_encoder, kyselyt_ja_ehdokkaat: list[tuple[str, list[dict]]]) -> list[np.ndarray]:
+    """Pisteyttää usean kyselyn (kysely, ehdokkaat) -parit yhdellä cross-encoder-kutsulla.
+
+    Välimuistista löytyvät parit ohitetaan; puuttuvat lähetetään mallille token-pituuden mukaan
+    järjestettyinä, jolloin saman erän parit ovat lähes samanpituisia (vähemmän täytettä).
+    """
+    valimuisti = hae_pistevalimuisti() if PARIPISTE_VALIMUISTI_KOKO > 0 else None
+    kaikki_pisteet, puuttuvat = [], []
+    for k, (kysely, ehdokkaat) in enumerate(kyselyt_ja_ehdokkaat):
+        viitteet = [j['viite'] for j in ehdokkaat]
+        tallessa = valimuisti.hae_monta(CROSS_ENCODER_MALLI, kysely, viitteet) if valimuisti else [None] * len(ehdokkaat)
+        pisteet = np.array([np.nan if p is None else p for p in tallessa], dtype=np.float32)
+        kaikki_pisteet.append(pisteet)
+        puuttuvat.extend((k, i) for i in np.flatnonzero(np.isnan(pisteet)))
+    if puuttuvat:
+        kyselyiden_pituudet = _token_pituudet(cross_encoder, [kysely for kysely, _ in kyselyt_ja_ehdokkaat])
+        tekstien_pituudet = _token_pituudet(cross_encoder, [kyselyt_ja_ehdokkaat[k][1][i]['teksti'] for k, i in puuttuvat])
+        jarjestys = sorted(range(len(puuttuvat)),
+                           key=lambda n: kyselyiden_pituudet[puuttuvat[n][0]] + tekstien_pituudet[n])
+        puuttuvat = [puuttuvat[n] for n in jarjestys]
+        parit = [[kyselyt_ja_ehdokkaat[k][0], kyselyt_ja_ehdokkaat[k][1][i]['teksti']] for k, i in puuttuvat]
+        with _mallilukko:
+            uudet = cross_encoder.predict(parit, batch_size=CROSS_ENCODER_ERAKOKO, show_progress_bar=False)
+        for (k, i), piste in zip(puuttuvat, uudet):
+            kaikki_pisteet[k][i] = piste
+        if valimuisti:
+            for k, (kysely, ehdokkaat) in enumerate(kyselyt_ja_ehdokkaat):
+                uudet_rivit = [i for kk, i in puuttuvat if kk == k]
+                if uudet_rivit:
+                    valimuisti.tallenna_monta(CROSS_ENCODER_MALLI, kysely, [ehdokkaat[i]['viite'] for i in uudet_rivit],
+                                              kaikki_pisteet[k][uudet_rivit])
+    return kaikki_pisteet
+
+
+def _pisteyta_parit(cross_encoder, kysely: str, ehdokkaat: list[dict]) -> np.ndarray:
+    return _pisteyta_parit_monta(cross_encoder, [(kysely, ehdokkaat)])[0]
+
+
+def _porrastuksen_viipaleet(top_k: int, ehdokkaita: int, porrastettu: bool) -> tuple[int, int]:
+    """Palauttaa porrastetun pisteytyksen ensimmäisen viipaleen ja sitä seuraavien viipaleiden koon."""
+    if not porrastettu:
+        return ehdokkaita, ehdokkaita
+    return max(top_k * PORRASTUS_ALKUKERROIN, PORRASTUS_MINIMI), max(top_k, PORRASTUS_MINIMI)
+
+
+def jarjesta_uudelleen(cross_encoder, kysely: str, ehdokkaat: list[dict], top_k: int,
+                       tehosteet: np.ndarray = None, porrastettu: bool = None,
+                       esipisteet: np.ndarray = None) -> list[dict]:
+    """Järjestää vektorihaun ehdokkaat cross-encoderilla ja palauttaa top_k parasta.
+
+    Porrastetussa tilassa ehdokkaat pisteytetään vektorihaun järjestyksessä viipaleittain,
+    ja pisteytys lopetetaan, kun kokonainen viipale ei enää muuta top_k-joukkoa.
+    `esipisteet` ovat valmiiksi lasketut cross-encoder-pisteet ensimmäiselle viipaleelle.
+    """
+    porrastettu = UUDELLEENJARJESTYS_PORRASTETTU if porrastettu is None else porrastettu
+    if tehosteet is None:
+        tehosteet = np.zeros(len(ehdokkaat), dtype=np.float32)
+    ensimmainen, askel = _porrastuksen_viipaleet(top_k, len(ehdokkaat), porrastettu)
+    if esipisteet is not None:
+        ensimmainen = len(esipisteet)
+
+    pisteet = np.full(len(ehdokkaat), -np.inf, dtype=np.float32)
+    pisteytetty = 0
+    while pisteytetty < len(ehdokkaat):
+        loppu = min(len(ehdokkaat), pisteytetty + (askel if pisteytetty else ensimmainen))
+        raja = np.partition(pisteet[:pisteytetty], -top_k)[-top_k] if pisteytetty >= top_k else -np.inf
+        if pisteytetty == 0 and esipisteet is not None:
+            ristipisteet = esipisteet[:loppu]
+        else:
+            ristipisteet = _pisteyta_parit(cross_encoder, kysely, ehdokkaat[pisteytetty:loppu])
+        pisteet[pisteytetty:loppu] = ristipisteet + tehosteet[pisteytetty:loppu]
+        muutti_karkea = bool(np.any(pisteet[pisteytetty:loppu] > raja))
+        pisteytetty = loppu
+        if not muutti_karkea:
+            break
+
+    if pisteytetty < len(ehdokkaat):
+        logging.info(f"Uudelleenjärjestys: top-{top_k} vakiintui, pisteytettiin {pisteytetty}/{len(ehdokkaat)} paria.")
+    else:
+        logging.info(f"Uudelleenjärjestys: pisteytettiin kaikki {pisteytetty} paria.")
+    for i in range(pisteytetty):
+        ehdokkaat[i]['pisteet'] = float(pisteet[i])
+    if PARIPISTE_VALIMUISTI_KOKO > 0:
+        tilastot = hae_pistevalimuisti().tilastot()
+        logging.info(f"Pistevälimuisti: {tilastot['osumat']} osumaa, {tilastot['ohitukset']} ohitusta "
+                     f"({tilastot['osumaprosentti']:.1f} %), {tilastot['koko']} paria tallessa.")
+    return sorted(ehdokkaat[:pisteytetty], key=lambda x: x['pisteet'], reverse=True)[:top_k]
+
+
+def _valmistele_haku(kysely: str, otsikko: str, resurssit: tuple, strategia_lahde: dict, siemenjae_lahde: dict,
+                     valitut_tehostesanat: set = None) -> tuple[list[dict], set, str, set]:
+    """Palauttaa kyselyn pakolliset jakeet ja niiden viitteet, strategialla laajennetun kyselyn ja tehostettavat sanat."""
+    jae_haku_kartta, viiteindeksi = resurssit[4], resurssit[6]
     viite_str_lista = poimi_raamatunviitteet(kysely)
     pakolliset_jakeet = []
     loytyneet_viitteet = set()
     for viite_str in viite_str_lista:
-        jakeet = hae_jakeet_viitteella(viite_str, jae_haku_kartta)
+        jakeet = hae_jakeet_viitteella(viite_str, jae_haku_kartta, viiteindeksi)
         for jae in jakeet:
             if jae["viite"] not in loytyneet_viitteet:
                 pakolliset_jakeet.append(jae)
                 loytyneet_viitteet.add(jae["viite"])
 
-    strategia_lahde = custom_strategiat if custom_strategiat is not None else STRATEGIA_SANAKIRJA
-    siemenjae_lahde = custom_siemenjakeet if custom_siemenjakeet is not None else STRATEGIA_SIEMENJAE_KARTTA
     laajennettu_kysely = kysely
     pien_kysely = kysely.lower()
-    tehostettavat_sanat = set()
-    
     if valitut_tehostesanat is None:
-        viite_pattern = r'((?:[1-3]\.\s)?[A-ZÅÄÖa-zåäö]+\.?\s\d+:\d+(?:-\d+)?)'
-        puhdistettu_otsikko = re.sub(viite_pattern, '', otsikko)
-        puhdistettu_otsikko = re.sub(r'[^\w\s]', '', puhdistettu_otsikko)
-        stop_words = {
-            'aiemmin', 'aika', 'aikaa', 'aikaan', 'aikaisemmin', 'aikaisin', 'aikana', 'aikoa', 'aina', 'ainakaan',
-            'ainakin', 'ainoa', 'ainut', 'aivan', 'alas', 'alkuisin', 'alla', 'alle', 'alta', 'aluksi', 'antaa', 'asia', 'asti',
-            'edes', 'edessä', 'edestä', 'ehkä', 'ei', 'eikä', 'eilen', 'eivät', 'eli', 'ellei', 'emme', 'en', 'enemmän', 'eniten',
-            'ensin', 'entinen', 'entä', 'eri', 'erittäin', 'esimerkiksi', 'et', 'eteen', 'etenkin', 'ette', 'he', 'heidän',
-            'hän', 'hänen', 'ihan', 'ilman', 'itse', 'itsensä', 'ja', 'jo', 'johon', 'joiden', 'joihin', 'joiksi', 'joilla',
-            'joille', 'joilta', 'joina', 'joissa', 'joista', 'joita', 'joka', 'jokainen', 'jokin', 'joko', 'joku', 'jolla',
-            'jolle', 'jolloin', 'jolta', 'jonka', 'jonkin', 'jonne', 'jos', 'joskus', 'jossa', 'josta', 'jota', 'jotain',
-            'joten', 'jotka', 'jotta', 'juuri', 'jälkeen', 'kanssa', 'keiden', 'keihin', 'keillä', 'keille', 'keiltä',
-            'keissä', 'keistä', 'keitä', 'kuka', 'kukaan', 'ken', 'kerran', 'kerta', 'kertaa', 'kesken', 'koska', 'koskaan',
-            'kuin', 'kuinka', 'kuitenkaan', 'kuitenkin', 'kun', 'kuten', 'kyllä', 'kymmenen', 'lähellä', 'läheltä', 'lähes',
-            'läpi', 'liian', 'lisäksi', 'me', 'meidän', 'melkein', 'melko', 'mihin', 'mikin', 'miksi', 'mikä', 'mikään',
-            'mille', 'milloin', 'millä', 'miltä', 'minkä', 'minne', 'minun', 'minut', 'minä', 'missä', 'mistä', 'miten',
-            'mitkä', 'mitä', 'mitään', 'mukaan', 'mutta', 'muu', 'muut', 'muuta', 'muutama', 'muuten', 'myös', 'myöskään',
-            'ne', 'neljä', 'niiden', 'niihin', 'niiksi', 'niillä', 'niille', 'niiltä', 'niin', 'niinä', 'niissä', 'niistä',
-            'niitä', 'noin', 'nopeasti', 'nyt', 'nämä', 'näiden', 'näihin', 'näiksi', 'näillä', 'näille', 'näiltä', 'näinä',
-            'näissä', 'näistä', 'näitä', 'ole', 'olemme', 'olen', 'olet', 'olette', 'oleva', 'olevan', 'olevat', 'oli',
-            'olimme', 'olin', 'olisi', 'olisimme', 'olisin', 'olisit', 'olisitte', 'olivat', 'olla', 'olleet', 'ollut',
-            'oma', 'omat', 'on', 'ovat', 'paljon', 'paremmin', 'perusteella', 'pian', 'pitkin', 'pitäisi', 'pitää', 'pois',
-            'puolesta', 'puolestaan', 'päälle', 'päin', 'saakka', 'sata', 'se', 'sekä', 'sen', 'siellä', 'sieltä', 'siihen',
-            'siinä', 'siitä', 'sijaan', 'siksi', 'sillä', 'silloin', 'silti', 'sinne', 'sinun', 'sinut', 'sinä', 'sisällä',
-            'siten', 'sitten', 'sitä', 'suoraan', 'suuri', 'suurin', 'tai', 'taas', 'takana', 'takia', 'tavalla', 'tavoin',
-            'te', 'teidän', 'tietenkin', 'todella', 'toinen', 'toisaalla', 'toisaalta', 'toistaiseksi', 'toki', 'tosin',
-            'tuhannen', 'tuhat', 'tulee', 'tulla', 'tämä', 'tämän', 'tänään', 'tässä', 'tästä', 'täysin', 'täytyy', 'täällä',
-            'täältä', 'usea', 'useasti', 'usein', 'useita', 'uusi', 'uusia', 'uutta', 'vaan', 'vaikka', 'vain', 'varmasti',
-            'varsinkin', 'varten', 'vasta', 'vastaan', 'verran', 'vielä', 'viime', 'viimeksi', 'voida', 'voimme', 'voin',
-            'voit', 'voitte', 'voivat', 'vuoksi', 'vuosi', 'vuotta', 'vähemmän', 'vähän', 'yhtä', 'yhtään', 'yksi', 'yleensä',
-            'yli', 'myöskin'
-        }
-        sanat = puhdistettu_otsikko.split()
-        potentiaaliset_sanat = {s.lower() for s in sanat if s.lower() not in stop_words and len(s) > 2 and s and s[0].isupper()}
-        tehostettavat_sanat = {sana for sana in potentiaaliset_sanat if sana in raamattu_sanasto}
+        tehostettavat_sanat = set(poimi_tehostesanat(otsikko))
     else:
         tehostettavat_sanat = valitut_tehostesanat
     if tehostettavat_sanat:
@@ -274,95 +954,335 @@ def etsi_merkityksen_mukaan(kysely: str, otsikko: str, top_k: int = 15,
                 break
             else:
                 logging.info(f"Strategia '{avainsana}' hylättiin epärelevanttina.")
-    
-    alyhaun_tulokset = []
-    if top_k > 0:
-        alyhaun_koko = max(0, top_k - len(pakolliset_jakeet))
-        if alyhaun_koko > 0:
-            haettava_maara = min(alyhaun_koko * max(5, 11 - (alyhaun_koko // 10)), paaindeksi.ntotal)
-            if haettava_maara > 0:
-                kysely_vektori = model_encoder.encode([f"query: {laajennettu_kysely}"])
-                _, indeksit = paaindeksi.search(np.array(kysely_vektori, dtype=np.float32), haettava_maara)
-                ehdokkaat = [{'viite': v, 'teksti': jae_haku_kartta.get(v, "")} for i in indeksit[0] if (v := paakartta.get(str(i))) and v not in loytyneet_viitteet]
-                if ehdokkaat:
-                    parit = [[laajennettu_kysely, j["teksti"]] for j in ehdokkaat]
-                    pisteet = cross_encoder.predict(parit, show_progress_bar=False)
-                    for i, j in enumerate(ehdokkaat):
-                        j['pisteet'] = pisteet[i]
-                    if tehostettavat_sanat:
-                        for jae in ehdokkaat:
-                            found_words = {sana for sana in tehostettavat_sanat if re.search(r'\b' + re.escape(sana) + r'\b', jae['teksti'].lower())}
-                            if found_words:
-                                jae['pisteet'] += 2.0 * len(found_words)
-                                logging.info(f"  -> Tehostettiin jaetta {jae['viite']} sanoilla: {found_words}")
-                    alyhaun_tulokset = sorted(ehdokkaat, key=lambda x: x['pisteet'], reverse=True)[:alyhaun_koko]
-
-    yhdistetyt_tulokset = pakolliset_jakeet + alyhaun_tulokset
-    return yhdistetyt_tulokset, tehostettavat_sanat
+    return pakolliset_jakeet, loytyneet_viitteet, laajennettu_kysely, tehostettavat_sanat
+
+
+def etsi_merkityksen_mukaan_monta(haut: list[tuple[str, str]], top_k: int = 15,
+                                  custom_strategiat: dict = None,
+                                  custom_siemenjakeet: dict = None,
+                                  valitut_tehostesanat: list = None,
+                                  hybridihaku: bool = None) -> list[tuple[list[dict], set]]:
+    """Hakee usean kyselyn [(kysely, otsikko), ...] jakeet kerralla; tulokset palautetaan samassa järjestyksessä.
+
+    Kyselyt koodataan yhtenä eränä ja haetaan yhdellä FAISS-haulla (nq = kyselyjen määrä), ja cross-encoder
+    pisteyttää kaikkien kyselyjen ensimmäiset ehdokasviipaleet samassa kutsussa.
+    `valitut_tehostesanat` on kyselykohtainen lista (None = tehostesanat poimitaan otsikosta).
+    """
+    resurssit = lataa_resurssit()
+    if not all(resurssit):
+        return [([], set()) for _ in haut]
+    (model_encoder, cross_encoder, paaindeksi, paakartta, jae_haku_kartta, _, _,
+     _, sanahakemisto, jae_numerot, bm25) = resurssit
+    hybridihaku = HYBRIDIHAKU if hybridihaku is None else hybridihaku
+    strategia_lahde = custom_strategiat if custom_strategiat is not None else STRATEGIA_SANAKIRJA
+    siemenjae_lahde = custom_siemenjakeet if custom_siemenjakeet is not None else STRATEGIA_SIEMENJAE_KARTTA
+    if valitut_tehostesanat is None:
+        valitut_tehostesanat = [None] * len(haut)
+    valmistellut = [_valmistele_haku(kysely, otsikko, resurssit, strategia_lahde, siemenjae_lahde, tehostesanat)
+                    for (kysely, otsikko), tehostesanat in zip(haut, valitut_tehostesanat)]
+
+    alyhaun_koot = [max(0, top_k - len(pakolliset)) if top_k > 0 else 0 for pakolliset, *_ in valmistellut]
+    haettavat_maarat = []
+    for alyhaun_koko in alyhaun_koot:
+        if hybridihaku:
+            haettavat_maarat.append(min(alyhaun_koko * HYBRIDI_TIHEA_KERROIN, paaindeksi.ntotal))
+        else:
+            haettavat_maarat.append(min(alyhaun_koko * max(5, 11 - (alyhaun_koko // 10)), paaindeksi.ntotal))
+    haettavat = [i for i, maara in enumerate(haettavat_maarat) if maara > 0]
+
+    ehdokaslistat = {}
+    if haettavat:
+        kysely_vektorit = koodaa_valimuistilla(model_encoder, [f"query: {valmistellut[i][2]}" for i in haettavat])
+        _, indeksit = paaindeksi.search(kysely_vektorit, max(haettavat_maarat[i] for i in haettavat))
+        for rivi, i in enumerate(haettavat):
+            loytyneet_viitteet = valmistellut[i][1]
+            viitteet = [v for j in indeksit[rivi][:haettavat_maarat[i]]
+                        if j >= 0 and (v := paakartta[j]) and v not in loytyneet_viitteet]
+            if hybridihaku:
+                sanahaun_kysely = VIITE_PATTERN.sub('', haut[i][0])
+                sanahaun_viitteet = [v for v, _ in bm25.hae(sanahaun_kysely, alyhaun_koot[i] * HYBRIDI_BM25_KERROIN)
+                                     if v not in loytyneet_viitteet]
+                uusia = len(set(sanahaun_viitteet) - set(viitteet))
+                viitteet = yhdista_rrf(viitteet, sanahaun_viitteet)
+                logging.info(f"Hybridihaku: BM25 toi {uusia} uutta ehdokasta ({len(viitteet)} yhteensä).")
+            ehdokkaat = [{'viite': v, 'teksti': jae_haku_kartta.get(v, "")} for v in viitteet]
+            if ehdokkaat:
+                ehdokaslistat[i] = ehdokkaat
+
+    # Kaikkien kyselyjen ensimmäiset viipaleet pisteytetään yhdellä cross-encoder-kutsulla
+    porrastettu = UUDELLEENJARJESTYS_PORRASTETTU
+    viipaleet = {i: ehdokkaat[:_porrastuksen_viipaleet(alyhaun_koot[i], len(ehdokkaat), porrastettu)[0]]
+                 for i, ehdokkaat in ehdokaslistat.items()}
+    esipisteet = dict(zip(viipaleet, _pisteyta_parit_monta(
+        cross_encoder, [(valmistellut[i][2], viipale) for i, viipale in viipaleet.items()])))
+    if len(haut) > 1:
+        logging.info(f"Erähaku: {len(haut)} kyselyä, {len(haettavat)} vektorihakua yhdellä FAISS-kutsulla, "
+                     f"{sum(map(len, viipaleet.values()))} paria yhdellä cross-encoder-kutsulla.")
+
+    tulokset = []
+    for i, (pakolliset_jakeet, _, laajennettu_kysely, tehostettavat_sanat) in enumerate(valmistellut):
+        alyhaun_tulokset = []
+        if i in ehdokaslistat:
+            ehdokkaat = ehdokaslistat[i]
+            tehosteet = laske_tehosteet(ehdokkaat, tehostettavat_sanat, sanahakemisto, jae_numerot)
+            alyhaun_tulokset = jarjesta_uudelleen(cross_encoder, laajennettu_kysely, ehdokkaat, alyhaun_koot[i],
+                                                  tehosteet, porrastettu, esipisteet[i])
+        tulokset.append((pakolliset_jakeet + alyhaun_tulokset, tehostettavat_sanat))
+    return tulokset
+
+
+def etsi_merkityksen_mukaan(kysely: str, otsikko: str, top_k: int = 15,
+                          custom_strategiat: dict = None,
+                          custom_siemenjakeet: dict = None,
+                          valitut_tehostesanat: set = None,
+                          hybridihaku: bool = None) -> tuple[list[dict], set]:
+    return etsi_merkityksen_mukaan_monta([(kysely, otsikko)], top_k, custom_strategiat, custom_siemenjakeet,
+                                         [valitut_tehostesanat], hybridihaku)[0]
 
 
 def etsi_puhtaalla_haulla(kysely: str, top_k: int = 15) -> list[dict]:
     resurssit = lataa_resurssit()
     if not all(resurssit):
         return []
-    model, _, paaindeksi, paakartta, jae_haku_kartta, _ = resurssit
-    kysely_vektori = model.encode([f"query: {kysely}"])
-    _, indeksit = paaindeksi.search(np.array(kysely_vektori, dtype=np.float32), top_k * 5)
-    ehdokkaat = [{'viite': v, 'teksti': jae_haku_kartta.get(v, "")} for i in indeksit[0] if (v := paakartta.get(str(i)))]
+    model, _, paaindeksi, paakartta, jae_haku_kartta, *_ = resurssit
+    kysely_vektori = koodaa_valimuistilla(model, [f"query: {kysely}"])
+    _, indeksit = paaindeksi.search(kysely_vektori, top_k * 5)
+    ehdokkaat = [{'viite': v, 'teksti': jae_haku_kartta.get(v, "")} for i in indeksit[0] if i >= 0 and (v := paakartta[i])]
     return ehdokkaat[:top_k]
 
 
-def arvioi_tulokset(aihe: str, tulokset: list, malli_nimi: str = ARVIOINTI_MALLI_ENSISIJAINEN) -> dict:
+def _arvioi_yksittainen_jae(aihe: str, jae: dict, malli_nimi: str, jarjestys: str) -> tuple[dict, str, float]:
+    start_time = time.time()
+    logging.info(f"  - Arvioidaan jae {jarjestys}: {jae['viite']}...")
+
+    kehote = ARVIOINTI_KEHOTE.format(aihe=aihe, viite=jae['viite'], teksti=jae['teksti'])
+
+    data, malli = suorita_varmistettu_json_kutsu(
+        [malli_nimi, ARVIOINTI_MALLI_VARAMALLI],
+        kehote,
+        required_keys=['arvosana', 'perustelu']
+    )
+
+    kesto = time.time() - start_time
+    logging.info(f"    -> {jae['viite']} kesto: {kesto:.2f} sekuntia.")
+    return data, malli, kesto
+
+
+@st.cache_resource
+def hae_arviovalimuisti() -> ArvioValimuisti | None:
+    if not ARVIO_VALIMUISTI_TIEDOSTO:
+        return None
+    try:
+        return ArvioValimuisti(ARVIO_VALIMUISTI_TIEDOSTO, ARVIO_VALIMUISTI_MAKSIMIKOKO,
+                               ARVIO_VALIMUISTI_MAKSIMI_IKA_PAIVAT)
+    except Exception as e:
+        logging.warning(f"Arviovälimuistia ei voitu avata ({e}). Jatketaan ilman välimuistia.")
+        return None
+
+
+def _arvion_valimuistiavain(malli_nimi: str, aihe: str, jae: dict) -> str:
+    kehotepohjat = ARVIOINTI_KEHOTE + ERA_ARVIOINTI_KEHOTE + ERA_ARVIOINTI_JAE
+    return ArvioValimuisti.avain(kehotepohjat, malli_nimi, aihe, jae['viite'], jae['teksti'])
+
+
+def _onko_kelvollinen_arvio(arvio) -> bool:
+    return (isinstance(arvio, dict)
+            and isinstance(arvio.get('arvosana'), (int, float))
+            and not isinstance(arvio.get('arvosana'), bool)
+            and isinstance(arvio.get('perustelu'), str))
+
+
+def _arvioi_jae_era(aihe: str, era: list, malli_nimi: str, jarjestys: str) -> list[tuple[dict, str, float]]:
+    """Arvioi jae-erän yhdellä kutsulla. Puuttuvat tai virheelliset arviot haetaan yksitellen."""
+    if len(era) == 1:
+        return [_arvioi_yksittainen_jae(aihe, era[0], malli_nimi, jarjestys)]
+
+    start_time = time.time()
+    logging.info(f"  - Arvioidaan erä {jarjestys} ({len(era)} jaetta): {', '.join(j['viite'] for j in era)}...")
+    jakeet_kehotteessa = "\n".join(
+        ERA_ARVIOINTI_JAE.format(nro=i + 1, viite=jae['viite'], teksti=jae['teksti']) for i, jae in enumerate(era)
+    )
+    kehote = ERA_ARVIOINTI_KEHOTE.format(aihe=aihe, jakeet=jakeet_kehotteessa, esimerkkiviite=era[0]['viite'])
+    data, malli = suorita_varmistettu_json_kutsu(
+        [malli_nimi, ARVIOINTI_MALLI_VARAMALLI],
+        kehote,
+        required_keys=['arviot']
+    )
+
+    pyydetyt = {jae['viite'] for jae in era}
+    saadut = {}
+    arviot = data.get('arviot') if isinstance(data.get('arviot'), list) else []
+    for arvio in arviot:
+        if not _onko_kelvollinen_arvio(arvio) or not isinstance(arvio.get('viite'), str):
+            continue
+        viite = arvio['viite'].strip()
+        if viite in pyydetyt and viite not in saadut:
+            saadut[viite] = {'arvosana': arvio['arvosana'], 'perustelu': arvio['perustelu']}
+    kesto_per_jae = (time.time() - start_time) / len(era)
+    logging.info(f"    -> Erä {jarjestys}: {len(saadut)}/{len(era)} arviota, kesto {kesto_per_jae * len(era):.2f} sekuntia.")
+
+    vastaukset = []
+    for i, jae in enumerate(era):
+        if jae['viite'] in saadut:
+            vastaukset.append((saadut[jae['viite']], malli, kesto_per_jae))
+        else:
+            logging.warning(f"Erän vastauksesta puuttui kelvollinen arvio jakeelle {jae['viite']}. Arvioidaan erikseen.")
+            vastaukset.append(_arvioi_yksittainen_jae(aihe, jae, malli_nimi, f"{jarjestys}.{i+1}"))
+    return vastaukset
+
+
+def _arvioi_jakeet(aihe: str, tulokset: list, malli_nimi: str, rinnakkaisuus: int, eran_koko: int,
+                   kayta_valimuistia: bool):
+    """Tuottaa (jae, arvio tai None, kesto) sitä mukaa kuin arviot valmistuvat; välimuistista löytyvät ensin (kesto None).
+
+    Eriä on kerrallaan työn alla enintään `rinnakkaisuus`, joten kun kutsuja lopettaa iteroinnin,
+    lähettämättömiä eriä ei arvioida lainkaan. Jo käynnissä olevia kutsuja ei voi keskeyttää: enintään
+    `rinnakkaisuus` erää arvioidaan loppuun taustalla ja niiden tulokset hylätään.
+    """
+    valimuisti = hae_arviovalimuisti() if kayta_valimuistia else None
+    valimuistista = set()
+    if valimuisti:
+        for jae in tulokset:
+            if (tallennettu := valimuisti.hae(_arvion_valimuistiavain(malli_nimi, aihe, jae))) is not None:
+                valimuistista.add(jae['viite'])
+                yield jae, {
+                    'arvosana': tallennettu['arvosana'],
+                    'perustelu': tallennettu['perustelu'],
+                    'viite': jae['viite'],
+                    'mallin_nimi': tallennettu['mallin_nimi'],
+                }, None
+        if valimuistista:
+            logging.info(f"Arviovälimuisti: {len(valimuistista)}/{len(tulokset)} jaetta löytyi valmiiksi arvioituna.")
+    arvioitavat = [jae for jae in tulokset if jae['viite'] not in valimuistista]
+
+    eran_koko = max(1, eran_koko)
+    erat = [arvioitavat[i:i + eran_koko] for i in range(0, len(arvioitavat), eran_koko)]
+    rinnakkaisuus = max(1, min(rinnakkaisuus, len(erat)))
+    logging.info(f"Aloitetaan {len(tulokset)} jakeen arviointi {len(erat)} erässä "
+                 f"(enintään {eran_koko} jaetta per kutsu, rinnakkaisuus: {rinnakkaisuus})...")
+
+    def kasittele(era, eravastaus):
+        for jae, (data, malli, kesto) in zip(era, eravastaus):
+            if "virhe" in data:
+                logging.warning(f"Jae {jae['viite']} arviointi epäonnistui kaikilla malleilla.")
+                yield jae, None, kesto
+                continue
+            data['viite'] = jae['viite']
+            data['mallin_nimi'] = malli
+            # Välimuistiin vain pyydetyn mallin arviot: avain on pyydetty malli, joten varamallin
+            # arvio tarjoiltaisiin myöhemmin pyydetyn mallin arviona
+            if valimuisti and malli == malli_nimi and _onko_kelvollinen_arvio(data):
+                valimuisti.tallenna(_arvion_valimuistiavain(malli_nimi, aihe, jae),
+                                    data['arvosana'], data['perustelu'], malli)
+            yield jae, data, kesto
+
+    if rinnakkaisuus == 1:
+        for i, era in enumerate(erat):
+            yield from kasittele(era, _arvioi_jae_era(aihe, era, malli_nimi, f"{i+1}/{len(erat)}"))
+        return
+
+    jono = iter(enumerate(erat))
+    kesken = {}
+    pooli = _luo_saiepooli(rinnakkaisuus)
+    try:
+        def laheta_seuraava():
+            if (seuraava := next(jono, None)) is not None:
+                i, era = seuraava
+                kesken[pooli.submit(_arvioi_jae_era, aihe, era, malli_nimi, f"{i+1}/{len(erat)}")] = era
+
+        for _ in range(rinnakkaisuus):
+            laheta_seuraava()
+        while kesken:
+            valmiit, _ = wait(kesken, return_when=FIRST_COMPLETED)
+            for tehtava in valmiit:
+                era = kesken.pop(tehtava)
+                laheta_seuraava()
+                yield from kasittele(era, tehtava.result())
+    finally:
+        # Kesken jäänyt iterointi: aloittamattomat erät perutaan, käynnissä olevia ei jäädä odottamaan
+        for tehtava in kesken:
+            tehtava.cancel()
+        pooli.shutdown(wait=False, cancel_futures=True)
+
+
+def arvioi_tulokset_virtana(aihe: str, tulokset: list, malli_nimi: str = ARVIOINTI_MALLI_ENSISIJAINEN,
+                            rinnakkaisuus: int = ARVIOINTI_RINNAKKAISUUS,
+                            eran_koko: int = ARVIOINTI_JAETTA_PER_KUTSU,
+                            kayta_valimuistia: bool = True):
+    """Tuottaa jakeiden arviot valmistumisjärjestyksessä; epäonnistuneita arvioita ei tuoteta."""
+    for _, arvio, _ in _arvioi_jakeet(aihe, tulokset, malli_nimi, rinnakkaisuus, eran_koko, kayta_valimuistia):
+        if arvio is not None:
+            yield arvio
+
+
+def laske_korvausten_nousu(arvosanat: list[float], korvattavat: list[float]) -> float:
+    """Pistesumman nousu, kun parhaat arvosanat korvaavat heikoimmat jakeet pareittain (vain parantavat korvaukset)."""
+    parhaat = sorted(arvosanat, reverse=True)
+    return sum(max(0.0, uusi - vanha) for uusi, vanha in zip(parhaat, sorted(korvattavat)))
+
+
+def arvioi_kunnes_riittaa(aihe: str, ehdokkaat: list, korvattavat: list[float], tarvittava_nousu: float,
+                          malli_nimi: str = ARVIOINTI_MALLI_ENSISIJAINEN,
+                          rinnakkaisuus: int = ARVIOINTI_RINNAKKAISUUS,
+                          eran_koko: int = ARVIOINTI_JAETTA_PER_KUTSU) -> list[dict]:
+    """Arvioi ehdokkaita virtana ja lopettaa, kun arvioiduilla ehdokkailla voidaan korvata `korvattavat`
+    (heikkojen jakeiden arvosanat) niin, että pistesumma nousee vähintään `tarvittava_nousu` verran.
+
+    Palauttaa siihen mennessä saadut arviot; arvioimatta jääneitä ehdokkaita ei palauteta.
+    """
+    arviot = []
+    arvosanat = []
+    virta = arvioi_tulokset_virtana(aihe, ehdokkaat, malli_nimi, rinnakkaisuus, eran_koko)
+    for arvio in virta:
+        arviot.append(arvio)
+        if _onko_kelvollinen_arvio(arvio):
+            arvosanat.append(float(arvio['arvosana']))
+        if tarvittava_nousu > 0 and laske_korvausten_nousu(arvosanat, korvattavat) >= tarvittava_nousu:
+            virta.close()
+            if len(arviot) < len(ehdokkaat):
+                logging.info(f"Varhainen lopetus: tavoite saavutettavissa {len(arviot)}/{len(ehdokkaat)} "
+                             f"arvioidulla ehdokkaalla. Loput jätetään arvioimatta.")
+            break
+    return arviot
+
+
+def arvioi_tulokset(aihe: str, tulokset: list, malli_nimi: str = ARVIOINTI_MALLI_ENSISIJAINEN,
+                    rinnakkaisuus: int = ARVIOINTI_RINNAKKAISUUS,
+                    eran_koko: int = ARVIOINTI_JAETTA_PER_KUTSU,
+                    kayta_valimuistia: bool = True) -> dict:
     if not tulokset:
         return {"kokonaisarvosana": 0.0, "jae_arviot": []}
 
-    kaikki_jae_arviot = []
     yhteiskesto = 0
-    logging.info(f"Aloitetaan {len(tulokset)} jakeen yksittäisarviointi...")
-
-    for i, jae in enumerate(tulokset):
-        start_time = time.time()
-        logging.info(f"  - Arvioidaan jae {i+1}/{len(tulokset)}: {jae['viite']}...")
-        
-        kehote = (
-            f"ROOLI: Olet teologian asiantuntija. Tehtäväsi on arvioida, kuinka hyvin YKSI Raamatun jae vastaa annettua aihetta.\n"
-            f"AIHE: \"{aihe}\"\n"
-            f"ARVIOITAVA JAE:\n"
-            f"- Viite: \"{jae['viite']}\"\n"
-            f"- Teksti: \"{jae['teksti']}\"\n"
-            f"VASTAA AINOASTAAN JSON-MUODOSSA. Anna arvosana (1.0-10.0) ja lyhyt, ytimekäs suomenkielinen perustelu.\n"
-            f"ESIMERKKIVASTAUS: {{\"arvosana\": 8.5, \"perustelu\": \"Sopii hyvin, koska...\"}}\n"
-            f"Sinun vastauksesi:"
-        )
-        
-        data, malli = suorita_varmistettu_json_kutsu(
-            [malli_nimi, ARVIOINTI_MALLI_VARAMALLI],
-            kehote,
-            required_keys=['arvosana', 'perustelu']
-        )
-        
-        end_time = time.time()
-        kesto = end_time - start_time
-        yhteiskesto += kesto
-        logging.info(f"    -> Kesto: {kesto:.2f} sekuntia.")
+    arvioituja = 0
+    aloitusaika = time.time()
+    saadut = {}
+    for jae, arvio, kesto in _arvioi_jakeet(aihe, tulokset, malli_nimi, rinnakkaisuus, eran_koko, kayta_valimuistia):
+        if kesto is not None:
+            yhteiskesto += kesto
+            arvioituja += 1
+        if arvio is not None:
+            saadut[jae['viite']] = arvio
+    kaikki_jae_arviot = [saadut[jae['viite']] for jae in tulokset if jae['viite'] in saadut]
 
-        if "virhe" not in data:
-            data['viite'] = jae['viite']
-            data['mallin_nimi'] = malli
-            kaikki_jae_arviot.append(data)
-        else:
-            logging.warning(f"Jae {jae['viite']} arviointi epäonnistui kaikilla malleilla.")
+    valimuisti = hae_arviovalimuisti() if kayta_valimuistia else None
+    if valimuisti:
+        tilastot = valimuisti.tilastot()
+        logging.info(f"Arviovälimuisti: {tilastot['osumat']} osumaa, {tilastot['ohitukset']} ohitusta "
+                     f"({tilastot['osumaprosentti']:.1f} %), {tilastot['koko']} arviota tallessa.")
 
     if not kaikki_jae_arviot:
         return {"kokonaisarvosana": 0.0, "jae_arviot": []}
 
     valid_scores = [a.get('arvosana') for a in kaikki_jae_arviot if isinstance(a.get('arvosana'), (int, float))]
     kokonaisarvosana = sum(valid_scores) / len(valid_scores) if valid_scores else 0.0
-    
-    keskiarvo_kesto = yhteiskesto / len(tulokset) if tulokset else 0
+
+    keskiarvo_kesto = yhteiskesto / arvioituja if arvioituja else 0
+    seinakelloaika = time.time() - aloitusaika
     logging.info("Kaikki jakeet arvioitu onnistuneesti.")
-    logging.info(f"Arviointien yhteiskesto: {yhteiskesto:.2f}s, keskimäärin {keskiarvo_kesto:.2f}s per jae.")
-    
+    logging.info(f"Arviointien yhteiskesto: {yhteiskesto:.2f}s, keskimäärin {keskiarvo_kesto:.2f}s per jae "
+                 f"(todellinen kesto {seinakelloaika:.2f}s).")
+
     return {
         "kokonaisarvosana": kokonaisarvosana,
         "kokonaisperustelu": f"Yhteenveto {len(kaikki_jae_arviot)} jakeen yksittäisarvioinnista.",
@@ -374,11 +1294,17 @@ def suorita_tarkennushaku(ydinjakeet: list, vanhat_tulokset_viitteet: set, haett
     resurssit = lataa_resurssit()
     if not all(resurssit):
         return []
-    model, _, paaindeksi, paakartta, jae_haku_kartta, _ = resurssit
+    model, _, paaindeksi, paakartta, jae_haku_kartta, *_ = resurssit
     if not ydinjakeet:
         return []
-    ydinjakeiden_tekstit = [j['teksti'] for j in ydinjakeet]
-    ydin_vektorit = model.encode(ydinjakeiden_tekstit)
+    # Ydinjakeet ovat jo indeksissä, joten niiden vektorit luetaan sieltä koodaamatta uudelleen.
+    ydin_vektorit, loydetyt = hae_jaevektorit([j['viite'] for j in ydinjakeet])
+    loydetyt = set(loydetyt)
+    koodattavat = [j['teksti'] for j in ydinjakeet if j['viite'] not in loydetyt]
+    if koodattavat:
+        with _mallilukko:
+            uudet_vektorit = model.encode(koodattavat)
+        ydin_vektorit = np.vstack([v for v in (ydin_vektorit, uudet_vektorit) if v.size])
     keskipiste_vektori = np.mean(ydin_vektorit, axis=0)
     
     # Haetaan hieman enemmän, jotta on varaa suodattaa pois jo nähdyt
@@ -389,7 +1315,7 @@ def suorita_tarkennushaku(ydinjakeet: list, vanhat_tulokset_viitteet: set, haett
     
     uudet_ehdokkaat = []
     for i in indeksit[0]:
-        viite = paakartta.get(str(i))
+        viite = paakartta[i] if i >= 0 else None
         if viite and viite not in vanhat_tulokset_viitteet:
             uudet_ehdokkaat.append({'viite': viite, 'teksti': jae_haku_kartta.get(viite, "")})
         if len(uudet_ehdokkaat) >= haettava_maara:
@@ -398,6 +1324,64 @@ def suorita_tarkennushaku(ydinjakeet: list, vanhat_tulokset_viitteet: set, haett
     return uudet_ehdokkaat
 
 
+class TarkennushaunEnnakointi:
+    """Laskee seuraavan parannuskierroksen tarkennushaun taustasäikeessä nykyisen erän LLM-arvioinnin aikana.
+
+    Ennakoitua tulosta käytetään, jos ydinjakeet ovat samat kuin ennakoitaessa ja jo nähtyjä viitteitä on
+    tullut lisää enintään ennakoidun haun varan verran; uudet nähdyt suodatetaan pois tuloksesta. Muuten
+    ennakoitu tulos hylätään ja haku tehdään tavalliseen tapaan. Käytetyt ja hylätyt ennakoinnit
+    lasketaan (osumat, ohitukset) ja kirjataan lokiin suljettaessa.
+    """
+
+    def __init__(self):
+        self._pooli = _luo_saiepooli(1)
+        self._avain = None
+        self._tulos = None
+        self.osumat = 0
+        self.ohitukset = 0
+
+    def ennakoi(self, ydinjakeet: list, vanhat_tulokset_viitteet: set, haettava_maara: int):
+        """Käynnistää haun; `haettava_maara` sisältää varan viitteille, jotka merkitään nähdyiksi ennen käyttöä."""
+        if self._tulos is not None:
+            self._tulos.cancel()
+            self.ohitukset += 1
+        self._avain = (frozenset(j['viite'] for j in ydinjakeet), frozenset(vanhat_tulokset_viitteet), haettava_maara)
+        self._tulos = self._pooli.submit(suorita_tarkennushaku, list(ydinjakeet), set(vanhat_tulokset_viitteet),
+                                         haettava_maara)
+
+    def hae(self, ydinjakeet: list, vanhat_tulokset_viitteet: set, haettava_maara: int) -> list:
+        """Palauttaa saman kuin suorita_tarkennushaku; ennakoitu tulos käytetään, jos se on yhä pätevä."""
+        tulos, self._tulos = self._tulos, None
+        if tulos is not None:
+            ydin, ennakoidut_nahdyt, ennakoitu_maara = self._avain
+            lisatyt = set(vanhat_tulokset_viitteet) - ennakoidut_nahdyt
+            # Haun järjestys ei riipu nähdyistä viitteistä, joten suuremman haun alkuosa suodatettuna vastaa
+            # suoraa hakua, kunhan poistettavia on enintään ennakoidun haun varan verran
+            if (ydin == frozenset(j['viite'] for j in ydinjakeet)
+                    and ennakoidut_nahdyt <= set(vanhat_tulokset_viitteet)
+                    and haettava_maara + len(lisatyt) <= ennakoitu_maara):
+                try:
+                    ehdokkaat = tulos.result()
+                except Exception as e:
+                    logging.warning(f"Ennakoitu tarkennushaku epäonnistui ({e}). Haetaan uudelleen.")
+                else:
+                    self.osumat += 1
+                    logging.info("Tarkennushaku: käytetään taustalla ennakoitua tulosta.")
+                    return [j for j in ehdokkaat if j['viite'] not in lisatyt][:haettava_maara]
+            else:
+                tulos.cancel()
+                logging.info("Tarkennushaku: ydinjakeet tai haettava määrä muuttuivat, ennakoitu tulos hylätään.")
+            self.ohitukset += 1
+        return suorita_tarkennushaku(ydinjakeet, vanhat_tulokset_viitteet, haettava_maara)
+
+    def sulje(self):
+        if self._tulos is not None:
+            self.ohitukset += 1
+        self._pooli.shutdown(wait=False, cancel_futures=True)
+        if self.osumat or self.ohitukset:
+            logging.info(f"Tarkennushaun ennakointi: {self.osumat} käytettyä, {self.ohitukset} hylättyä ennakointia.")
+
+
 def ehdota_uutta_strategiaa(aihe: str, arvio: dict, edellinen_ehdotus: dict = None) -> dict:
     kokonaisperustelu = arvio.get('kokonaisperustelu', 'Ei perustelua.')
     analyysi_kehote = (
@@ -458,9 +1442,13 @@ def luo_avainsana_selitteen_pohjalta(selite: str) -> list:
     return data.get("avainsanat", [])
 
 
+# Rinnakkaiset osiot eivät saa kirjoittaa logic.py-tiedostoa yhtä aikaa
+_strategian_tallennuslukko = threading.Lock()
+
+
 def tallenna_uusi_strategia(avainsanat: list, selite: str):
     try:
-        with open(LOGIC_TIEDOSTOPOLKU, 'r+', encoding='utf-8') as f:
+        with _strategian_tallennuslukko, open(LOGIC_TIEDOSTOPOLKU, 'r+', encoding='utf-8') as f:
             content = f.read()
             temp_sanakirja = STRATEGIA_SANAKIRJA.copy()
             for sana in avainsanat:
@@ -1,14 +1,16 @@
 # luo_siemenjae_indeksi.py
-import json
 import logging
-import faiss
-import numpy as np
 from sentence_transformers import SentenceTransformer
 
+from indeksityokalut import paivita_indeksi
+from korpus import lataa_korpus
+
 # --- MÄÄRITYKSET ---
 RAAMATTU_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/bible.json"
+KORPUS_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_korpus.npz"
 SIEMENJAE_INDEKSI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/siemenjae_indeksi.faiss"
 SIEMENJAE_KARTTA_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/siemenjae_kartta.json"
+SIEMENJAE_MANIFESTI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/siemenjae_manifesti.json"
 EMBEDDING_MALLI = "TurkuNLP/sbert-cased-finnish-paraphrase"
 
 # --- KURATOITU LISTA SUPERJAKEISTA ---
@@ -71,8 +73,7 @@ def luo_siemenjae_indeksi():
     logging.info("Aloitetaan siemenjae-vektoritietokannan luonti...")
 
     try:
-        with open(RAAMATTU_TIEDOSTO, "r", encoding="utf-8") as f:
-            raamattu_data = json.load(f)
+        korpus = lataa_korpus(KORPUS_TIEDOSTO, RAAMATTU_TIEDOSTO)
     except Exception as e:
         logging.error(f"Raamatun datatiedostoa '{RAAMATTU_TIEDOSTO}' ei voitu lukea: {e}")
         return
@@ -81,29 +82,9 @@ def luo_siemenjae_indeksi():
 
     # Muunnetaan lista setiksi nopeaa hakua varten
     superjakeet_set = set(SUPERJAKEET)
-    valitut_jakeet = []
-
-    logging.info("Jäsennellään Raamattua ja poimitaan superjakeet...")
-    for book_obj in raamattu_data.get("book", {}).values():
-        kirjan_nimi = book_obj.get("info", {}).get("name")
-        luvut_obj = book_obj.get("chapter")
-
-        if not kirjan_nimi or not isinstance(luvut_obj, dict):
-            continue
-
-        for luku_nro, luku_obj in luvut_obj.items():
-            jakeet_obj = luku_obj.get("verse")
-
-            if not isinstance(jakeet_obj, dict):
-                continue
-
-            for jae_nro, jae_obj in jakeet_obj.items():
-                teksti = jae_obj.get("text", "").strip()
-                viite = f"{kirjan_nimi} {luku_nro}:{jae_nro}"
-                
-                # Tarkistetaan, onko jae haluttujen superjakeiden listalla
-                if teksti and viite in superjakeet_set:
-                    valitut_jakeet.append({"viite": viite, "teksti": teksti})
+    logging.info("Poimitaan superjakeet korpuksesta...")
+    valitut_jakeet = [{"viite": viite, "teksti": korpus.teksti(i)}
+                      for i, viite in enumerate(korpus.viitteet) if viite in superjakeet_set]
 
     logging.info(f"Jäsennys valmis. Löydettiin {len(valitut_jakeet)}/{len(SUPERJAKEET)} superjaetta.")
 
@@ -111,30 +92,19 @@ def luo_siemenjae_indeksi():
         logging.error("Jakeiden kerääminen epäonnistui. Vektorikantaa ei luoda.")
         return
         
-    # Erotetaan tekstit ja viitteet omiin listoihinsa
-    tekstit_vektorointiin = [jae["teksti"] for jae in valitut_jakeet]
-    viitteet_karttaan = [jae["viite"] for jae in valitut_jakeet]
-
-    logging.info(f"Muunnetaan {len(tekstit_vektorointiin)} jaetta vektoreiksi...")
-    
-    vektorit = model.encode(tekstit_vektorointiin, show_progress_bar=True)
-    
-    if vektorit.ndim < 2 or vektorit.shape[0] == 0:
+    # Vain uudet ja muuttuneet superjakeet muunnetaan vektoreiksi
+    indeksi = paivita_indeksi(
+        [(jae["viite"], jae["teksti"]) for jae in valitut_jakeet],
+        lambda tekstit: [model.encode(tekstit, show_progress_bar=True)],
+        EMBEDDING_MALLI,
+        SIEMENJAE_INDEKSI_TIEDOSTO,
+        SIEMENJAE_KARTTA_TIEDOSTO,
+        SIEMENJAE_MANIFESTI_TIEDOSTO,
+    )
+    if indeksi is None:
         logging.error("Vektorien luonti epäonnistui. Indeksiä ei luoda.")
         return
 
-    vektorin_ulottuvuus = vektorit.shape[1]
-    indeksi = faiss.IndexFlatL2(vektorin_ulottuvuus)
-    indeksi.add(np.array(vektorit, dtype=np.float32))
-
-    faiss.write_index(indeksi, SIEMENJAE_INDEKSI_TIEDOSTO)
-    logging.info(f"Uusi siemenjae-indeksi tallennettu: '{SIEMENJAE_INDEKSI_TIEDOSTO}'")
-
-    viite_kartta = {str(i): viite for i, viite in enumerate(viitteet_karttaan)}
-    with open(SIEMENJAE_KARTTA_TIEDOSTO, "w", encoding="utf-8") as f:
-        json.dump(viite_kartta, f, ensure_ascii=False, indent=4)
-    logging.info(f"Uusi siemenjae-kartta tallennettu: '{SIEMENJAE_KARTTA_TIEDOSTO}'")
-    
     logging.info("Siemenjae-vektorikannan luonti onnistui!")
 
 
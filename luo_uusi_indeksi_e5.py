@@ -1,17 +1,54 @@
-# luo_uusi_indeksi_e5.py (Versio 1.0)
+# luo_uusi_indeksi_e5.py (Versio 1.6 - Sirpaleet poistetaan onnistuneen ajon jälkeen)
+import argparse
+import hashlib
 import json
 import logging
+import math
+import os
+import shutil
+import time
+
 import faiss
 import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
 
+from indeksityokalut import (
+    koodaa_tekstit,
+    koodauspooli,
+    lue_vektorit_ja_tunnisteet,
+    paivita_indeksi,
+    tallenna_vektorimatriisi,
+    vertaa_koodausnopeutta,
+)
+from korpus import lataa_korpus
+
 # --- MÄÄRITYKSET ---
 RAAMATTU_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/bible.json"
+KORPUS_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_korpus.npz"
 UUSI_EMBEDDING_MALLI = "intfloat/multilingual-e5-large"
 UUSI_INDEKSI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large.faiss"
 UUSI_KARTTA_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_kartta_e5_large.json"
+UUSI_VEKTORIMATRIISI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_vektorit_e5_large.npy"
+# Konteksti-ikkunoiden sisältötiivisteet: vain muuttuneet ikkunat koodataan uudelleen
+UUSI_MANIFESTI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_manifesti_e5_large.json"
 ERAKOKO = 32  # Käsitellään jakeita erissä muistin säästämiseksi
+# Vektorit tallennetaan levylle sirpaleittain; keskeytynyt ajo jatkuu viimeisestä valmiista sirpaleesta.
+SIRPALEHAKEMISTO = "D:/Python_AI/Raamattu-tutkija-data/e5_sirpaleet"
+SIRPALEEN_KOKO = 2048  # Jaetta per sirpale
+SAILYTA_SIRPALEET = False  # True = sirpaleet jätetään levylle myös onnistuneen ajon jälkeen
+# Koodausprosessien määrä CPU-ajossa (1 = koodaus yhdessä prosessissa). Tekstit järjestetään pituuden mukaan.
+TYOPROSESSIT = 1
+
+# --- LIKIMÄÄRÄISET INDEKSIT (ANN) ---
+# Tasaisen indeksin rinnalle rakennettavat variantit: "hnsw" ja/tai "ivfpq".
+# Variantti valitaan ajossa logic.py:n PAAINDEKSI_TYYPPI-asetuksella.
+ANN_INDEKSIT = []
+ANN_INDEKSI_TIEDOSTOPOHJA = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large_{tyyppi}.faiss"
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+IVFPQ_ALIVEKTORIT = 64  # Vektorin ulottuvuuden on oltava jaollinen tällä
+IVFPQ_BITIT = 8
 
 # --- LOKITUS ---
 logging.basicConfig(
@@ -32,75 +69,172 @@ def luo_ja_tallenna_indeksi():
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     logging.info(f"Käytetään laitetta: {device}")
 
+    # 1. Ladataan jakeet käännetystä korpuksesta (käännetään tarvittaessa bible.json-tiedostosta)
     try:
-        with open(RAAMATTU_TIEDOSTO, "r", encoding="utf-8") as f:
-            raamattu_data = json.load(f)
+        korpus = lataa_korpus(KORPUS_TIEDOSTO, RAAMATTU_TIEDOSTO)
     except Exception as e:
         logging.error(f"Tiedostoa '{RAAMATTU_TIEDOSTO}' ei voitu lukea: {e}")
         return
-
-    # 1. Jäsennellään Raamattu ja kerätään kaikki jakeet
-    kaikki_jakeet = []
-    logging.info("Jäsennellään Raamattua...")
-    for book_obj in raamattu_data.get("book", {}).values():
-        kirjan_nimi = book_obj.get("info", {}).get("name")
-        for luku_nro, luku_obj in book_obj.get("chapter", {}).items():
-            for jae_nro, jae_obj in luku_obj.get("verse", {}).items():
-                teksti = jae_obj.get("text", "").strip()
-                if teksti and kirjan_nimi:
-                    viite = f"{kirjan_nimi} {luku_nro}:{jae_nro}"
-                    kaikki_jakeet.append({"viite": viite, "teksti": teksti})
-
-    logging.info(f"Jäsennys valmis. Löydettiin {len(kaikki_jakeet)} jaetta.")
-    if not kaikki_jakeet:
+    logging.info(f"Korpus ladattu: {len(korpus)} jaetta.")
+    if not len(korpus):
         return
 
-    # 2. Luodaan 3 jakeen konteksti-ikkunat
-    konteksti_tekstit = []
-    konteksti_viitteet = []
-    logging.info("Luodaan kontekstuaalisia kokonaisuuksia (3 jakeen ikkuna)...")
-    for i, jae in enumerate(kaikki_jakeet):
-        edellinen = kaikki_jakeet[i-1]["teksti"] if i > 0 else ""
-        nykyinen = jae["teksti"]
-        seuraava = kaikki_jakeet[i+1]["teksti"] if i < len(kaikki_jakeet) - 1 else ""
-        
-        # E5-mallit vaativat tämän etuliitteen parhaan suorituskyvyn saavuttamiseksi
-        koko_teksti = f"passage: {edellinen} {nykyinen} {seuraava}".strip()
-        
-        konteksti_tekstit.append(koko_teksti)
-        konteksti_viitteet.append(jae["viite"])
-
-    # 3. Ladataan uusi, tehokas embedding-malli
+    # 2. Ladataan uusi, tehokas embedding-malli
     logging.info(f"Ladataan mallia '{UUSI_EMBEDDING_MALLI}'. Tämä voi kestää hetken...")
     model = SentenceTransformer(UUSI_EMBEDDING_MALLI, device=device)
 
-    # 4. Luodaan vektorit erissä
-    logging.info(f"Muunnetaan {len(konteksti_tekstit)} tekstinpätkää vektoreiksi...")
+    # 3. Päivitetään indeksi: vain muuttuneet konteksti-ikkunat koodataan (sirpaleittain levylle)
+    # E5-mallit vaativat "passage: "-etuliitteen parhaan suorituskyvyn saavuttamiseksi
+    ikkunat = list(zip(korpus.viitteet, korpus.konteksti_ikkunat("passage: ")))
+    with koodauspooli(model, TYOPROSESSIT if device == 'cpu' else 1) as pooli:
+        indeksi = paivita_indeksi(
+            ikkunat,
+            lambda tekstit: koodaa_sirpaleittain(model, tekstit, pooli),
+            UUSI_EMBEDDING_MALLI,
+            UUSI_INDEKSI_TIEDOSTO,
+            UUSI_KARTTA_TIEDOSTO,
+            UUSI_MANIFESTI_TIEDOSTO,
+        )
+    if indeksi is None:
+        logging.error("Indeksiä ei voitu muodostaa.")
+        return
+
+    # 4. Sama matriisi .npy-muodossa, jotta logic.py voi lukea jakeiden vektorit suoraan rivinumerolla (= id)
+    tallenna_vektorimatriisi(indeksi, UUSI_VEKTORIMATRIISI_TIEDOSTO)
+    if not SAILYTA_SIRPALEET:
+        poista_sirpaleet()
+
+    luo_ann_indeksit()
     
-    # model.encode tukee suoraan eräkäsittelyä ja näyttää edistymispalkin
-    vektorit = model.encode(
-        konteksti_tekstit,
-        batch_size=ERAKOKO,
-        show_progress_bar=True
-    )
+    logging.info("Valmista! Uusi, tehokkaampi vektoritietokanta on luotu.")
 
-    logging.info("Vektorien luonti valmis.")
 
-    # 5. Luodaan ja tallennetaan FAISS-indeksi ja viitekartta
-    vektorin_ulottuvuus = vektorit.shape[1]
-    indeksi = faiss.IndexFlatL2(vektorin_ulottuvuus)
-    indeksi.add(np.array(vektorit, dtype=np.float32))
+def poista_sirpaleet():
+    """Poistaa sirpalehakemiston; indeksi ja vektorimatriisi sisältävät jo kaikki vektorit."""
+    if os.path.isdir(SIRPALEHAKEMISTO):
+        shutil.rmtree(SIRPALEHAKEMISTO, ignore_errors=True)
+        logging.info(f"Sirpalehakemisto poistettu: '{SIRPALEHAKEMISTO}'")
 
-    faiss.write_index(indeksi, UUSI_INDEKSI_TIEDOSTO)
-    logging.info(f"Uusi indeksi tallennettu: '{UUSI_INDEKSI_TIEDOSTO}'")
 
-    viite_kartta = {str(i): viite for i, viite in enumerate(konteksti_viitteet)}
-    with open(UUSI_KARTTA_TIEDOSTO, "w", encoding="utf-8") as f:
-        json.dump(viite_kartta, f, ensure_ascii=False, indent=4)
-    logging.info(f"Uusi viitekartta tallennettu: '{UUSI_KARTTA_TIEDOSTO}'")
-    
-    logging.info("Valmista! Uusi, tehokkaampi vektoritietokanta on luotu.")
+def koodaa_sirpaleittain(model, tekstit: list[str], pooli=None):
+    """Koodaa tekstit sirpaleittain .npy-tiedostoiksi ja tuottaa sirpaleiden vektorit järjestyksessä.
+
+    Valmiit sirpaleet ohitetaan, joten keskeytynyt ajo jatkuu siitä, mihin se jäi. Jos malli,
+    sirpaleen koko tai koodattavat tekstit ovat muuttuneet, vanhat sirpaleet hylätään.
+    """
+    os.makedirs(SIRPALEHAKEMISTO, exist_ok=True)
+    tunniste = hashlib.sha256(json.dumps(
+        [UUSI_EMBEDDING_MALLI, SIRPALEEN_KOKO, tekstit], ensure_ascii=False).encode("utf-8")).hexdigest()
+    tunnistetiedosto = os.path.join(SIRPALEHAKEMISTO, "tunniste.txt")
+    if os.path.exists(tunnistetiedosto):
+        with open(tunnistetiedosto, "r", encoding="utf-8") as f:
+            if f.read().strip() != tunniste:
+                logging.info("Koodattavat tekstit tai asetukset ovat muuttuneet. Vanhat sirpaleet hylätään.")
+                for nimi in os.listdir(SIRPALEHAKEMISTO):
+                    if nimi.startswith("sirpale_"):
+                        os.remove(os.path.join(SIRPALEHAKEMISTO, nimi))
+    with open(tunnistetiedosto, "w", encoding="utf-8") as f:
+        f.write(tunniste)
+
+    sirpaleiden_maara = math.ceil(len(tekstit) / SIRPALEEN_KOKO)
+    sirpaleet = [os.path.join(SIRPALEHAKEMISTO, f"sirpale_{nro:05d}.npy") for nro in range(sirpaleiden_maara)]
+    valmiit = sum(os.path.exists(t) for t in sirpaleet)
+    if valmiit:
+        logging.info(f"Jatketaan keskeytynyttä ajoa: {valmiit}/{sirpaleiden_maara} sirpaletta on jo valmiina.")
+
+    logging.info(f"Muunnetaan {len(tekstit)} tekstinpätkää vektoreiksi {sirpaleiden_maara} sirpaleessa...")
+    aloitus = time.time()
+    koodatut = 0
+    for nro, tiedosto in enumerate(sirpaleet):
+        alku, loppu = nro * SIRPALEEN_KOKO, min((nro + 1) * SIRPALEEN_KOKO, len(tekstit))
+        if not os.path.exists(tiedosto):
+            vektorit = koodaa_tekstit(model, tekstit[alku:loppu], ERAKOKO, pooli)
+            # Kirjoitetaan ensin väliaikaiseen tiedostoon, jotta keskeytys ei jätä puolikasta sirpaletta
+            valiaikainen = tiedosto[:-len(".npy")] + ".tmp.npy"
+            np.save(valiaikainen, vektorit)
+            os.replace(valiaikainen, tiedosto)
+
+            koodatut += loppu - alku
+            kesto = time.time() - aloitus
+            nopeus = koodatut / kesto if kesto > 0 else 0.0
+            jaljella = len(tekstit) - loppu
+            arvio = f", arviolta {jaljella / nopeus / 60:.1f} min jäljellä" if nopeus and jaljella else ""
+            logging.info(f"Sirpale {nro + 1}/{sirpaleiden_maara} valmis ({loppu}/{len(tekstit)} tekstiä, "
+                         f"{nopeus:.1f} tekstiä/s{arvio}).")
+        yield np.load(tiedosto)
+
+    logging.info("Vektorien luonti valmis.")
+
+
+def luo_ann_indeksi(vektorit: np.ndarray, tyyppi: str, lisaa: bool = True) -> faiss.Index:
+    """Rakentaa (ja opettaa) HNSW- tai IVF-PQ-indeksin; lisaa=False jättää vektorit lisättäviksi id:illä."""
+    ulottuvuus = vektorit.shape[1]
+    if tyyppi == "hnsw":
+        indeksi = faiss.IndexHNSWFlat(ulottuvuus, HNSW_M)
+        indeksi.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif tyyppi == "ivfpq":
+        # Klustereita n. 4 * sqrt(N), mutta kullekin vähintään 39 opetusvektoria
+        klusterit = max(1, min(int(4 * math.sqrt(len(vektorit))), len(vektorit) // 39))
+        indeksi = faiss.index_factory(ulottuvuus, f"IVF{klusterit},PQ{IVFPQ_ALIVEKTORIT}x{IVFPQ_BITIT}")
+        logging.info(f"Opetetaan IVF-PQ-indeksi ({klusterit} klusteria)...")
+        indeksi.train(vektorit)
+    else:
+        raise ValueError(f"Tuntematon indeksityyppi: {tyyppi}")
+    if lisaa:
+        indeksi.add(vektorit)
+    return indeksi
+
+
+def luo_ann_indeksit(tyypit: list = None):
+    """Rakentaa valitut likimääräiset indeksit tasaisen indeksin vektoreista samoilla id:illä."""
+    tyypit = ANN_INDEKSIT if tyypit is None else tyypit
+    if not tyypit:
+        return
+    vektorit, tunnisteet = lue_vektorit_ja_tunnisteet(faiss.read_index(UUSI_INDEKSI_TIEDOSTO))
+    vektorit = np.ascontiguousarray(vektorit, dtype=np.float32)
+    for tyyppi in tyypit:
+        logging.info(f"Rakennetaan {tyyppi}-indeksi {len(vektorit)} vektorista...")
+        tiedosto = ANN_INDEKSI_TIEDOSTOPOHJA.format(tyyppi=tyyppi)
+        indeksi = faiss.IndexIDMap2(luo_ann_indeksi(vektorit, tyyppi, lisaa=False))
+        indeksi.add_with_ids(vektorit, tunnisteet)
+        faiss.write_index(indeksi, tiedosto)
+        logging.info(f"{tyyppi}-indeksi tallennettu: '{tiedosto}'")
 
 
 if __name__ == "__main__":
-    luo_ja_tallenna_indeksi()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Luo e5-large-indeksin Raamatun jakeista.")
+    parser.add_argument(
+        "--vain-ann", nargs="+", choices=["hnsw", "ivfpq"],
+        help="Rakenna vain annetut likimääräiset indeksit olemassa olevista vektoreista."
+    )
+    parser.add_argument(
+        "--ann", nargs="+", choices=["hnsw", "ivfpq"],
+        help="Rakenna täyden ajon yhteydessä myös nämä likimääräiset indeksit."
+    )
+    parser.add_argument(
+        "--prosessit", type=int, default=None,
+        help=f"Koodausprosessien määrä CPU-ajossa (oletus {TYOPROSESSIT})."
+    )
+    parser.add_argument(
+        "--sailyta-sirpaleet", action="store_true",
+        help="Älä poista koodaussirpaleita onnistuneen ajon jälkeen."
+    )
+    parser.add_argument(
+        "--vertaa-nopeutta", action="store_true",
+        help="Mittaa yhden prosessin ja rinnakkaisen koodauksen nopeuden otoksella ja lopeta."
+    )
+    argumentit = parser.parse_args()
+    if argumentit.prosessit:
+        TYOPROSESSIT = argumentit.prosessit
+    if argumentit.sailyta_sirpaleet:
+        SAILYTA_SIRPALEET = True
+    if argumentit.vertaa_nopeutta:
+        vertaa_koodausnopeutta(SentenceTransformer(UUSI_EMBEDDING_MALLI, device='cpu'),
+                               lataa_korpus(KORPUS_TIEDOSTO, RAAMATTU_TIEDOSTO).konteksti_ikkunat("passage: "),
+                               max(TYOPROSESSIT, 2), ERAKOKO)
+    elif argumentit.vain_ann:
+        luo_ann_indeksit(tyypit=argumentit.vain_ann)
+    else:
+        if argumentit.ann:
+            ANN_INDEKSIT = argumentit.ann
+        luo_ja_tallenna_indeksi()
\ No newline at end of file
@@ -1,5 +1,8 @@
-# monitoring.py (Versio 3.1 - Lisätty tiedoston flush-toiminto)
+# monitoring.py (Versio 3.3 - Säieturvallinen suorituskykyloki)
 import csv
+import subprocess
+import sys
+import threading
 import time
 import psutil
 
@@ -11,6 +14,9 @@ try:
 except (ImportError, pynvml.NVMLError):
     NVIDIA_SMI_AVAILABLE = False
 
+# Rinnakkain käsiteltävät osiot kirjaavat samaan CSV-tiedostoon
+_write_lock = threading.Lock()
+
 def get_gpu_stats():
     """Hakee NVIDIA-näytönohjaimen tilastot, jos saatavilla."""
     if not NVIDIA_SMI_AVAILABLE:
@@ -77,6 +83,31 @@ def log_performance_stats(writer, file_handle):
     else:
         row.extend(["N/A", "N/A", "N/A"])
         
-    writer.writerow(row)
-    # HUOM: Tämä on tärkeä lisäys! Se pakottaa puskurin kirjoittamaan levylle heti.
-    file_handle.flush()
\ No newline at end of file
+    with _write_lock:
+        writer.writerow(row)
+        # HUOM: Tämä on tärkeä lisäys! Se pakottaa puskurin kirjoittamaan levylle heti.
+        file_handle.flush()
+
+def measure_import_times(modules=("numpy", "streamlit", "ollama", "faiss", "torch", "sentence_transformers", "logic")):
+    """Mittaa kunkin moduulin tuontiajan (s) omassa prosessissaan python -X importtime -tulosteesta."""
+    results = {}
+    for module in modules:
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            results[module] = None
+            continue
+        # Rivit ovat muotoa "import time: self [us] | cumulative | imported package"
+        for line in completed.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                results[module] = int(parts[1]) / 1e6
+    return results
+
+
+if __name__ == "__main__":
+    print("Moduulien tuontiajat (kukin puhtaassa prosessissa):")
+    for module, seconds in measure_import_times().items():
+        print(f"  {module:<24} {'ei saatavilla' if seconds is None else f'{seconds:6.2f} s'}")
@@ -1,4 +1,4 @@
-# run_full_diagnostics.py (Versio 21.2 - Korjattu import-virhe)
+# run_full_diagnostics.py (Versio 22.4 - Osiot ajetaan oletuksena peräkkäin luettavan raportin vuoksi)
 import logging
 import math
 import re
@@ -9,10 +9,14 @@ from logic import (
     ARVIOINTI_MALLI_ENSISIJAINEN,
     ARVIOINTI_MALLI_VARAMALLI,
     TIMANTTIJAE_MINIMI_MAARA,
+    arvioi_kunnes_riittaa,
     arvioi_tulokset,
     ehdota_uutta_strategiaa,
     etsi_merkityksen_mukaan,
+    etsi_merkityksen_mukaan_monta,
+    kirjaa_json_kutsutilastot,
     lataa_resurssit,
+    suorita_osiot,
     suorita_tarkennushaku,
 )
 
@@ -22,6 +26,10 @@ TULOS_LOKI = 'diagnostiikka_raportti_final.txt'
 LOPULLISTEN_HAKUTULOSTEN_MAARA = 15
 LAAJAN_HAUN_MAARA = 75
 ARVIOINTI_ERAN_KOKO = 10
+LAATUTAVOITE = 8.5  # Tarkennushaun ehdokkaiden arviointi lopetetaan, kun tämä keskiarvo on saavutettavissa
+# Osiot kirjoittavat samaan raporttiin, joten rinnakkain ajettujen osioiden rivit sekoittuisivat keskenään.
+# Arvoa > 1 kannattaa käyttää vain, kun raporttia ei lueta osioittain.
+OSIO_RINNAKKAISUUS = 1
 
 # --- LOKITUSMÄÄRITYKSET ---
 logger = logging.getLogger()
@@ -77,6 +85,146 @@ def lue_syote_tiedosto(tiedostopolku):
     return hakulauseet, otsikot
 
 
+def kasittele_osio(osio_nro, haku, otsikko, alkuperaiset_ehdokkaat):
+    """Arvioi ja parantaa yhden osion laajan haun jakeet; palauttaa (jaerivit, arvosana) tai None."""
+    log_header(f"Käsitellään osio {osio_nro}: {otsikko}")
+    logging.info(f"Vaihe 1: Laaja haku löysi {len(alkuperaiset_ehdokkaat)} ehdokasjaetta.")
+
+    if not alkuperaiset_ehdokkaat:
+        logging.warning("Laaja haku ei tuottanut tuloksia. Siirrytään seuraavaan osioon.")
+        return None
+
+    # VAIHE 2: ALKUPERÄINEN ARVIOINTI PÄÄMALLILLA (ERISSÄ)
+    logging.info(f"Vaihe 2: Arvioidaan {len(alkuperaiset_ehdokkaat)} ehdokasta päämallilla...")
+    kaikki_arviot = []
+    erien_maara = math.ceil(len(alkuperaiset_ehdokkaat) / ARVIOINTI_ERAN_KOKO)
+
+    for j in range(erien_maara):
+        alku, loppu = j * ARVIOINTI_ERAN_KOKO, (j + 1) * ARVIOINTI_ERAN_KOKO
+        era_ehdokkaat = alkuperaiset_ehdokkaat[alku:loppu]
+        logging.info(f"  - Arvioidaan erä {j+1}/{erien_maara}...")
+        arvio = arvioi_tulokset(haku, era_ehdokkaat, eran_koko=ARVIOINTI_ERAN_KOKO)
+
+        if "virhe" in arvio or len(arvio.get("jae_arviot", [])) != len(era_ehdokkaat):
+            logging.warning("Päämalli epäonnistui, yritetään varamallia erälle...")
+            arvio = arvioi_tulokset(haku, era_ehdokkaat, malli_nimi=ARVIOINTI_MALLI_VARAMALLI, eran_koko=ARVIOINTI_ERAN_KOKO)
+            if "virhe" in arvio or len(arvio.get("jae_arviot", [])) != len(era_ehdokkaat):
+                logging.error(f"KRIITTINEN: Myös varamalli epäonnistui erälle {j+1}. Erä ohitetaan.")
+                continue
+
+        kaikki_arviot.extend(arvio.get("jae_arviot", []))
+
+    logging.info(f"Alkuperäinen arviointi valmis. Saatiin {len(kaikki_arviot)} jaearviota.")
+    if not kaikki_arviot:
+        logging.error("Arviointi epäonnistui kokonaan. Siirrytään seuraavaan osioon.")
+        return None
+
+    # VAIHE 3: TULOSTEN KOKOAMINEN JA KESKIARVON LASKENTA
+    jarjestetyt_arviot = sorted(kaikki_arviot, key=lambda x: x.get('arvosana', 0), reverse=True)
+    parhaat_arviot = jarjestetyt_arviot[:LOPULLISTEN_HAKUTULOSTEN_MAARA]
+
+    valid_scores = [a.get('arvosana') for a in parhaat_arviot if a.get('arvosana') is not None]
+    alkuperainen_keskiarvo = sum(valid_scores) / len(valid_scores) if valid_scores else 0.0
+    logging.info(f"Vaihe 3: Valittu {len(parhaat_arviot)} parasta jaetta. Alkuperäinen laatuarvio: {alkuperainen_keskiarvo:.2f}/10")
+
+    final_tulokset = []
+    for arvio_item in parhaat_arviot:
+        vastaava_jae = next((item for item in alkuperaiset_ehdokkaat if item['viite'] == arvio_item.get('viite')), None)
+        if vastaava_jae:
+            vastaava_jae.update(arvio_item)
+            final_tulokset.append(vastaava_jae)
+
+    # VAIHE 4: DYNAAMINEN PARANNUSALGORITMI
+    log_header(f"KÄYNNISTETÄÄN DYNAAMINEN PARANNUSALGORITMI (OSIO {osio_nro})")
+    dynaaminen_raja_arvo = alkuperainen_keskiarvo
+    ydinjakeet = [t for t in final_tulokset if t.get('arvosana', 0) >= dynaaminen_raja_arvo]
+
+    if len(ydinjakeet) >= TIMANTTIJAE_MINIMI_MAARA:
+        logging.info(f"TILA A: Ydinjakeita löytyi {len(ydinjakeet)} kpl (väh. {TIMANTTIJAE_MINIMI_MAARA}). Suoritetaan tarkennushaku.")
+        logging.info(f"Dynaaminen raja-arvo tälle osiolle: {dynaaminen_raja_arvo:.2f}/10")
+
+        heikot_jakeet = sorted([t for t in final_tulokset if t.get('arvosana', 0) < dynaaminen_raja_arvo], key=lambda x: x.get('arvosana', 0))
+        haettava_maara = max(10, min(50, len(heikot_jakeet) * 3))
+
+        logging.info(f"Korvattavia heikkoja jakeita: {len(heikot_jakeet)}. Haetaan {haettava_maara} uutta ehdokasta.")
+        vanhat_viitteet = {t['viite'] for t in final_tulokset}
+        uudet_ehdokkaat = suorita_tarkennushaku(ydinjakeet, vanhat_viitteet, haettava_maara)
+
+        if uudet_ehdokkaat:
+            logging.info(f"Tarkennushaku löysi {len(uudet_ehdokkaat)} uutta, uniikkia jaetta. Arvioidaan ne...")
+            tarvittava_nousu = LAATUTAVOITE * len(final_tulokset) - sum(t.get('arvosana', 0) for t in final_tulokset)
+            uudet_arvioidut = arvioi_kunnes_riittaa(
+                haku, uudet_ehdokkaat, [t.get('arvosana', 0) for t in heikot_jakeet], tarvittava_nousu
+            )
+
+            for jae in uudet_ehdokkaat:
+                vastaava_arvio = next((a for a in uudet_arvioidut if a.get('viite') == jae['viite']), None)
+                if vastaava_arvio:
+                    jae.update(vastaava_arvio)
+
+            uudet_parhaat = sorted([j for j in uudet_ehdokkaat if 'arvosana' in j], key=lambda x: x.get('arvosana', 0), reverse=True)
+
+            logging.info("--- LAADUNVALVONTA JA ÄLYKÄS KORVAAMINEN ---")
+            korvaus_laskuri = 0
+            for i_korv in range(len(heikot_jakeet)):
+                if i_korv < len(uudet_parhaat):
+                    vanha_jae = heikot_jakeet[i_korv]
+                    uusi_jae = uudet_parhaat[i_korv]
+                    if uusi_jae.get('arvosana', 0) > vanha_jae.get('arvosana', 0):
+                        log_msg = (
+                            f"  -> KORVATAAN: '{vanha_jae['viite']}' ({vanha_jae.get('arvosana'):.2f}/10) ==> '{uusi_jae['viite']}' ({uusi_jae.get('arvosana'):.2f}/10)\n"
+                            f"     - Vanha perustelu: {vanha_jae.get('perustelu', 'N/A')}\n"
+                            f"     + Uusi perustelu:  {uusi_jae.get('perustelu', 'N/A')}"
+                        )
+                        logging.info(log_msg)
+                        for idx, item in enumerate(final_tulokset):
+                            if item['viite'] == vanha_jae['viite']:
+                                final_tulokset[idx] = uusi_jae
+                                break
+                        korvaus_laskuri += 1
+                    else:
+                        logging.info(f"  -> SÄILYTETÄÄN: '{vanha_jae['viite']}' ({vanha_jae.get('arvosana'):.2f}/10), koska uusi ehdokas '{uusi_jae['viite']}' ({uusi_jae.get('arvosana'):.2f}/10) ei ollut parempi.")
+            logging.info(f"Laadunvalvonta valmis. {korvaus_laskuri} jaetta korvattu.")
+        else:
+            logging.warning("Tarkennushaku ei löytänyt uusia jakeita.")
+    else:
+        logging.warning(f"TILA B: Ydinjakeita löytyi vain {len(ydinjakeet)} kpl (väh. {TIMANTTIJAE_MINIMI_MAARA}). Siirrytään strategian parannukseen.")
+        arvio_obj = {"kokonaisarvosana": alkuperainen_keskiarvo, "jae_arviot": parhaat_arviot}
+        ehdotus = ehdota_uutta_strategiaa(haku, arvio_obj)
+
+        if "virhe" not in ehdotus and ehdotus.get("selite"):
+            logging.info(f"Luotu uusi strategia: {ehdotus.get('selite')}")
+            uudet_strategiat = {s.lower(): ehdotus.get("selite") for s in ehdotus.get("avainsanat", [])}
+            heikot_lkm = len([t for t in final_tulokset if t.get('arvosana', 0) < dynaaminen_raja_arvo])
+            if heikot_lkm > 0:
+                logging.info(f"Haetaan {heikot_lkm} korvaajaa uudella strategialla...")
+                paikkaushaku, _ = etsi_merkityksen_mukaan(haku, otsikko, top_k=heikot_lkm, custom_strategiat=uudet_strategiat)
+                if paikkaushaku:
+                    final_tulokset_hyvat = [t for t in final_tulokset if t.get('arvosana', 0) >= dynaaminen_raja_arvo]
+                    final_tulokset = final_tulokset_hyvat + paikkaushaku
+                    logging.info(f"{len(paikkaushaku)} jaetta korvattu.")
+            else:
+                logging.info("Ei heikkoja jakeita korvattavaksi.")
+        else:
+            logging.error("Strategian luonti epäonnistui.")
+
+    valid_scores_final = [a.get('arvosana') for a in final_tulokset if a.get('arvosana') is not None]
+    lopputulos_keskiarvo = sum(valid_scores_final) / len(valid_scores_final) if valid_scores_final else 0.0
+
+    logging.info(f"Parannusprosessin jälkeen lopullinen laatuarvio: {lopputulos_keskiarvo:.2f}/10")
+    if lopputulos_keskiarvo > alkuperainen_keskiarvo:
+        logging.info(f"LAADUNPARANNUS ONNISTUI! ({alkuperainen_keskiarvo:.2f} -> {lopputulos_keskiarvo:.2f}) ✅")
+    else:
+        logging.info("Laatu ei parantunut tai pysyi samana.")
+
+    logging.info(f"--- Lopulliset valitut jakeet ja niiden arviot (Päämalli: {ARVIOINTI_MALLI_ENSISIJAINEN}) ---")
+    for jae_arvio in sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True):
+        logging.info(f"  - {jae_arvio.get('viite')}: {jae_arvio.get('arvosana', 0):.2f}/10 ({jae_arvio.get('perustelu')})")
+
+    jae_rivit = [f"- {t['viite']}: \"{t['teksti']}\"" for t in sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True)]
+    return jae_rivit, f"{lopputulos_keskiarvo:.2f}"
+
+
 def suorita_diagnostiikka():
     """Ajaa koko diagnostiikkaprosessin, sisältäen dynaamisen parannusalgoritmin."""
     total_start_time = time.time()
@@ -100,145 +248,22 @@ def suorita_diagnostiikka():
         key=lambda item: [int(p) for p in item[0].split('.')]
     )
 
-    for i, (osio_nro, haku) in enumerate(sorted_osiot):
-        otsikko = otsikot.get(osio_nro, "")
-        log_header(f"Käsitellään osio {i+1}/{len(sorted_osiot)}: {otsikko}")
-
-        # VAIHE 1: ALKUPERÄINEN LAAJA ETSINTÄ
-        logging.info(f"Vaihe 1: Suoritetaan laaja haku (haetaan {LAAJAN_HAUN_MAARA} jaetta)...")
-        alkuperaiset_ehdokkaat = etsi_merkityksen_mukaan(haku, otsikko, top_k=LAAJAN_HAUN_MAARA)
-        logging.info(f"Löytyi {len(alkuperaiset_ehdokkaat)} ehdokasjaetta.")
-
-        if not alkuperaiset_ehdokkaat:
-            logging.warning("Laaja haku ei tuottanut tuloksia. Siirrytään seuraavaan osioon.")
-            continue
-
-        # VAIHE 2: ALKUPERÄINEN ARVIOINTI PÄÄMALLILLA (ERISSÄ)
-        logging.info(f"Vaihe 2: Arvioidaan {len(alkuperaiset_ehdokkaat)} ehdokasta päämallilla...")
-        kaikki_arviot = []
-        erien_maara = math.ceil(len(alkuperaiset_ehdokkaat) / ARVIOINTI_ERAN_KOKO)
-
-        for j in range(erien_maara):
-            alku, loppu = j * ARVIOINTI_ERAN_KOKO, (j + 1) * ARVIOINTI_ERAN_KOKO
-            era_ehdokkaat = alkuperaiset_ehdokkaat[alku:loppu]
-            logging.info(f"  - Arvioidaan erä {j+1}/{erien_maara}...")
-            arvio = arvioi_tulokset(haku, era_ehdokkaat)
-
-            if "virhe" in arvio or len(arvio.get("jae_arviot", [])) != len(era_ehdokkaat):
-                logging.warning("Päämalli epäonnistui, yritetään varamallia erälle...")
-                arvio = arvioi_tulokset(haku, era_ehdokkaat, malli_nimi=ARVIOINTI_MALLI_VARAMALLI)
-                if "virhe" in arvio or len(arvio.get("jae_arviot", [])) != len(era_ehdokkaat):
-                    logging.error(f"KRIITTINEN: Myös varamalli epäonnistui erälle {j+1}. Erä ohitetaan.")
-                    continue
-
-            kaikki_arviot.extend(arvio.get("jae_arviot", []))
-
-        logging.info(f"Alkuperäinen arviointi valmis. Saatiin {len(kaikki_arviot)} jaearviota.")
-        if not kaikki_arviot:
-            logging.error("Arviointi epäonnistui kokonaan. Siirrytään seuraavaan osioon.")
-            continue
-
-        # VAIHE 3: TULOSTEN KOKOAMINEN JA KESKIARVON LASKENTA
-        jarjestetyt_arviot = sorted(kaikki_arviot, key=lambda x: x.get('arvosana', 0), reverse=True)
-        parhaat_arviot = jarjestetyt_arviot[:LOPULLISTEN_HAKUTULOSTEN_MAARA]
-
-        valid_scores = [a.get('arvosana') for a in parhaat_arviot if a.get('arvosana') is not None]
-        alkuperainen_keskiarvo = sum(valid_scores) / len(valid_scores) if valid_scores else 0.0
-        logging.info(f"Vaihe 3: Valittu {len(parhaat_arviot)} parasta jaetta. Alkuperäinen laatuarvio: {alkuperainen_keskiarvo:.2f}/10")
-
-        final_tulokset = []
-        for arvio_item in parhaat_arviot:
-            vastaava_jae = next((item for item in alkuperaiset_ehdokkaat if item['viite'] == arvio_item.get('viite')), None)
-            if vastaava_jae:
-                vastaava_jae.update(arvio_item)
-                final_tulokset.append(vastaava_jae)
-
-        # VAIHE 4: DYNAAMINEN PARANNUSALGORITMI
-        log_header(f"KÄYNNISTETÄÄN DYNAAMINEN PARANNUSALGORITMI (OSIO {osio_nro})")
-        dynaaminen_raja_arvo = alkuperainen_keskiarvo
-        ydinjakeet = [t for t in final_tulokset if t.get('arvosana', 0) >= dynaaminen_raja_arvo]
-
-        if len(ydinjakeet) >= TIMANTTIJAE_MINIMI_MAARA:
-            logging.info(f"TILA A: Ydinjakeita löytyi {len(ydinjakeet)} kpl (väh. {TIMANTTIJAE_MINIMI_MAARA}). Suoritetaan tarkennushaku.")
-            logging.info(f"Dynaaminen raja-arvo tälle osiolle: {dynaaminen_raja_arvo:.2f}/10")
-
-            heikot_jakeet = sorted([t for t in final_tulokset if t.get('arvosana', 0) < dynaaminen_raja_arvo], key=lambda x: x.get('arvosana', 0))
-            haettava_maara = max(10, min(50, len(heikot_jakeet) * 3))
-
-            logging.info(f"Korvattavia heikkoja jakeita: {len(heikot_jakeet)}. Haetaan {haettava_maara} uutta ehdokasta.")
-            vanhat_viitteet = {t['viite'] for t in final_tulokset}
-            uudet_ehdokkaat = suorita_tarkennushaku(ydinjakeet, vanhat_viitteet, haettava_maara)
-
-            if uudet_ehdokkaat:
-                logging.info(f"Tarkennushaku löysi {len(uudet_ehdokkaat)} uutta, uniikkia jaetta. Arvioidaan ne...")
-                uudet_arvioidut = arvioi_tulokset(haku, uudet_ehdokkaat).get("jae_arviot", [])
-
-                for jae in uudet_ehdokkaat:
-                    vastaava_arvio = next((a for a in uudet_arvioidut if a.get('viite') == jae['viite']), None)
-                    if vastaava_arvio:
-                        jae.update(vastaava_arvio)
-
-                uudet_parhaat = sorted([j for j in uudet_ehdokkaat if 'arvosana' in j], key=lambda x: x.get('arvosana', 0), reverse=True)
-
-                logging.info("--- LAADUNVALVONTA JA ÄLYKÄS KORVAAMINEN ---")
-                korvaus_laskuri = 0
-                for i_korv in range(len(heikot_jakeet)):
-                    if i_korv < len(uudet_parhaat):
-                        vanha_jae = heikot_jakeet[i_korv]
-                        uusi_jae = uudet_parhaat[i_korv]
-                        if uusi_jae.get('arvosana', 0) > vanha_jae.get('arvosana', 0):
-                            log_msg = (
-                                f"  -> KORVATAAN: '{vanha_jae['viite']}' ({vanha_jae.get('arvosana'):.2f}/10) ==> '{uusi_jae['viite']}' ({uusi_jae.get('arvosana'):.2f}/10)\n"
-                                f"     - Vanha perustelu: {vanha_jae.get('perustelu', 'N/A')}\n"
-                                f"     + Uusi perustelu:  {uusi_jae.get('perustelu', 'N/A')}"
-                            )
-                            logging.info(log_msg)
-                            for idx, item in enumerate(final_tulokset):
-                                if item['viite'] == vanha_jae['viite']:
-                                    final_tulokset[idx] = uusi_jae
-                                    break
-                            korvaus_laskuri += 1
-                        else:
-                            logging.info(f"  -> SÄILYTETÄÄN: '{vanha_jae['viite']}' ({vanha_jae.get('arvosana'):.2f}/10), koska uusi ehdokas '{uusi_jae['viite']}' ({uusi_jae.get('arvosana'):.2f}/10) ei ollut parempi.")
-                logging.info(f"Laadunvalvonta valmis. {korvaus_laskuri} jaetta korvattu.")
-            else:
-                logging.warning("Tarkennushaku ei löytänyt uusia jakeita.")
-        else:
-            logging.warning(f"TILA B: Ydinjakeita löytyi vain {len(ydinjakeet)} kpl (väh. {TIMANTTIJAE_MINIMI_MAARA}). Siirrytään strategian parannukseen.")
-            arvio_obj = {"kokonaisarvosana": alkuperainen_keskiarvo, "jae_arviot": parhaat_arviot}
-            ehdotus = ehdota_uutta_strategiaa(haku, arvio_obj)
-
-            if "virhe" not in ehdotus and ehdotus.get("selite"):
-                logging.info(f"Luotu uusi strategia: {ehdotus.get('selite')}")
-                uudet_strategiat = {s.lower(): ehdotus.get("selite") for s in ehdotus.get("avainsanat", [])}
-                heikot_lkm = len([t for t in final_tulokset if t.get('arvosana', 0) < dynaaminen_raja_arvo])
-                if heikot_lkm > 0:
-                    logging.info(f"Haetaan {heikot_lkm} korvaajaa uudella strategialla...")
-                    paikkaushaku = etsi_merkityksen_mukaan(haku, otsikko, top_k=heikot_lkm, custom_strategiat=uudet_strategiat)
-                    if paikkaushaku:
-                        final_tulokset_hyvat = [t for t in final_tulokset if t.get('arvosana', 0) >= dynaaminen_raja_arvo]
-                        final_tulokset = final_tulokset_hyvat + paikkaushaku
-                        logging.info(f"{len(paikkaushaku)} jaetta korvattu.")
-                else:
-                    logging.info("Ei heikkoja jakeita korvattavaksi.")
-            else:
-                logging.error("Strategian luonti epäonnistui.")
-
-        valid_scores_final = [a.get('arvosana') for a in final_tulokset if a.get('arvosana') is not None]
-        lopputulos_keskiarvo = sum(valid_scores_final) / len(valid_scores_final) if valid_scores_final else 0.0
-        lopulliset_arvosanat[osio_nro] = f"{lopputulos_keskiarvo:.2f}"
-
-        logging.info(f"Parannusprosessin jälkeen lopullinen laatuarvio: {lopputulos_keskiarvo:.2f}/10")
-        if lopputulos_keskiarvo > alkuperainen_keskiarvo:
-            logging.info(f"LAADUNPARANNUS ONNISTUI! ({alkuperainen_keskiarvo:.2f} -> {lopputulos_keskiarvo:.2f}) ✅")
-        else:
-            logging.info("Laatu ei parantunut tai pysyi samana.")
-
-        logging.info(f"--- Lopulliset valitut jakeet ja niiden arviot (Päämalli: {ARVIOINTI_MALLI_ENSISIJAINEN}) ---")
-        for jae_arvio in sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True):
-            logging.info(f"  - {jae_arvio.get('viite')}: {jae_arvio.get('arvosana', 0):.2f}/10 ({jae_arvio.get('perustelu')})")
+    # VAIHE 1: ALKUPERÄINEN LAAJA ETSINTÄ kaikille osioille yhtenä eränä
+    logging.info(f"Vaihe 1: Suoritetaan laaja haku {len(sorted_osiot)} osiolle (haetaan {LAAJAN_HAUN_MAARA} jaetta per osio)...")
+    laajat_haut = etsi_merkityksen_mukaan_monta(
+        [(haku, otsikot.get(osio_nro, "")) for osio_nro, haku in sorted_osiot], top_k=LAAJAN_HAUN_MAARA
+    )
+    ehdokkaat_osioittain = {osio_nro: ehdokkaat for (osio_nro, _), (ehdokkaat, _) in zip(sorted_osiot, laajat_haut)}
 
-        jae_kartta_tuloksille[osio_nro] = [f"- {t['viite']}: \"{t['teksti']}\"" for t in sorted(final_tulokset, key=lambda x: x.get('arvosana', 0), reverse=True)]
+    # Osiot käsitellään OSIO_RINNAKKAISUUS kerrallaan; yhteenveto kirjoitetaan lopuksi osioiden numerojärjestyksessä
+    tulokset = suorita_osiot(
+        sorted_osiot,
+        lambda nro, haku: kasittele_osio(nro, haku, otsikot.get(nro, ""), ehdokkaat_osioittain[nro]),
+        OSIO_RINNAKKAISUUS,
+    )
+    for osio_nro, tulos in tulokset:
+        if tulos is not None:
+            jae_kartta_tuloksille[osio_nro], lopulliset_arvosanat[osio_nro] = tulos
 
     # YHTEENVETO-OSA
     total_end_time = time.time()
@@ -249,6 +274,7 @@ def suorita_diagnostiikka():
     if valid_scores_float:
         keskiarvo_total = sum(valid_scores_float) / len(valid_scores_float)
         logging.info(f"PÄÄMALLIN antama lopullinen keskiarvo tulosten laadulle: {keskiarvo_total:.2f}/10")
+    kirjaa_json_kutsutilastot()
 
     log_header("YKSITYISKOHTAINEN JAEJAOTTELU (LOPULLISET TULOKSET)")
     for osio_nro_sorted, haku_sorted in sorted_osiot:
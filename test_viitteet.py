@@ -0,0 +1,53 @@
+# test_viitteet.py (Versio 1.1 - Lauseen päättävä pilkkujae ja ajatusviivavälit)
+from logic import hae_jakeet_viitteella, poimi_raamatunviitteet, rakenna_viiteindeksi
+
+JAE_KARTTA = {
+    "Joh. 1:1": "Alussa oli Sana.",
+    "Joh. 1:2": "Hän oli alussa Jumalan tykönä.",
+    "Joh. 3:16": "Sillä niin on Jumala maailmaa rakastanut.",
+    "Joh. 3:17": "Sillä ei Jumala lähettänyt Poikaansa maailmaan.",
+    "Joh. 3:18": "Joka uskoo häneen, sitä ei tuomita.",
+    "2. Joh. 1:2": "totuuden tähden, joka pysyy meissä.",
+    "Room. 12:1": "Minä kehotan siis teitä.",
+    "1. Kor. 13:4": "Rakkaus on pitkämielinen.",
+    "2. Kor. 5:17": "Sentähden, jos joku on Kristuksessa.",
+    "1. Moos. 1:1": "Alussa loi Jumala taivaan ja maan.",
+}
+
+
+def test_pilkkulista_ei_nielaise_seuraavan_kirjan_numeroa():
+    assert poimi_raamatunviitteet("Joh. 1:1, 2. Joh. 1:2") == ["Joh. 1:1", "2. Joh. 1:2"]
+    assert poimi_raamatunviitteet("Room. 12:1, 2. Kor. 5:17") == ["Room. 12:1", "2. Kor. 5:17"]
+    assert poimi_raamatunviitteet("Joh. 1:1-2, 1. Moos. 1:1") == ["Joh. 1:1-2", "1. Moos. 1:1"]
+
+
+def test_lauseen_paattava_pilkkujae_sailyy():
+    assert poimi_raamatunviitteet("Katso Joh. 3:16, 17.") == ["Joh. 3:16, 17"]
+    assert poimi_raamatunviitteet("Room. 12:1, 4. Sitten jatketaan.") == ["Room. 12:1, 4"]
+    indeksi = rakenna_viiteindeksi(JAE_KARTTA)
+    assert [j["viite"] for j in hae_jakeet_viitteella("Joh. 3:16, 17", JAE_KARTTA, indeksi)] == ["Joh. 3:16", "Joh. 3:17"]
+
+
+def test_ajatusviiva_valina():
+    assert poimi_raamatunviitteet("Joh. 3:16–18 ja Room. 12:1, 4–5") == ["Joh. 3:16–18", "Room. 12:1, 4–5"]
+    indeksi = rakenna_viiteindeksi(JAE_KARTTA)
+    assert [j["viite"] for j in hae_jakeet_viitteella("Joh. 3:16–18", JAE_KARTTA, indeksi)] == [
+        "Joh. 3:16", "Joh. 3:17", "Joh. 3:18"]
+
+
+def test_pilkkulista_jakeille_ja_luvuille():
+    assert poimi_raamatunviitteet("Room. 12:1, 4-5") == ["Room. 12:1, 4-5"]
+    assert poimi_raamatunviitteet("Room. 12:1, 14:2") == ["Room. 12:1, 14:2"]
+
+
+def test_numeroidut_kirjat_ratkaistaan_oikein():
+    indeksi = rakenna_viiteindeksi(JAE_KARTTA)
+    assert [j["viite"] for j in hae_jakeet_viitteella("2. Joh. 1:2", JAE_KARTTA, indeksi)] == ["2. Joh. 1:2"]
+    assert [j["viite"] for j in hae_jakeet_viitteella("Joh. 1:2", JAE_KARTTA, indeksi)] == ["Joh. 1:2"]
+    assert [j["viite"] for j in hae_jakeet_viitteella("2. Kor. 5:17", JAE_KARTTA, indeksi)] == ["2. Kor. 5:17"]
+    assert [j["viite"] for j in hae_jakeet_viitteella("1. Korinttolaiskirje 13:4", JAE_KARTTA, indeksi)] == ["1. Kor. 13:4"]
+
+
+def test_kirja_ilman_numeroa_ei_ratkea_numeroituun_kirjaan():
+    indeksi = rakenna_viiteindeksi(JAE_KARTTA)
+    assert hae_jakeet_viitteella("Kor. 5:17", JAE_KARTTA, indeksi) == []
@@ -0,0 +1,283 @@
+# valimuisti.py (Versio 1.4 - Kyselyvektorien levyvälimuistin kokoraja)
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def laske_tiiviste(*osat) -> str:
+    """Laskee osista vakaan SHA-256-tiivisteen välimuistiavaimeksi."""
+    return hashlib.sha256(json.dumps(osat, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ArvioValimuisti:
+    """SQLite-tiedostoon tallentuva välimuisti jäsennellyille jaearvioille.
+
+    Avain muodostetaan kehotepohjan tiivisteestä, mallista, aiheesta ja jakeesta,
+    joten kehotteen muuttaminen mitätöi vanhat arviot automaattisesti. Osumien käyttöajat kerätään
+    muistiin ja kirjoitetaan seuraavan tallennuksen tai siivouksen yhteydessä, joten osuma ei kirjoita levylle.
+    """
+
+    SIIVOUSVALI = 500  # Tallennusta siivousten välillä
+    KAYTTOAIKOJEN_ERA = 256  # Kirjaamattomia käyttöaikoja, joiden jälkeen ne kirjoitetaan heti
+
+    def __init__(self, tiedosto: str, maksimikoko: int = 200_000, maksimi_ika_paivat: float = 90):
+        self.tiedosto = tiedosto
+        self.maksimikoko = maksimikoko
+        self.maksimi_ika = maksimi_ika_paivat * 24 * 3600
+        self.osumat = 0
+        self.ohitukset = 0
+        self.tallennukset = 0
+        self.poistot = 0
+        self._lukko = threading.Lock()
+        self._kaytetyt = {}
+        self._yhteys = sqlite3.connect(tiedosto, check_same_thread=False)
+        self._yhteys.execute(
+            "CREATE TABLE IF NOT EXISTS arviot ("
+            "avain TEXT PRIMARY KEY, arvosana REAL, perustelu TEXT, "
+            "mallin_nimi TEXT, luotu REAL, kaytetty REAL)"
+        )
+        self._yhteys.execute("CREATE INDEX IF NOT EXISTS arviot_kaytetty ON arviot (kaytetty)")
+        self._yhteys.commit()
+        self.siivoa()
+
+    @staticmethod
+    def avain(kehotepohja: str, malli: str, aihe: str, viite: str, teksti: str) -> str:
+        return laske_tiiviste(hashlib.sha256(kehotepohja.encode("utf-8")).hexdigest(), malli, aihe, viite, teksti)
+
+    def hae(self, avain: str) -> dict | None:
+        with self._lukko:
+            rivi = self._yhteys.execute(
+                "SELECT arvosana, perustelu, mallin_nimi, luotu FROM arviot WHERE avain = ?", (avain,)
+            ).fetchone()
+            if rivi is None or time.time() - rivi[3] > self.maksimi_ika:
+                self.ohitukset += 1
+                return None
+            self._kaytetyt[avain] = time.time()
+            if len(self._kaytetyt) >= self.KAYTTOAIKOJEN_ERA:
+                self._kirjaa_kayttoajat()
+                self._yhteys.commit()
+            self.osumat += 1
+            return {"arvosana": rivi[0], "perustelu": rivi[1], "mallin_nimi": rivi[2]}
+
+    def _kirjaa_kayttoajat(self):
+        """Kirjoittaa kerätyt käyttöajat tauluun (ilman commitia); kutsutaan lukko hallussa."""
+        if self._kaytetyt:
+            self._yhteys.executemany("UPDATE arviot SET kaytetty = ? WHERE avain = ?",
+                                     [(kaytetty, avain) for avain, kaytetty in self._kaytetyt.items()])
+            self._kaytetyt.clear()
+
+    def tallenna(self, avain: str, arvosana: float, perustelu: str, mallin_nimi: str):
+        nyt = time.time()
+        with self._lukko:
+            self._kaytetyt.pop(avain, None)
+            self._kirjaa_kayttoajat()
+            self._yhteys.execute(
+                "INSERT OR REPLACE INTO arviot VALUES (?, ?, ?, ?, ?, ?)",
+                (avain, float(arvosana), perustelu, mallin_nimi, nyt, nyt),
+            )
+            self._yhteys.commit()
+            self.tallennukset += 1
+            siivotaan = self.tallennukset % self.SIIVOUSVALI == 0
+        if siivotaan:
+            self.siivoa()
+
+    def siivoa(self):
+        """Poistaa vanhentuneet arviot ja pitää koon rajoissa poistamalla pisimpään käyttämättömät."""
+        with self._lukko:
+            self._kirjaa_kayttoajat()
+            poistettu = self._yhteys.execute(
+                "DELETE FROM arviot WHERE luotu < ?", (time.time() - self.maksimi_ika,)
+            ).rowcount
+            ylimaara = self._yhteys.execute("SELECT COUNT(*) FROM arviot").fetchone()[0] - self.maksimikoko
+            if ylimaara > 0:
+                poistettu += self._yhteys.execute(
+                    "DELETE FROM arviot WHERE avain IN "
+                    "(SELECT avain FROM arviot ORDER BY kaytetty LIMIT ?)", (ylimaara,)
+                ).rowcount
+            self._yhteys.commit()
+            self.poistot += poistettu
+        if poistettu:
+            logging.info(f"Arviovälimuisti: poistettiin {poistettu} vanhaa arviota.")
+
+    def tilastot(self) -> dict:
+        with self._lukko:
+            koko = self._yhteys.execute("SELECT COUNT(*) FROM arviot").fetchone()[0]
+        haut = self.osumat + self.ohitukset
+        return {
+            "osumat": self.osumat,
+            "ohitukset": self.ohitukset,
+            "osumaprosentti": 100.0 * self.osumat / haut if haut else 0.0,
+            "tallennukset": self.tallennukset,
+            "poistot": self.poistot,
+            "koko": koko,
+        }
+
+
+class VektoriValimuisti:
+    """Kyselyvektorien LRU-välimuisti muistissa ja valinnaisesti SQLite-tiedostossa.
+
+    Avain on mallin nimi ja täsmälleen koodattu merkkijono (etuliitteineen, esim. "query: ...").
+    Levyllä pidetään enintään `levyn_maksimikoko` vektoria; ylimäärästä poistetaan pisimpään käyttämättömät.
+    """
+
+    SIIVOUSVALI = 500  # Levylle tallennusta siivousten välillä
+    KAYTTOAIKOJEN_ERA = 256  # Kirjaamattomia käyttöaikoja, joiden jälkeen ne kirjoitetaan heti
+
+    def __init__(self, maksimikoko: int = 2048, tiedosto: str = None, levyn_maksimikoko: int = 100_000):
+        self.maksimikoko = maksimikoko
+        self.levyn_maksimikoko = levyn_maksimikoko
+        self.osumat = 0
+        self.levyosumat = 0
+        self.ohitukset = 0
+        self.tallennukset = 0
+        self.poistot = 0
+        self._muisti = OrderedDict()
+        self._lukko = threading.Lock()
+        self._kaytetyt = {}
+        self._yhteys = None
+        if tiedosto:
+            self._yhteys = sqlite3.connect(tiedosto, check_same_thread=False)
+            self._yhteys.execute(
+                "CREATE TABLE IF NOT EXISTS vektorit (avain TEXT PRIMARY KEY, vektori BLOB, kaytetty REAL DEFAULT 0)"
+            )
+            # Aiemman version taulussa ei ole käyttöaikaa
+            sarakkeet = {rivi[1] for rivi in self._yhteys.execute("PRAGMA table_info(vektorit)")}
+            if "kaytetty" not in sarakkeet:
+                self._yhteys.execute("ALTER TABLE vektorit ADD COLUMN kaytetty REAL DEFAULT 0")
+            self._yhteys.execute("CREATE INDEX IF NOT EXISTS vektorit_kaytetty ON vektorit (kaytetty)")
+            self._yhteys.commit()
+            self.siivoa()
+
+    def hae(self, malli: str, teksti: str) -> np.ndarray | None:
+        avain = laske_tiiviste(malli, teksti)
+        with self._lukko:
+            if avain in self._muisti:
+                self._muisti.move_to_end(avain)
+                self.osumat += 1
+                return self._muisti[avain]
+            if self._yhteys is not None:
+                rivi = self._yhteys.execute("SELECT vektori FROM vektorit WHERE avain = ?", (avain,)).fetchone()
+                if rivi is not None:
+                    vektori = np.frombuffer(rivi[0], dtype=np.float32)
+                    self._lisaa_muistiin(avain, vektori)
+                    self._kaytetyt[avain] = time.time()
+                    if len(self._kaytetyt) >= self.KAYTTOAIKOJEN_ERA:
+                        self._kirjaa_kayttoajat()
+                        self._yhteys.commit()
+                    self.levyosumat += 1
+                    return vektori
+            self.ohitukset += 1
+            return None
+
+    def tallenna(self, malli: str, teksti: str, vektori: np.ndarray):
+        avain = laske_tiiviste(malli, teksti)
+        vektori = np.ascontiguousarray(vektori, dtype=np.float32).ravel()
+        siivotaan = False
+        with self._lukko:
+            self._lisaa_muistiin(avain, vektori)
+            if self._yhteys is not None:
+                self._kaytetyt.pop(avain, None)
+                self._kirjaa_kayttoajat()
+                self._yhteys.execute("INSERT OR REPLACE INTO vektorit VALUES (?, ?, ?)",
+                                     (avain, vektori.tobytes(), time.time()))
+                self._yhteys.commit()
+                self.tallennukset += 1
+                siivotaan = self.tallennukset % self.SIIVOUSVALI == 0
+        if siivotaan:
+            self.siivoa()
+
+    def _kirjaa_kayttoajat(self):
+        """Kirjoittaa kerätyt levyosumien käyttöajat tauluun (ilman commitia); kutsutaan lukko hallussa."""
+        if self._kaytetyt:
+            self._yhteys.executemany("UPDATE vektorit SET kaytetty = ? WHERE avain = ?",
+                                     [(kaytetty, avain) for avain, kaytetty in self._kaytetyt.items()])
+            self._kaytetyt.clear()
+
+    def siivoa(self):
+        """Pitää levyvälimuistin koon rajoissa poistamalla pisimpään käyttämättömät vektorit."""
+        if self._yhteys is None:
+            return
+        with self._lukko:
+            self._kirjaa_kayttoajat()
+            poistettu = 0
+            ylimaara = self._yhteys.execute("SELECT COUNT(*) FROM vektorit").fetchone()[0] - self.levyn_maksimikoko
+            if ylimaara > 0:
+                poistettu = self._yhteys.execute(
+                    "DELETE FROM vektorit WHERE avain IN "
+                    "(SELECT avain FROM vektorit ORDER BY kaytetty LIMIT ?)", (ylimaara,)
+                ).rowcount
+            self._yhteys.commit()
+            self.poistot += poistettu
+        if poistettu:
+            logging.info(f"Kyselyvektorivälimuisti: poistettiin {poistettu} vanhaa vektoria levyltä.")
+
+    def _lisaa_muistiin(self, avain: str, vektori: np.ndarray):
+        self._muisti[avain] = vektori
+        self._muisti.move_to_end(avain)
+        while len(self._muisti) > self.maksimikoko:
+            self._muisti.popitem(last=False)
+
+    def tilastot(self) -> dict:
+        haut = self.osumat + self.levyosumat + self.ohitukset
+        return {
+            "osumat": self.osumat,
+            "levyosumat": self.levyosumat,
+            "ohitukset": self.ohitukset,
+            "osumaprosentti": 100.0 * (self.osumat + self.levyosumat) / haut if haut else 0.0,
+            "koko": len(self._muisti),
+            "poistot": self.poistot,
+        }
+
+
+class PisteValimuisti:
+    """Cross-encoderin (kysely, jae) -parien pisteiden LRU-välimuisti muistissa.
+
+    Avain on mallin ja kyselyn tiiviste sekä jakeen viite, joten sama laajennettu kysely
+    pisteytetään vain kerran, vaikka se haettaisiin uudelleen eri vaiheissa.
+    """
+
+    def __init__(self, maksimikoko: int = 50_000):
+        self.maksimikoko = maksimikoko
+        self.osumat = 0
+        self.ohitukset = 0
+        self._muisti = OrderedDict()
+        self._lukko = threading.Lock()
+
+    def hae_monta(self, malli: str, kysely: str, viitteet: list[str]) -> list[float | None]:
+        kyselyn_tiiviste = laske_tiiviste(malli, kysely)
+        tulokset = []
+        with self._lukko:
+            for viite in viitteet:
+                avain = (kyselyn_tiiviste, viite)
+                pisteet = self._muisti.get(avain)
+                if pisteet is None:
+                    self.ohitukset += 1
+                else:
+                    self._muisti.move_to_end(avain)
+                    self.osumat += 1
+                tulokset.append(pisteet)
+        return tulokset
+
+    def tallenna_monta(self, malli: str, kysely: str, viitteet: list[str], pisteet):
+        kyselyn_tiiviste = laske_tiiviste(malli, kysely)
+        with self._lukko:
+            for viite, piste in zip(viitteet, pisteet):
+                self._muisti[(kyselyn_tiiviste, viite)] = float(piste)
+                self._muisti.move_to_end((kyselyn_tiiviste, viite))
+            while len(self._muisti) > self.maksimikoko:
+                self._muisti.popitem(last=False)
+
+    def tilastot(self) -> dict:
+        haut = self.osumat + self.ohitukset
+        return {
+            "osumat": self.osumat,
+            "ohitukset": self.ohitukset,
+            "osumaprosentti": 100.0 * self.osumat / haut if haut else 0.0,
+            "koko": len(self._muisti),
+        }
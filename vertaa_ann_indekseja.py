@@ -0,0 +1,84 @@
+# vertaa_ann_indekseja.py (Versio 1.1 - IndexIDMap2-indeksit)
+import logging
+import os
+import time
+
+import faiss
+import numpy as np
+
+from indeksityokalut import lue_vektorit_ja_tunnisteet, sisainen_indeksi
+
+# --- MÄÄRITYKSET ---
+TASAINEN_INDEKSI_TIEDOSTO = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large.faiss"
+ANN_INDEKSI_TIEDOSTOPOHJA = "D:/Python_AI/Raamattu-tutkija-data/raamattu_indeksi_e5_large_{tyyppi}.faiss"
+VERRATTAVAT_TYYPIT = ["hnsw", "ivfpq"]
+K_ARVOT = [15, 75, 250, 1000]  # Tyypillisiä haettava_maara-arvoja
+KYSELYJEN_MAARA = 200
+HNSW_EF_SEARCH_ARVOT = [64, 256]
+IVFPQ_NPROBE_ARVOT = [16, 64]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+
+def mittaa_haku(indeksi, kyselyt: np.ndarray, k: int) -> tuple[np.ndarray, float]:
+    """Hakee kyselyt yksitellen (kuten sovellus) ja palauttaa tulokset sekä keskimääräisen viiveen (ms)."""
+    tulokset = np.empty((len(kyselyt), k), dtype=np.int64)
+    alku = time.perf_counter()
+    for i in range(len(kyselyt)):
+        _, indeksit = indeksi.search(kyselyt[i:i + 1], k)
+        tulokset[i] = indeksit[0]
+    return tulokset, (time.perf_counter() - alku) * 1000 / len(kyselyt)
+
+
+def laske_recall(oikeat: np.ndarray, loydetyt: np.ndarray) -> float:
+    osumat = sum(len(set(o) & set(l)) for o, l in zip(oikeat, loydetyt))
+    return osumat / oikeat.size
+
+
+def aseta_hakuparametri(indeksi, tyyppi: str, arvo: int) -> str:
+    if tyyppi == "hnsw":
+        sisainen_indeksi(indeksi).hnsw.efSearch = arvo
+        return f"efSearch={arvo}"
+    faiss.extract_index_ivf(indeksi).nprobe = arvo
+    return f"nprobe={arvo}"
+
+
+def vertaa_indekseja():
+    """Vertaa likimääräisiä indeksejä tasaiseen indeksiin: recall@k ja viive per kysely."""
+    tasainen = faiss.read_index(TASAINEN_INDEKSI_TIEDOSTO)
+    logging.info(f"Tasainen indeksi: {tasainen.ntotal} vektoria, ulottuvuus {tasainen.d}.")
+
+    # Kyselyinä käytetään satunnaisia indeksin vektoreita, joihin on lisätty pieni häiriö
+    satunnainen = np.random.default_rng(42)
+    vektorit, _ = lue_vektorit_ja_tunnisteet(tasainen)
+    rivit = satunnainen.choice(len(vektorit), size=min(KYSELYJEN_MAARA, len(vektorit)), replace=False)
+    kyselyt = vektorit[rivit].astype(np.float32)
+    kyselyt += satunnainen.normal(0, 0.01, kyselyt.shape).astype(np.float32)
+    k_arvot = [k for k in K_ARVOT if k <= tasainen.ntotal]
+
+    oikeat = {}
+    for k in k_arvot:
+        oikeat[k], viive = mittaa_haku(tasainen, kyselyt, k)
+        logging.info(f"flat            k={k:<5} recall=1.000  viive {viive:7.2f} ms/kysely")
+
+    for tyyppi in VERRATTAVAT_TYYPIT:
+        tiedosto = ANN_INDEKSI_TIEDOSTOPOHJA.format(tyyppi=tyyppi)
+        if not os.path.exists(tiedosto):
+            logging.warning(f"{tyyppi}-indeksiä ei löytynyt ('{tiedosto}'). Ohitetaan.")
+            continue
+        indeksi = faiss.read_index(tiedosto)
+        parametrit = HNSW_EF_SEARCH_ARVOT if tyyppi == "hnsw" else IVFPQ_NPROBE_ARVOT
+        for arvo in parametrit:
+            kuvaus = aseta_hakuparametri(indeksi, tyyppi, arvo)
+            for k in k_arvot:
+                loydetyt, viive = mittaa_haku(indeksi, kyselyt, k)
+                recall = laske_recall(oikeat[k], loydetyt)
+                logging.info(f"{tyyppi:<5} {kuvaus:<12} k={k:<5} recall={recall:.3f}  viive {viive:7.2f} ms/kysely")
+
+
+if __name__ == "__main__":
+    vertaa_indekseja()